@@ -95,7 +95,7 @@ with wave.open(output_filename, 'wb') as output_file:
 
     i = 0
     # recorded_samples = np.array([], dtype=np.int16)
-    recorded_samples = np.array([], dtype=np.uint16) # test to work on uint16 since ADC output is use 0 as base
+    recorded_chunks = [] # one array per read, joined once at the end (concatenating on every read copies everything so far)
 
 
     exit_while = False
@@ -110,9 +110,9 @@ with wave.open(output_filename, 'wb') as output_file:
             print(num_samples)
             # ReadInSample = struct.unpack('<' + 'h' * num_samples, ReadInData)
             # print(np_data)
-            recorded_samples = np.concatenate((recorded_samples, np_data))
+            recorded_chunks.append(np_data)
 
-            num =len(recorded_samples)
+            num += len(np_data)
             # print(num)
             # print("YEAHHHHHH")
         except:
@@ -121,6 +121,7 @@ with wave.open(output_filename, 'wb') as output_file:
     
     
     dev.write(ep_out, 'e') # send a signal to ADC so it will stop timer and reset itself
+    recorded_samples = np.concatenate(recorded_chunks) if recorded_chunks else np.array([], dtype=np.uint16) # uint16 since ADC output is use 0 as base
     
     output_file.writeframes(np.array(recorded_samples, dtype=np.uint16).tobytes()) 
     print("ADC recording completed. Saved as output.wav.")
@@ -11,6 +11,8 @@ import struct
 
 import serial
 
+from usb_buffers import readView
+
 # ser = serial.Serial("COM8")
 
 #  explicitly set backend
@@ -94,25 +96,22 @@ with wave.open(output_filename, 'wb') as output_file:
     output_file.setframerate(frame_rate)
 
     i = 0
+    NUM_SAMPLES = 5000
     # recorded_samples = np.array([], dtype=np.int16)
-    recorded_samples = np.array([], dtype=np.uint16) # test to work on uint16 since ADC output is use 0 as base
+    # allocated once, every read lands directly behind the previous one (np.concatenate copied everything each time)
+    recorded_samples = np.empty(NUM_SAMPLES + HLAF_MAX_BUFFER_SIZE//2, dtype='>u2') # > large-endian, u2: unint16, ADC output is use 0 as base
+    recorded_bytes = memoryview(recorded_samples.view(np.uint8))
 
 
     exit_while = False
     num = 0
-    while num <= 5000:
+    while num <= NUM_SAMPLES:
         try:
             # Poll for data with a short timeout
-            ReadInData = dev.read(ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
-            # print(ReadInData)
-            np_data = np.frombuffer(ReadInData, dtype='>u2') # > large-endian, u2: unint16
-            num_samples = len(ReadInData)   #sometime it will read 512, sometime it will read 1024 bytes
-            print(num_samples)
+            num_samples = readView(dev, ep_in, recorded_bytes[2*num:2*num + HLAF_MAX_BUFFER_SIZE], timeout=10)
+            print(num_samples)   #sometime it will read 512, sometime it will read 1024 bytes
             # ReadInSample = struct.unpack('<' + 'h' * num_samples, ReadInData)
-            # print(np_data)
-            recorded_samples = np.concatenate((recorded_samples, np_data))
-
-            num =len(recorded_samples)
+            num += num_samples // 2
             # print(num)
             # print("YEAHHHHHH")
         except:
@@ -122,7 +121,7 @@ with wave.open(output_filename, 'wb') as output_file:
     
     dev.write(ep_out, 'e') # send a signal to ADC so it will stop timer and reset itself
     
-    output_file.writeframes(np.array(recorded_samples, dtype=np.uint16).tobytes()) 
+    output_file.writeframes(recorded_samples[:num].astype(np.uint16).tobytes()) 
     print("ADC recording completed. Saved as output.wav.")
 
 # clean all buffer
@@ -48,6 +48,51 @@ volatile int totalSend = 0;
 
 int coming_size; // coming size from PC, initilze here
 
+// ================= packed sample format ===========
+// PC sends 8 bytes (sampling rate + sample bits) instead of 4 to ask for packed samples:
+// only the top sampleBits bits of every ADC word are sent, MSB first as one continuous bit stream
+// (12 bits: 2 samples in 3 bytes). ACK is 'P' when packing is on, '1' for plain 16-bit samples.
+volatile int sampleBits = 16;
+uint32_t packAcc = 0;   // bits not written to byte_buffer yet, in the low packBits bits
+int packBits = 0;
+
+// ================= delta compressed format ===========
+// PC sends DELTA_FORMAT instead of the sample bits to ask for compressed packets (ACK 'D').
+// Samples are still stored as 16-bit words, the loop compresses them while sending: blocks of
+// DELTA_BLOCK samples, first sample + zigzag coded differences with the bits the largest one needs.
+// Every 512 byte packet holds whole blocks (layout in delta_format.py):
+//   [n blocks][samples in last block][n widths][n first samples, big-endian][differences per block, byte aligned][zeros]
+#define DELTA_FORMAT 256
+#define DELTA_BLOCK 16
+#define DELTA_MAX_BLOCKS ((PACKET_SIZE - 2) / 3)
+volatile bool compressMode = false;
+int nextCompress = 0;  // index in byte_buffer of the next sample to compress
+uint8_t packetWidths[DELTA_MAX_BLOCKS];
+uint16_t packetFirsts[DELTA_MAX_BLOCKS];
+uint8_t packetPayload[PACKET_SIZE];
+int packetBlocks = 0;
+int packetPayloadSize = 0;
+int packetLastCount = DELTA_BLOCK;
+
+// ================= framed format ===========
+// PC sends FRAMED_FORMAT instead of the sample bits to ask for framed packets (ACK 'F').
+// byte_buffer is a ring of PACKET_SIZE slots, the timer fills them with 16-bit samples after a header
+// (layout in framed_format.py):
+//   [sequence number, 2 bytes][index of the first sample, 4 bytes][number of samples, 2 bytes][samples, big-endian]
+// When all slots are waiting to be sent a sample is dropped, but sampleIndex still counts it,
+// so PC sees the jump in the next header. The sequence number is set when the slot is sent.
+#define FRAMED_FORMAT 257
+#define FRAME_HEADER 8
+#define FRAME_SAMPLES ((PACKET_SIZE - FRAME_HEADER) / 2)
+volatile bool framedMode = false;
+volatile uint32_t sampleIndex = 0; // samples taken since the timer started, dropped ones included
+volatile int frameFill = 0;   // samples in the slot being filled
+volatile int framePut = 0;    // slot being filled
+volatile int framesReady = 0; // full slots waiting to be sent
+int frameSend = 0;            // next slot to send
+int frameSlots = 2;
+uint16_t frameSequence = 0;
+
 // =============== Test LED def ===========
 #define LED 2
 #define LED2 3
@@ -91,15 +136,35 @@ void setup() {
 
 void loop() {
   if (sendSample == false && timerStart == false){
-    // to revieve sampling rate from PC
-    if (usb_serial_available() == 4){
-      uint8_t byte1, byte2, byte3, byte4;
-      usb_serial_read(&byte1, 1);
-      usb_serial_read(&byte2, 1);
-      usb_serial_read(&byte3, 1);
-      usb_serial_read(&byte4, 1);
-
-      uint32_t sampleRate = (uint32_t) byte1 | (uint32_t) byte2 <<8 | (uint32_t) byte3 <<16 | (uint32_t) byte4 <<24;
+    // to revieve sampling rate (+ sample bits) from PC
+    int headerSize = usb_serial_available();
+    if (headerSize == 4 || headerSize == 8){
+      uint8_t header[8];
+      usb_serial_read(header, headerSize);
+
+      uint32_t sampleRate = (uint32_t) header[0] | (uint32_t) header[1] <<8 | (uint32_t) header[2] <<16 | (uint32_t) header[3] <<24;
+
+      sampleBits = 16;
+      compressMode = false;
+      framedMode = false;
+      if (headerSize == 8){
+        uint32_t bits = (uint32_t) header[4] | (uint32_t) header[5] <<8 | (uint32_t) header[6] <<16 | (uint32_t) header[7] <<24;
+        if (bits >= 8 && bits < 16){
+          sampleBits = bits;
+        }
+        else if (bits == DELTA_FORMAT){
+          compressMode = true;
+        }
+        else if (bits == FRAMED_FORMAT){
+          framedMode = true;
+        }
+      }
+      packAcc = 0;
+      packBits = 0;
+      nextCompress = 0;
+      packetBlocks = 0;
+      packetPayloadSize = 0;
+      packetLastCount = DELTA_BLOCK;
 
       // setup timer based on sampling rate
       samplingRate = (float)sampleRate;
@@ -125,10 +190,18 @@ void loop() {
       // MAX_BUFFER_SIZE = SUPER_MAX_BUFFER_SIZE;
 
       HALF_MAX_BUFFER_SIZE = MAX_BUFFER_SIZE/2;
-
-      uint8_t ACK = '1'; //notify Python it is ready
+      frameSlots = MAX_BUFFER_SIZE / PACKET_SIZE;
+      sampleIndex = 0;
+      frameFill = 0;
+      framePut = 0;
+      framesReady = 0;
+      frameSend = 0;
+      frameSequence = 0;
+
+      uint8_t ACK = compressMode ? 'D' : framedMode ? 'F' : (sampleBits == 16) ? '1' : 'P'; //notify Python it is ready (and whether samples are packed/compressed/framed)
       usb_serial_write(&ACK, 1); 
-      HWSERIAL.println("Send ACK");
+      HWSERIAL.println("Send ACK, sample bits:");
+      HWSERIAL.println(sampleBits);
 
       sendSample = false; // initally, no samples will be sent to PC.
       timerStart = true;
@@ -163,11 +236,19 @@ void loop() {
       // if we receive PC's notification,
       //  we can stop ADC reading + we send what we have to PC
       timer.end();
-      while (nextSend < buffer_size-512){
-        usb_serial_write(byte_buffer+nextSend, 512);
-        nextSend = (nextSend +512) % MAX_BUFFER_SIZE;
+      if (compressMode == true){
+        compressFlush();
+      }
+      else if (framedMode == true){
+        framedFlush();
+      }
+      else{
+        while (nextSend < buffer_size-512){
+          usb_serial_write(byte_buffer+nextSend, 512);
+          nextSend = (nextSend +512) % MAX_BUFFER_SIZE;
+        }
+        usb_serial_write(byte_buffer+nextSend, buffer_size-nextSend+1);
       }
-      usb_serial_write(byte_buffer+nextSend, buffer_size-nextSend+1);
        
 
       sendSample = false;
@@ -181,7 +262,13 @@ void loop() {
 
   }else if(sendSample == true && timerStart == true){
     // we need to send data 512 bytes each time
-    if(nextSend == 0 && nextPut >= HALF_MAX_BUFFER_SIZE){
+    if (compressMode == true){
+      compressService();
+    }
+    else if (framedMode == true){
+      framedService();
+    }
+    else if(nextSend == 0 && nextPut >= HALF_MAX_BUFFER_SIZE){
       while(nextSend != HALF_MAX_BUFFER_SIZE){
         // to receive "STOP" signal from PC
         if (usb_serial_available() > 0){
@@ -257,11 +344,233 @@ void ADC_callback(){
   // Serial.println(lowByte);
   // HWSERIAL.println(ReadData);
   //put in the array
-  byte_buffer[nextPut] = lowByte;
-  byte_buffer[nextPut] = highByte;
-  nextPut = (nextPut +2) % MAX_BUFFER_SIZE;
+  if (framedMode == true){
+    framedPut(highByte, lowByte);
+  }
+  else if (sampleBits == 16){
+    byte_buffer[nextPut] = highByte; // PC reads big-endian words
+    byte_buffer[nextPut +1] = lowByte;
+    nextPut = (nextPut +2) % MAX_BUFFER_SIZE;
 
-  buffer_size += 2;
+    buffer_size += 2;
+  }
+  else{
+    // append the top sampleBits bits to the bit stream and move every complete byte to the buffer
+    uint16_t value = (uint16_t) highByte <<8 | lowByte;
+    packAcc = (packAcc << sampleBits) | (value >> (16 - sampleBits));
+    packBits += sampleBits;
+    while (packBits >= 8){
+      packBits -= 8;
+      byte_buffer[nextPut] = (uint8_t)(packAcc >> packBits);
+      nextPut = (nextPut +1) % MAX_BUFFER_SIZE;
+      buffer_size += 1;
+    }
+  }
   // HWSERIAL.println(buffer_size);
 
 }
+
+// ================= delta compression =================
+void compressService(){
+  // to receive "STOP" signal from PC
+  if (usb_serial_available() > 0){
+    char dummy_signal;
+    usb_serial_read(&dummy_signal, usb_serial_available());
+    HWSERIAL.print("dummy signal = ");
+    HWSERIAL.println(dummy_signal);
+
+    digitalWrite(LED, LOW);
+    // if we receive PC's notification, we can stop ADC reading and send what is left
+    timer.end();
+    compressFlush();
+
+    sendSample = false;
+    timerStart = false;
+
+    nextPut = 0; //the index of the next ADC value
+    nextSend = 0; // the index of the next bunch of data MCU will send to PC
+    buffer_size = 0;
+    return;
+  }
+
+  while (compressAvailable() >= DELTA_BLOCK){
+    compressBlock(DELTA_BLOCK);
+  }
+}
+
+void compressFlush(){
+  int count = compressAvailable();
+  while (count > 0){
+    compressBlock(min(count, DELTA_BLOCK));
+    count = compressAvailable();
+  }
+  sendDeltaPacket();
+}
+
+int compressAvailable(){
+  noInterrupts();
+  int put = nextPut;
+  interrupts();
+  return ((put - nextCompress + MAX_BUFFER_SIZE) % MAX_BUFFER_SIZE) / 2;
+}
+
+uint16_t compressSample(int i){
+  // i-th sample from nextCompress, stored big-endian by ADC_callback
+  int index = (nextCompress + 2*i) % MAX_BUFFER_SIZE;
+  return (uint16_t) byte_buffer[index] <<8 | byte_buffer[index +1];
+}
+
+void compressBlock(int count){
+  // zigzag coded differences and the number of bits the largest one needs
+  uint16_t zigzag[DELTA_BLOCK];
+  uint16_t first = compressSample(0);
+  uint16_t previous = first;
+  uint16_t all = 0;
+  for (int j = 1; j < count; j++){
+    uint16_t value = compressSample(j);
+    int16_t delta = (int16_t)(value - previous);
+    zigzag[j-1] = (uint16_t)((delta << 1) ^ (delta >> 15));
+    all |= zigzag[j-1];
+    previous = value;
+  }
+  int width = 0;
+  while (width < 16 && (all >> width) != 0){
+    width++;
+  }
+  int payloadSize = ((count - 1) * width + 7) / 8;
+
+  // send the packet first if this block does not fit anymore
+  if (2 + 3 * (packetBlocks + 1) + packetPayloadSize + payloadSize > PACKET_SIZE){
+    sendDeltaPacket();
+  }
+
+  packetWidths[packetBlocks] = width;
+  packetFirsts[packetBlocks] = first;
+  packetBlocks++;
+  packetLastCount = count;
+
+  uint8_t *out = packetPayload + packetPayloadSize;
+  uint32_t acc = 0;
+  int accBits = 0;
+  for (int j = 0; j < count - 1; j++){
+    acc = (acc << width) | zigzag[j];
+    accBits += width;
+    while (accBits >= 8){
+      accBits -= 8;
+      *out++ = (uint8_t)(acc >> accBits);
+    }
+  }
+  if (accBits > 0){
+    *out++ = (uint8_t)(acc << (8 - accBits));
+  }
+  packetPayloadSize += payloadSize;
+  nextCompress = (nextCompress + 2 * count) % MAX_BUFFER_SIZE;
+}
+
+void sendDeltaPacket(){
+  if (packetBlocks == 0){
+    return;
+  }
+  uint8_t packet[PACKET_SIZE];
+  memset(packet, 0, PACKET_SIZE);
+  packet[0] = packetBlocks;
+  packet[1] = packetLastCount;
+  int pos = 2;
+  for (int b = 0; b < packetBlocks; b++){
+    packet[pos++] = packetWidths[b];
+  }
+  for (int b = 0; b < packetBlocks; b++){
+    packet[pos++] = packetFirsts[b] >> 8;
+    packet[pos++] = packetFirsts[b] & 0xFF;
+  }
+  memcpy(packet + pos, packetPayload, packetPayloadSize);
+  usb_serial_write(packet, PACKET_SIZE);
+
+  packetBlocks = 0;
+  packetPayloadSize = 0;
+  packetLastCount = DELTA_BLOCK;
+}
+
+// ================= framed packets =================
+void framedPut(uint8_t highByte, uint8_t lowByte){
+  // called by ADC_callback
+  uint8_t *slot = byte_buffer + framePut * PACKET_SIZE;
+  if (frameFill == 0){
+    if (framesReady == frameSlots){
+      sampleIndex++; // no free slot: drop the sample, the next header shows the gap
+      return;
+    }
+    slot[2] = sampleIndex >> 24;
+    slot[3] = sampleIndex >> 16;
+    slot[4] = sampleIndex >> 8;
+    slot[5] = sampleIndex;
+    slot[6] = FRAME_SAMPLES >> 8;
+    slot[7] = FRAME_SAMPLES & 0xFF;
+  }
+  slot[FRAME_HEADER + 2 * frameFill] = highByte; // PC reads big-endian words
+  slot[FRAME_HEADER + 2 * frameFill + 1] = lowByte;
+  frameFill++;
+  sampleIndex++;
+  buffer_size += 2;
+  if (frameFill == FRAME_SAMPLES){
+    frameFill = 0;
+    framePut = (framePut + 1) % frameSlots;
+    framesReady++;
+  }
+}
+
+void framedService(){
+  // to receive "STOP" signal from PC
+  if (usb_serial_available() > 0){
+    char dummy_signal;
+    usb_serial_read(&dummy_signal, usb_serial_available());
+    HWSERIAL.print("dummy signal = ");
+    HWSERIAL.println(dummy_signal);
+
+    digitalWrite(LED, LOW);
+    // if we receive PC's notification, we can stop ADC reading and send what is left
+    timer.end();
+    framedFlush();
+
+    sendSample = false;
+    timerStart = false;
+
+    nextPut = 0; //the index of the next ADC value
+    nextSend = 0; // the index of the next bunch of data MCU will send to PC
+    buffer_size = 0;
+    return;
+  }
+
+  while (framesReady > 0){
+    sendFrame(FRAME_SAMPLES);
+  }
+}
+
+void framedFlush(){
+  // the timer is stopped: send the full slots, then the one being filled
+  while (framesReady > 0){
+    sendFrame(FRAME_SAMPLES);
+  }
+  if (frameFill > 0){
+    uint8_t *slot = byte_buffer + frameSend * PACKET_SIZE;
+    slot[6] = frameFill >> 8;
+    slot[7] = frameFill & 0xFF;
+    memset(slot + FRAME_HEADER + 2 * frameFill, 0, 2 * (FRAME_SAMPLES - frameFill));
+    sendFrame(frameFill);
+    frameFill = 0;
+  }
+}
+
+void sendFrame(int count){
+  uint8_t *slot = byte_buffer + frameSend * PACKET_SIZE;
+  slot[0] = frameSequence >> 8;
+  slot[1] = frameSequence & 0xFF;
+  usb_serial_write(slot, PACKET_SIZE);
+  frameSequence++;
+  frameSend = (frameSend + 1) % frameSlots;
+  if (count == FRAME_SAMPLES){
+    noInterrupts();
+    framesReady--; // the timer may fill this slot again
+    interrupts();
+  }
+}
@@ -1,7 +1,21 @@
+'''
+Play a stimulus on the DAC Teensy and record the ADC Teensy at the same time (loopback rig).
+
+runDAC sends the samples, runADC records into a WAV file, each in its own thread; main() runs both.
+The settings below pick the USB protocol. Everything beyond the original one is negotiated by the
+header PC sends first and needs the firmware of this folder flashed on the boards:
+  usb_serial_try.ino    DAC credit mode (DAC_CREDIT_WINDOW > 0), packed DAC samples, and the underrun
+                        count after 'E' ('E' + 4 bytes; the original firmware sends a single 'E',
+                        which is still understood). The original firmware never answers a credit
+                        header, so the default is the handshake mode it has always spoken.
+  ADC_usb_serial.ino    packed (ADC_SAMPLE_BITS < 16), delta compressed (ADC_COMPRESSION) and
+                        framed (ADC_FRAMED) ADC streams; the defaults are plain 16-bit samples.
+'''
 import usb.core
 import usb.util
 from usb.backend import libusb1
 
+import json
 import wave
 import numpy as np
 import struct
@@ -13,6 +27,17 @@ import time
 from queue import Queue 
 import threading 
 
+from adc_async_capture import AsyncBulkReader
+from adc_recorder import WavRecorder
+from adc_ring import SampleRing
+from dac_source import BlockStreamSource, MappedWavSource, wav_blocks
+from delta_format import DELTA_FORMAT, DeltaDecoder
+from framed_format import FRAMED_FORMAT, FramedDecoder
+from sample_format import SAMPLE_BITS, PackedDecoder
+from skew_monitor import SkewMonitor
+from telemetry import RunTelemetry
+from usb_buffers import readView, writeView
+
 
 # =============================================
 # ========== Constant setting
@@ -22,6 +47,45 @@ MAX_BUFFER_SIZE = 81920  #ADC buffer size
 HLAF_MAX_BUFFER_SIZE = MAX_BUFFER_SIZE//2 # ADC half buffer size
 PACKET_SIZE = 512 # the size for one-time send and receive, # of bytes 
 
+# DAC flow control: number of packets the MCU may grant at a time (credit mode, max 255, e.g. 16),
+# 0 uses the original one 'S' per packet handshake. Credit mode needs the current usb_serial_try.ino
+DAC_CREDIT_WINDOW = 0
+
+# ADC capture: number of bulk IN transfers kept queued (asynchronous libusb API),
+# 0 reads with one synchronous dev.read at a time
+ADC_ASYNC_TRANSFERS = 8
+
+# ADC capture buffer: slots of HLAF_MAX_BUFFER_SIZE bytes allocated once (adc_ring.py), reads land directly in them
+ADC_RING_SLOTS = 32
+
+# Sample bits on the USB link (sample_format.py): 16 sends plain 16-bit words,
+# 12 or 14 packs only the top bits (12 bits: 25% less traffic). The DAC packs only in credit mode.
+ADC_SAMPLE_BITS = 16
+DAC_SAMPLE_BITS = 16
+
+# ADC delta compression (delta_format.py), lossless, takes precedence over ADC_SAMPLE_BITS
+ADC_COMPRESSION = False
+
+# ADC packets with a sequence number and sample counter (framed_format.py), so dropouts are detected and
+# saved as output_filename + GAPS_SUFFIX. Used unless ADC_COMPRESSION is on, always 16-bit samples
+ADC_FRAMED = False
+GAPS_SUFFIX = ".gaps.json"
+
+# Read the ADC in a process of its own (process_mode.py), so other threads cannot hold it up through the GIL
+ADC_PROCESS_MODE = False
+
+# Track the clock skew during the capture (skew_monitor.py): nominal frequency (Hz) of the test tone, None is off.
+# With ADC_SKEW_LIMIT_PPM the capture stops once the skew is clearly beyond it
+ADC_SKEW_MONITOR = None
+ADC_SKEW_LIMIT_PPM = None
+
+# Live oscilloscope view while recording (live_scope.py): seconds across the screen, None is off
+ADC_LIVE_SCOPE = None
+
+# Per-packet timings of the run (telemetry.py), saved as output_filename + TELEMETRY_SUFFIX, cheap enough to stay on
+TELEMETRY = True
+TELEMETRY_SUFFIX = ".telemetry.json"
+
 # Threading parameters
 DAC_finished = False  
 ADC_ready = False
@@ -39,67 +103,56 @@ output_filename = "output.wav"
 # =============================================
 # ========= Get DAC, ADC device
 # =============================================
-def getDevices():
-    #  explicitly set backend
-    backend = libusb1.get_backend(find_library=lambda x: "libusb-1.0.dll")
-
-    # ----- DAC device setup
-    DAC_dev = usb.core.find(idVendor=0x16C0, idProduct=0x048B)
-    if DAC_dev is None:
-        raise ValueError('DAC_device not found')
+# Since we use USB Serial, based on usb_desc.h
+VENDOR_ID = 0x16C0
+DAC_PRODUCT_ID = 0x048B
+ADC_PRODUCT_ID = 0x0483
+DAC_EP_IN = 0x83
+ADC_EP_IN = 0x84
+EP_OUT = 0x03
 
-    DAC_dev.set_configuration()
-    DAC_cfg = DAC_dev.get_active_configuration()
-    DAC_intf = DAC_cfg[(1,0)]  # use the first interface for bulk endpoint
 
-    # print(DAC_dev)
+def getEndpoints(dev, name, ep_in_address, ep_out_address=EP_OUT):
+    '''Configure a board and return its bulk [ep_in, ep_out], name is 'DAC' or 'ADC' for the printout.'''
+    dev.set_configuration()
+    cfg = dev.get_active_configuration()
+    intf = cfg[(1,0)]  # use the first interface for bulk endpoint
 
-    DAC_ep_out = None
-    DAC_ep_in = None
+    ep_out = None
+    ep_in = None
 
-    for ep in DAC_intf:
+    for ep in intf:
 
         if usb.util.endpoint_direction(ep.bEndpointAddress) == usb.util.ENDPOINT_OUT:
-            if ep.bEndpointAddress == 0x03:  #
-                DAC_ep_out = ep
-            print("DAC_ep_out", ep.bEndpointAddress)
+            if ep.bEndpointAddress == ep_out_address:  #
+                ep_out = ep
+            print(name + "_ep_out", ep.bEndpointAddress)
 
         # Check for Endpoint 4 (TX)
         elif usb.util.endpoint_direction(ep.bEndpointAddress) == usb.util.ENDPOINT_IN:
-            if ep.bEndpointAddress == 0x83: 
-                DAC_ep_in = ep
-
-            print("DAC_ep_in", ep.bEndpointAddress)
-
-
-    # ------- ADC device setup
-    ADC_dev = usb.core.find(idVendor=0x16C0, idProduct=0x0483)
-    if ADC_dev is None:
-        raise ValueError('ADC_device not found')
-    # print(ADC_dev)
+            if ep.bEndpointAddress == ep_in_address: 
+                ep_in = ep
 
-    ADC_dev.set_configuration()
-    ADC_cfg = ADC_dev.get_active_configuration()
-    ADC_intf = ADC_cfg[(1,0)]  # use the first interface for bulk endpoint
+            print(name + "_ep_in", ep.bEndpointAddress)
 
-    # print(ADC_dev)
+    return [ep_in, ep_out]
 
-    ADC_ep_out = None
-    ADC_ep_in = None
 
-    for ep in ADC_intf:
-
-        if usb.util.endpoint_direction(ep.bEndpointAddress) == usb.util.ENDPOINT_OUT:
-            if ep.bEndpointAddress == 0x03:  #
-                ADC_ep_out = ep
-            print("ADC_ep_out", ep.bEndpointAddress)
+def getDevices():
+    #  explicitly set backend
+    backend = libusb1.get_backend(find_library=lambda x: "libusb-1.0.dll")
 
-        # Check for Endpoint 4 (TX)
-        elif usb.util.endpoint_direction(ep.bEndpointAddress) == usb.util.ENDPOINT_IN:
-            if ep.bEndpointAddress == 0x84: 
-                ADC_ep_in = ep
+    # ----- DAC device setup
+    DAC_dev = usb.core.find(idVendor=VENDOR_ID, idProduct=DAC_PRODUCT_ID)
+    if DAC_dev is None:
+        raise ValueError('DAC_device not found')
+    DAC_ep_in, DAC_ep_out = getEndpoints(DAC_dev, "DAC", DAC_EP_IN)
 
-            print("ADC_ep_in", ep.bEndpointAddress)
+    # ------- ADC device setup
+    ADC_dev = usb.core.find(idVendor=VENDOR_ID, idProduct=ADC_PRODUCT_ID)
+    if ADC_dev is None:
+        raise ValueError('ADC_device not found')
+    ADC_ep_in, ADC_ep_out = getEndpoints(ADC_dev, "ADC", ADC_EP_IN)
 
     return [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out]
 
@@ -109,48 +162,14 @@ def getDevices():
 
 
 # =============================================
-# ========= DAC Thread Function
+# ========= DAC send loops
 # =============================================
-def runDAC(DAC_dev, DAC_ep_in, DAC_ep_out):
-    global ADC_ready, DAC_finished, input_filename
-
-    # ----------------------------
-    # ----- Process input file ---
-    # ----------------------------
-    with wave.open(input_filename, "rb") as wav:
-        num_channels = wav.getnchannels()
-        sample_width = wav.getsampwidth()
-        frame_rate = wav.getframerate()
-        num_frames = wav.getnframes() # get number of samples
-
-        raw_data = wav.readframes(num_frames) # get all samples in bytes object, little-endian so low-byte then high-byte
-
-    # make sure there are tiles
-    if len(raw_data) % PACKET_SIZE == 0:
-        raw_data += b'\x00\x00'
-    raw_data_length = len(raw_data)
-
-    print("[DAC] Total number of bytes: ",raw_data_length)
-
-    # change the format of sampling rate
-    bytes_rate = frame_rate.to_bytes(4, byteorder='little')
-
-
-    # ----------------------------
-    # --- wait for ADC to be ready
-    # ----------------------------
-    print("[DAC] Waiting for ADC to be ready...")
-    ADC_ready.wait()
-    print("[DAC] ADC is ready, start DAC now...")
-
-    # ----------------------------
-    # ---- Start working ---------
-    # ----------------------------
-
-    # 1. send sampling rate
-    DAC_dev.write(DAC_ep_out, bytes_rate)
-
-    # 2. send samples
+def sendSamplesHandshake(DAC_dev, DAC_ep_in, DAC_ep_out, source, telemetry=None):
+    '''
+    Original flow control: the MCU sends one 'S' for every packet it wants,
+    so throughput is one PACKET_SIZE chunk per USB round trip.
+    '''
+    clock = time.perf_counter_ns
     send_index = 0
 
     exit_while = False
@@ -163,132 +182,434 @@ def runDAC(DAC_dev, DAC_ep_in, DAC_ep_out):
 
             if chr(ReadInData[0]) == 'S':
                 # send 1 chunk/packet everytime it receive an S
-            
-                if send_index < (len(raw_data) - PACKET_SIZE):
-                    chunk = raw_data[send_index:send_index+PACKET_SIZE]
-                    DAC_dev.write(DAC_ep_out, chunk)
-                    send_index += PACKET_SIZE
-                    # print(send_index)
-
-                else:
-                    chunk = raw_data[send_index:] # get the rest of the value 
-                    DAC_dev.write(DAC_ep_out, chunk)
-                    send_index += len(chunk) 
+                requested = clock()
+                chunk = source.read(send_index, PACKET_SIZE) # the last chunk is shorter
+                start = clock()
+                writeView(DAC_dev, DAC_ep_out, chunk)
+                if telemetry is not None:
+                    done = clock()
+                    telemetry.record('dac.request_to_write_ns', done - requested)
+                    telemetry.record('dac.write_ns', done - start)
+                    telemetry.record('dac.write_bytes', len(chunk))
+                send_index += len(chunk)
+                # print(send_index)
+
+                if len(chunk) < PACKET_SIZE:
                     print(send_index)
-                    print(raw_data_length)
                     print('[DAC] ============ PC send all samples ===============')
                     exit_while = True
 
                     break
 
         except usb.core.USBTimeoutError:
+            if telemetry is not None:
+                telemetry.count('dac.read_timeouts')
             continue
             # print("[DAC] No 'S' send from DAC.")
 
-    # 3. wait for DAC to read samples in buffer and send to ADC
-    exit_while = False
-    while not exit_while:
+
+def parseDACMessages(data):
+    '''
+    Split the bytes received from the DAC into messages:
+      'S'              -> one packet requested (handshake mode)
+      'C' + 1 byte     -> number of packets granted (credit mode)
+      'E' + 4 bytes    -> DAC timer ends, followed by the underrun count (little-endian)
+    Returns (credits, underruns, rest). underruns is None until 'E' has been received,
+    rest is an incomplete message to prepend to the next read.
+    '''
+    credits = 0
+    underruns = None
+    i = 0
+    while i < len(data):
+        signal = chr(data[i])
+        if signal == 'C':
+            if i + 2 > len(data):
+                break
+            credits += data[i+1]
+            i += 2
+        elif signal == 'E':
+            if i + 5 > len(data):
+                break
+            underruns = int.from_bytes(bytes(data[i+1:i+5]), byteorder='little')
+            i += 5
+        else:
+            i += 1 # 'S' or anything we do not know
+    return credits, underruns, bytes(data[i:])
+
+
+def sendSamplesCredit(DAC_dev, DAC_ep_in, DAC_ep_out, source, telemetry=None):
+    '''
+    Credit-window flow control: the MCU grants free ring-buffer space as 'C' + number of
+    packets (at most the window negotiated with the sampling rate) and we write all granted
+    packets back to back in one bulk transfer, instead of waiting for an 'S' per packet.
+    Only the last chunk is shorter than PACKET_SIZE, that's how the MCU detects the end of file.
+    '''
+    clock = time.perf_counter_ns
+    send_index = 0
+    credits = 0
+    rest = b''
+    end_of_file = False
+
+    while not end_of_file:
+        try:
+            ReadInData = DAC_dev.read(DAC_ep_in, 512, timeout=10)
+        except usb.core.USBTimeoutError:
+            if telemetry is not None:
+                telemetry.count('dac.read_timeouts')
+            continue
+        requested = clock()
+
+        granted, _, rest = parseDACMessages(rest + bytes(ReadInData))
+        credits += granted
+        if telemetry is not None and granted:
+            telemetry.record('dac.credits', granted)
+
+        # a source may return less than asked (e.g. the padding comes as its own piece),
+        # only the last piece is not a multiple of PACKET_SIZE
+        while credits > 0 and not end_of_file:
+            chunk = source.read(send_index, credits*PACKET_SIZE)
+            start = clock()
+            writeView(DAC_dev, DAC_ep_out, chunk)
+            if telemetry is not None:
+                done = clock()
+                telemetry.record('dac.request_to_write_ns', done - requested)
+                telemetry.record('dac.write_ns', done - start)
+                telemetry.record('dac.write_bytes', len(chunk))
+            send_index += len(chunk)
+            credits -= -(-len(chunk) // PACKET_SIZE) # ceil
+            end_of_file = len(chunk) % PACKET_SIZE != 0
+
+    print(send_index)
+    print('[DAC] ============ PC send all samples ===============')
+
+
+def waitDACEnd(DAC_dev, DAC_ep_in):
+    '''
+    Wait for the DAC to play the samples in its buffer, it sends 'E' when the timer ends.
+    Returns the number of underruns reported by the DAC (None for firmware that does not report it).
+    '''
+    rest = b''
+    while True:
         try:
             ReadInData = DAC_dev.read(DAC_ep_in, 512, timeout=10)
-            if chr(ReadInData[0]) == 'E':
-                print('[DAC] send signal: ', chr(ReadInData[0]))
-                print('[DAC] DAC timer ends')
-                time.sleep(1) # sleep for 1 seconds s
-                DAC_finished.set()
-                exit_while = True
-        except:
-            print("[DAC] No 'E' send from DAC.")
+        except usb.core.USBTimeoutError:
+            if rest[:1] == b'E':
+                return None # older firmware only sends a single 'E'
+            continue
+
+        _, underruns, rest = parseDACMessages(rest + bytes(ReadInData))
+        if underruns is not None:
+            return underruns
+
+
+def playSamples(DAC_dev, DAC_ep_in, DAC_ep_out, source, credit_window=DAC_CREDIT_WINDOW, telemetry=None):
+    '''
+    Send the samples of source (dac_source.py) to the DAC and wait until they are played.
+    telemetry is a RunTelemetry (telemetry.py) that records the timing of every packet.
+    Returns the number of underruns reported by the DAC.
+    '''
+    # change the format of sampling rate
+    bytes_rate = source.frame_rate.to_bytes(4, byteorder='little')
+
+    # 1. send sampling rate (+ credit window + sample bits, the MCU uses the header length to pick the mode)
+    # 2. send samples
+    if credit_window > 0:
+        header = bytes_rate + credit_window.to_bytes(4, byteorder='little')
+        if source.sample_bits != SAMPLE_BITS:
+            header += source.sample_bits.to_bytes(4, byteorder='little')
+        DAC_dev.write(DAC_ep_out, header)
+        sendSamplesCredit(DAC_dev, DAC_ep_in, DAC_ep_out, source, telemetry)
+    else:
+        if source.sample_bits != SAMPLE_BITS:
+            raise ValueError('packed samples need credit mode (credit_window > 0)')
+        DAC_dev.write(DAC_ep_out, bytes_rate)
+        sendSamplesHandshake(DAC_dev, DAC_ep_in, DAC_ep_out, source, telemetry)
+
+    # 3. wait for DAC to read samples in buffer and send to ADC
+    underruns = waitDACEnd(DAC_dev, DAC_ep_in)
+    if telemetry is not None and underruns is not None:
+        telemetry.count('dac.underruns', underruns)
+    print('[DAC] send signal:  E')
+    print('[DAC] DAC timer ends, underruns: ', underruns)
+    return underruns
+
+
+def makeSource(blocks=None, frame_rate=None, sample_bits=DAC_SAMPLE_BITS):
+    '''
+    Sample source (dac_source.py) for input_filename, or for the int16 blocks of an iterator at frame_rate.
+    blocks can also be a source already, e.g. StimulusCache.source() (stimulus_cache.py), it is used as it is.
+    '''
+    if hasattr(blocks, 'read'):
+        print("[DAC] Total number of bytes: ", len(blocks))
+        return blocks
+
+    if sample_bits != SAMPLE_BITS and blocks is None:
+        # packing needs a pass over every sample anyway, so decode the file block by block
+        with wave.open(input_filename, "rb") as wav:
+            frame_rate = wav.getframerate()
+        blocks = wav_blocks(input_filename)
+
+    if blocks is not None:
+        source = BlockStreamSource(blocks, frame_rate, sample_bits=sample_bits) # bounded read-ahead in a producer thread
+        print("[DAC] Streaming samples at", frame_rate, "Hz,", sample_bits, "bits")
+    else:
+        # memory-map the samples (little-endian so low-byte then high-byte), packets are sent
+        # straight from the mapping and the tail padding is added by the source without a copy
+        source = MappedWavSource(input_filename)
+        print("[DAC] Total number of bytes: ",len(source))
+    return source
+
+
+# =============================================
+# ========= DAC Thread Function
+# =============================================
+def runDAC(DAC_dev, DAC_ep_in, DAC_ep_out, credit_window=DAC_CREDIT_WINDOW, blocks=None, frame_rate=None, sample_bits=DAC_SAMPLE_BITS,
+           ready=None, finished=None, telemetry=None):
+    '''
+    Play input_filename, or the int16 blocks of an iterator (e.g. square_wave_generate.sine_blocks)
+    at frame_rate, so stimuli can be produced on the fly with constant memory, or a cached stimulus
+    (StimulusCache.source in stimulus_cache.py).
+    ready/finished are the events shared with runADC, ADC_ready/DAC_finished by default
+    (multi_rig.py gives every rig its own). telemetry is a RunTelemetry (telemetry.py) shared with runADC.
+    Returns the number of underruns reported by the DAC.
+    '''
+    global ADC_ready, DAC_finished, input_filename
+    ready = ADC_ready if ready is None else ready
+    finished = DAC_finished if finished is None else finished
+
+    # ----------------------------
+    # ----- Process input file ---
+    # ----------------------------
+    source = makeSource(blocks, frame_rate, sample_bits)
+
+    # ----------------------------
+    # --- wait for ADC to be ready
+    # ----------------------------
+    print("[DAC] Waiting for ADC to be ready...")
+    ready.wait()
+    print("[DAC] ADC is ready, start DAC now...")
+
+    # ----------------------------
+    # ---- Start working ---------
+    # ----------------------------
+
+    underruns = playSamples(DAC_dev, DAC_ep_in, DAC_ep_out, source, credit_window, telemetry)
+    source.close()
+    time.sleep(1) # sleep for 1 seconds s
+    finished.set()
     
     print("[DAC] finish and close")
+    return underruns
 
 
 # =============================================
 # ========= ADC Thread Function
 # =============================================
-def runADC(ADC_dev, ADC_ep_in, ADC_ep_out):
-    global ADC_ready, DAC_finished, input_filename, output_filename
-
-    recorded_samples_list = []
-
+def adcHeader(frame_rate):
+    '''Sampling rate, followed by the sample format if it is not plain 16-bit words.'''
+    bytes_rate = frame_rate.to_bytes(4, byteorder='little')
+    if ADC_COMPRESSION:
+        bytes_rate += DELTA_FORMAT.to_bytes(4, byteorder='little') # ask for compressed packets
+    elif ADC_FRAMED:
+        bytes_rate += FRAMED_FORMAT.to_bytes(4, byteorder='little') # ask for framed packets
+    elif ADC_SAMPLE_BITS != SAMPLE_BITS:
+        bytes_rate += ADC_SAMPLE_BITS.to_bytes(4, byteorder='little') # ask for packed samples
+    return bytes_rate
+
+
+def startADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate, drain=True):
+    '''
+    Empty the ADC's input buffer (unless drain is False, e.g. stopADC has just done it),
+    send the sampling rate (and sample format) and wait for its ACK.
+    Returns the ACK: '1' plain 16-bit words, 'P' packed samples, 'D' delta compressed packets, 'F' framed packets.
+    '''
     # 0: read all dummy data may exist in the input buffer
-    try:
-        ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
-        ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
-        print("[ADC] dummy data is in buffer")
-    except:
-        print("[ADC] no dummy data is in buffer")
+    if drain:
+        try:
+            ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
+            ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
+            print("[ADC] dummy data is in buffer")
+        except usb.core.USBError:
+            print("[ADC] no dummy data is in buffer")
     
-    # 1. get input sampling rate and send SR to ADC
-    with wave.open(input_filename, "rb") as wav:
-        frame_rate = wav.getframerate()
-    bytes_rate = frame_rate.to_bytes(4, byteorder='little')
-    ADC_dev.write(ADC_ep_out, bytes_rate)
+    # 1. send SR to ADC
+    ADC_dev.write(ADC_ep_out, adcHeader(frame_rate))
 
-    # 2. receive ADC timer start signal '1'
+    # 2. receive ADC timer start signal '1' ('P' if the samples are packed, 'D' if compressed, 'F' if framed)
     getSR_ACK = ADC_dev.read(ADC_ep_in, 512, timeout=1000)
+    return chr(getSR_ACK[0])
+
+
+def adcDecoder(ack):
+    '''Decoder for the format the ADC acknowledged, None for plain 16-bit words.'''
+    if ack == 'P':
+        print("[ADC] ready,", ADC_SAMPLE_BITS, "bits per sample")
+        return PackedDecoder(ADC_SAMPLE_BITS)
+    if ack == 'D':
+        print("[ADC] ready, delta compressed")
+        return DeltaDecoder()
+    if ack == 'F':
+        print("[ADC] ready, framed packets")
+        return FramedDecoder()
     print("[ADC] ready")
-    ADC_ready.set()
-
-    # 3. read incoming signals
-    with wave.open(output_filename, 'wb') as output_file:
-        output_file.setnchannels(1)  # Mono audio
-        output_file.setsampwidth(2)  # 16-bit samples (2 bytes per sample)
-        output_file.setframerate(frame_rate)
-
-        i = 0
-        # recorded_samples = np.array([], dtype=np.int16)
-        # recorded_samples = np.array([], dtype=np.uint16) # test to work on uint16 since ADC output is use 0 as base
-
-        exit_while = False
-        num = 0
-        while not DAC_finished.is_set():
-        # while num <900000:
+    return None
+
+
+def saveGaps(decoder, filename):
+    '''Report the dropouts found by a FramedDecoder and save them as filename + GAPS_SUFFIX.'''
+    gaps = decoder.metadata()
+    with open(filename + GAPS_SUFFIX, 'w') as f:
+        json.dump(gaps, f, indent=1)
+    print("[ADC] %d gaps, %d samples missing, %d packets lost (of %d)"
+          % (gaps['gaps'], gaps['missing_samples'], gaps['lost_packets'], gaps['packets'] + gaps['lost_packets']))
+    print("[ADC] gaps saved as", filename + GAPS_SUFFIX)
+
+
+def captureADC(ADC_dev, ADC_ep_in, ring, consumer, finished, telemetry=None, make_transport=None):
+    '''
+    Read the ADC stream into the slots of ring and hand every filled slot to consumer(data, slot),
+    which releases it, until finished is set. telemetry counts the reads that timed out.
+    make_transport(ADC_dev, num_transfers, transfer_size) makes the transport of the queued transfers,
+    libusb on ADC_dev if None (fake_device.FakeADC.async_transport for a simulated board).
+    '''
+    if ADC_ASYNC_TRANSFERS > 0:
+        # keep several transfers queued so the endpoint is never idle while we store data
+        transport = None if make_transport is None else make_transport(ADC_dev, ADC_ASYNC_TRANSFERS, HLAF_MAX_BUFFER_SIZE)
+        reader = AsyncBulkReader(ADC_dev, ADC_ep_in, consumer, ADC_ASYNC_TRANSFERS, HLAF_MAX_BUFFER_SIZE, transport, ring)
+        try:
+            reader.start()
+            while not finished.is_set():
+                reader.poll(0.01)
+        finally:
+            # also after an error: no transfer may stay queued into the ring, which the next run reuses
+            reader.stop() # cancelled transfers still hand over what they already received
+        print("[ADC] lowest number of queued transfers: ", reader.min_in_flight)
+
+    else:
+        while not finished.is_set():
+            slot = ring.acquire()
             try:
                 # Poll for data with a short timeout
-                ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
-                np_data = np.frombuffer(ReadInData, dtype='>i2') # > large-endian, u2: unint16, i2:signed int16
-                recorded_samples_list.append(np_data)
-                # recorded_samples = np.concatenate((recorded_samples, np_data))
-
-                num +=len(np_data)
-                # print(num)
-            
-            except:
+                num_bytes = readView(ADC_dev, ADC_ep_in, ring.slots[slot], timeout=10)
+            except usb.core.USBTimeoutError:
+                ring.release(slot)
+                if telemetry is not None:
+                    telemetry.count('adc.read_timeouts')
                 continue
-        
-        ADC_dev.write(ADC_ep_out, 'e') # send a signal to ADC so it will stop timer and reset itself
-        recorded_samples = np.concatenate(recorded_samples_list)
-        output_file.writeframes(np.array(recorded_samples, dtype=np.int16).tobytes()) 
+            consumer(ring.view(slot, num_bytes), slot)
 
-    print("[ADC] byte num" ,num*2)
-    print("[ADC] recording completed. Saved as output.wav.")
+
+def stopADC(ADC_dev, ADC_ep_in, ADC_ep_out):
+    '''Stop the ADC timer and read what is left in its buffer.'''
+    ADC_dev.write(ADC_ep_out, 'e') # send a signal to ADC so it will stop timer and reset itself
 
     # 4. clean all buffer
     while True:
         try:
             ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
             # ReadInData = ADC_dev.read(ADC_ep_in, HLAF_MAX_BUFFER_SIZE, timeout=10)
-        except:
+        except usb.core.USBError:
             print("no data in buffer")
             break
+
+
+def runADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate=None, filename=None, ready=None, finished=None, monitor=None, scope=None,
+           telemetry=None, make_transport=None):
+    '''
+    Record into filename (output_filename by default) until finished is set by runDAC.
+    monitor is a SkewMonitor (skew_monitor.py) fed with every buffer, one is made for ADC_SKEW_MONITOR.
+    scope is a LiveScope (live_scope.py) fed with every buffer, shown by another thread.
+    telemetry is a RunTelemetry (telemetry.py) that records the size and timing of every buffer.
+    With framed packets (ADC_FRAMED) the dropouts are saved next to the file (saveGaps).
+    make_transport is passed to captureADC.
+    Returns the number of samples written.
+    '''
+    global ADC_ready, DAC_finished, input_filename, output_filename
+    filename = output_filename if filename is None else filename
+    ready = ADC_ready if ready is None else ready
+    finished = DAC_finished if finished is None else finished
+
+    # 1. get input sampling rate, 2. start the ADC
+    if frame_rate is None:
+        with wave.open(input_filename, "rb") as wav:
+            frame_rate = wav.getframerate()
+    decoder = adcDecoder(startADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate))
+    ready.set()
+
+    # 3. read incoming signals
+    # USB reads land in the slots of a preallocated ring, the recorder thread byte-swaps them
+    # in place (> large-endian from the ADC), appends them to the file and releases the slot
+    ring = SampleRing(ADC_RING_SLOTS, HLAF_MAX_BUFFER_SIZE, '>i2' if decoder is None else np.uint8)
+    if monitor is None and ADC_SKEW_MONITOR:
+        monitor = SkewMonitor(frame_rate, ADC_SKEW_MONITOR, limit_ppm=ADC_SKEW_LIMIT_PPM, on_limit=finished.set)
+    recorder = WavRecorder(filename, frame_rate, ring, decoder, monitor, scope)
+    consumer = recorder.put if telemetry is None else telemetry.wrapConsumer(recorder.put, ring, recorder.queue)
+    captureADC(ADC_dev, ADC_ep_in, ring, consumer, finished, telemetry, make_transport)
+    stopADC(ADC_dev, ADC_ep_in, ADC_ep_out)
+    num = recorder.close() # finalizes the WAV header
+    if monitor is not None:
+        monitor.publish() # estimate over the whole capture
+
+    print("[ADC] byte num" ,num*2)
+    if isinstance(decoder, DeltaDecoder):
+        print("[ADC] compression ratio: %.2f (%d bytes received)" % (decoder.compression_ratio, decoder.num_bytes))
+    if isinstance(decoder, FramedDecoder):
+        saveGaps(decoder, filename)
+    print("[ADC] largest writer queue depth: ", recorder.max_queue_depth)
+    print("[ADC] fewest free ring slots: ", ring.min_free)
+    print("[ADC] recording completed. Saved as", filename)
     print("EOF")
+    return num
 
 
 # =============================================
 # ========= Main Function
 # =============================================
-def main():
+def main(blocks=None, frame_rate=None):
+    '''
+    Play input_filename and record output_filename.
+    Usage for a stimulus generated on the fly (e.g. an overnight soak test):
+        main(sine_blocks(180000, 18000.0, duration=8*3600), frame_rate=180000)
+    '''
     [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out] = getDevices()
     # runDAC(DAC_dev, DAC_ep_in, DAC_ep_out)
     # runADC(ADC_dev, ADC_ep_in, ADC_ep_out)
 
-    thread_adc = threading.Thread(target=runADC, args=(ADC_dev, ADC_ep_in, ADC_ep_out))
-    thread_dac = threading.Thread(target=runDAC, args=(DAC_dev, DAC_ep_in, DAC_ep_out))
+    telemetry = RunTelemetry() if TELEMETRY else None
+    scope = None
+    if ADC_PROCESS_MODE:
+        # imported here, process_mode.py builds on this module
+        from functools import partial
+        from multi_rig import deviceId
+        from process_mode import openBoard, runADCProcess
+        ADC_id = deviceId(ADC_dev)
+        usb.util.dispose_resources(ADC_dev) # the reader process opens the board itself
+        open_ADC = partial(openBoard, ADC_PRODUCT_ID, "ADC", ADC_EP_IN, ADC_id)
+        thread_adc = threading.Thread(target=runADCProcess, args=(open_ADC, frame_rate)) # no scope or ADC telemetry, the samples stay in the reader process
+    else:
+        if ADC_LIVE_SCOPE:
+            from live_scope import LiveScope # imported here, it brings in matplotlib
+            rate = frame_rate or getattr(blocks, 'frame_rate', None)
+            if rate is None:
+                with wave.open(input_filename, "rb") as wav:
+                    rate = wav.getframerate()
+            scope = LiveScope(rate, ADC_LIVE_SCOPE)
+        thread_adc = threading.Thread(target=runADC, args=(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate),
+                                      kwargs={'scope': scope, 'telemetry': telemetry})
+    thread_dac = threading.Thread(target=runDAC, args=(DAC_dev, DAC_ep_in, DAC_ep_out, DAC_CREDIT_WINDOW, blocks, frame_rate, DAC_SAMPLE_BITS),
+                                  kwargs={'telemetry': telemetry})
 
     thread_adc.start()
     thread_dac.start()
+    if scope is not None:
+        scope.show(until=lambda: not thread_adc.is_alive()) # the GUI needs the main thread
 
     thread_dac.join()
     thread_adc.join()
+    if telemetry is not None:
+        telemetry.report()
+        telemetry.dump(output_filename + TELEMETRY_SUFFIX)
+        print("[telemetry] saved as", output_filename + TELEMETRY_SUFFIX)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+Asynchronous bulk IN capture for the ADC.
+
+dev.read() only has one transfer on the endpoint at a time, so while Python converts and stores
+a buffer nothing is queued and the Teensy ring buffer keeps filling up.
+AsyncBulkReader keeps several bulk IN transfers submitted through libusb's asynchronous API
+(the same libusb1 backend pyusb uses), resubmits each one as soon as it completes
+and hands the filled slot of a SampleRing (adc_ring.py) to a consumer, the data is never copied.
+'''
+from ctypes import POINTER, Structure, byref, c_long, c_void_p
+
+import numpy as np
+import usb.core
+from usb.backend import libusb1
+
+from adc_ring import SampleRing
+
+ASYNC_NUM_TRANSFERS = 8 # number of bulk IN transfers kept queued on the endpoint
+LIBUSB_TRANSFER_TYPE_BULK = 2
+
+
+class _timeval(Structure):
+    _fields_ = [('tv_sec', c_long),
+                ('tv_usec', c_long)]
+
+
+# =============================================
+# ========= libusb transport
+# =============================================
+class Libusb1BulkTransport:
+    '''
+    Owns the libusb transfers for one bulk IN endpoint of a pyusb device, the buffers are passed to submit().
+    on_complete(index, num_bytes, status) is called from handle_events() for every finished transfer.
+    '''
+    def __init__(self, dev, ep_in, num_transfers, transfer_size):
+        backend = dev._ctx.backend
+        if backend.__class__.__name__ != '_LibUSB':
+            raise ValueError('asynchronous capture needs the libusb1 backend')
+
+        self.lib = backend.lib
+        self.ctx = backend.ctx
+        self.lib.libusb_handle_events_timeout.argtypes = [c_void_p, POINTER(_timeval)]
+        self.lib.libusb_cancel_transfer.argtypes = [libusb1._libusb_transfer_p]
+
+        # same as dev.read(): open the device and claim the interface of the endpoint
+        dev._ctx.managed_open()
+        _, ep = dev._ctx.setup_request(dev, ep_in)
+        self.handle = dev._ctx.handle.handle
+        self.endpoint = ep.bEndpointAddress
+
+        self.transfer_size = transfer_size
+        self.on_complete = None
+        self.buffers = [None] * num_transfers # keeps the submitted buffers alive
+        self.transfers = [self.lib.libusb_alloc_transfer(0) for _ in range(num_transfers)]
+        self.callbacks = [libusb1._libusb_transfer_cb_fn_p(self._make_callback(index)) for index in range(num_transfers)]
+
+    def _make_callback(self, index):
+        def callback(transfer_p):
+            transfer = transfer_p.contents
+            self.buffers[index] = None
+            self.on_complete(index, transfer.actual_length, transfer.status)
+        return callback
+
+    def submit(self, index, buffer):
+        '''Queue transfer index to receive into buffer (writable, at least transfer_size bytes).'''
+        array = np.frombuffer(buffer, dtype=np.uint8)
+        transfer = self.transfers[index].contents
+        transfer.dev_handle = self.handle
+        transfer.endpoint = self.endpoint
+        transfer.type = LIBUSB_TRANSFER_TYPE_BULK
+        transfer.timeout = 0 # stay queued until data arrives
+        transfer.length = self.transfer_size
+        transfer.buffer = array.ctypes.data
+        transfer.callback = self.callbacks[index]
+        self.buffers[index] = array
+        libusb1._check(self.lib.libusb_submit_transfer(self.transfers[index]))
+
+    def handle_events(self, timeout):
+        tv = _timeval(int(timeout), int((timeout % 1) * 1e6))
+        libusb1._check(self.lib.libusb_handle_events_timeout(self.ctx, byref(tv)))
+
+    def cancel(self, index):
+        self.lib.libusb_cancel_transfer(self.transfers[index]) # fails harmlessly if already finished
+
+    def close(self):
+        for transfer in self.transfers:
+            self.lib.libusb_free_transfer(transfer)
+        self.transfers = []
+
+
+# =============================================
+# ========= Capture engine
+# =============================================
+class AsyncBulkReader:
+    '''
+    Keep num_transfers bulk IN transfers queued, each receiving into a slot of ring, and pass every
+    filled slot to consumer(samples, slot), samples being a zero-copy view of the slot (ring.view).
+    The consumer owns the slot from then on and calls ring.release(slot) when it is done with it.
+
+    Usage:
+        reader = AsyncBulkReader(ADC_dev, ADC_ep_in, consumer, transfer_size=HLAF_MAX_BUFFER_SIZE)
+        reader.start()
+        while not done:
+            reader.poll(0.01)
+        reader.stop()  # cancelled transfers still hand over what they already received
+
+    The consumer runs in the thread calling poll(), after the transfer has been resubmitted.
+    A transfer is resubmitted only when a free slot is available. If the consumer falls behind by the
+    whole ring, the transfer waits idle in poll() and the Teensy buffers the data meanwhile.
+    '''
+    def __init__(self, dev, ep_in, consumer, num_transfers=ASYNC_NUM_TRANSFERS, transfer_size=16384, transport=None, ring=None):
+        if ring is None:
+            ring = SampleRing(4 * num_transfers, transfer_size)
+        if ring.slot_size < transfer_size:
+            raise ValueError('ring slots are smaller than transfer_size')
+        if transport is None:
+            transport = Libusb1BulkTransport(dev, ep_in, num_transfers, transfer_size)
+        transport.on_complete = self._complete
+        self.transport = transport
+        self.consumer = consumer
+        self.ring = ring
+        self.num_transfers = num_transfers
+
+        self.slots = [None] * num_transfers # ring slot each transfer is receiving into, None when idle
+        self.in_flight = 0
+        self.stopping = False
+        self.error = None
+
+        # statistics
+        self.num_completed = 0
+        self.num_bytes = 0
+        self.min_in_flight = num_transfers # lowest queue depth seen after a completion
+
+    def start(self):
+        for index in range(self.num_transfers):
+            self._submit(index, self.ring.acquire())
+
+    def poll(self, timeout=0.01):
+        for index in range(self.num_transfers): # transfers left idle by a full ring
+            if self.slots[index] is None and not self.stopping:
+                slot = self.ring.try_acquire()
+                if slot is None:
+                    break
+                self._submit(index, slot)
+        self.transport.handle_events(timeout)
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.stopping = True
+        for index in range(self.num_transfers):
+            if self.slots[index] is not None:
+                self.transport.cancel(index)
+        while self.in_flight > 0:
+            self.transport.handle_events(0.1)
+        self.transport.close()
+
+    def _submit(self, index, slot):
+        self.slots[index] = slot
+        try:
+            self.transport.submit(index, self.ring.slots[slot])
+        except BaseException:
+            # never queued: the transfer stays idle and the slot goes back to the ring
+            self.slots[index] = None
+            self.ring.release(slot)
+            raise
+        self.in_flight += 1
+
+    def _complete(self, index, num_bytes, status):
+        self.in_flight -= 1
+        slot = self.slots[index]
+        self.slots[index] = None
+
+        if status in (libusb1.LIBUSB_TRANSFER_COMPLETED, libusb1.LIBUSB_TRANSFER_TIMED_OUT):
+            if not self.stopping:
+                next_slot = self.ring.try_acquire()
+                if next_slot is not None:
+                    try:
+                        self._submit(index, next_slot) # requeue before the consumer runs
+                    except usb.core.USBError as e:
+                        self.error = e
+        elif status != libusb1.LIBUSB_TRANSFER_CANCELLED and self.error is None:
+            self.error = usb.core.USBError(libusb1._str_transfer_error[status], status, libusb1._transfer_errno[status])
+
+        if not self.stopping:
+            self.min_in_flight = min(self.min_in_flight, self.in_flight)
+        if num_bytes == 0:
+            self.ring.release(slot)
+            return
+        self.num_completed += 1
+        self.num_bytes += num_bytes
+        try:
+            self.consumer(self.ring.view(slot, num_bytes), slot)
+        except Exception as e: # would be swallowed inside the libusb callback
+            self.error = e
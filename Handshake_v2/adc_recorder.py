@@ -0,0 +1,106 @@
+'''
+Writer stage for the ADC capture.
+
+The USB reader only puts the received buffers (big-endian 16-bit samples from the Teensy) into
+a bounded queue. A writer thread byte-swaps them and appends them to the WAV file as they arrive,
+so RAM use does not depend on the capture length and a crash keeps everything written so far.
+Buffers that are slots of a SampleRing (adc_ring.py) are byte-swapped in place and the slot is
+released once it is on disk, so a capture allocates nothing per buffer.
+Packed samples (sample_format.py) are unpacked by the decoder instead, in arrival order.
+A SkewMonitor (skew_monitor.py) and a LiveScope (live_scope.py) get the samples of every buffer
+once they are written.
+'''
+import threading
+import wave
+import time
+from queue import Queue
+
+import numpy as np
+
+from adc_ring import swapInPlace
+
+
+class WavRecorder:
+    '''
+    Usage:
+        recorder = WavRecorder(output_filename, frame_rate, ring, decoder, monitor, scope)
+        recorder.put(samples, slot)   # from the USB reader, blocks only if the writer is max_queue buffers behind
+        recorder.put(ReadInData)      # a buffer that is not part of the ring
+        num_samples = recorder.close()  # finalizes the WAV header
+    '''
+    def __init__(self, filename, frame_rate, ring=None, decoder=None, monitor=None, scope=None, max_queue=64, flush_interval=1.0):
+        self.ring = ring
+        self.decoder = decoder
+        self.monitor = monitor
+        self.scope = scope
+        self.queue = Queue(maxsize=max_queue)
+        self.flush_interval = flush_interval
+        self.num_samples = 0
+        self.max_queue_depth = 0
+        self.error = None
+
+        self.file = open(filename, 'wb')
+        self.output_file = wave.open(self.file, 'wb')
+        self.output_file.setnchannels(1)  # Mono audio
+        self.output_file.setsampwidth(2)  # 16-bit samples (2 bytes per sample)
+        self.output_file.setframerate(frame_rate)
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, ReadInData, slot=None):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((ReadInData, slot))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            ReadInData, slot = item
+            if self.error is None:
+                try:
+                    self._write(ReadInData, slot)
+                    if time.monotonic() > next_flush:
+                        self.file.flush()
+                        next_flush += self.flush_interval
+                except Exception as e:
+                    self.error = e
+            # also after an error, so the reader never runs out of slots
+            if slot is not None:
+                self.ring.release(slot)
+
+    def _write(self, ReadInData, slot):
+        if self.decoder is not None:
+            samples = self.decoder.decode(ReadInData) # already little-endian
+        elif slot is None:
+            samples = np.frombuffer(ReadInData, dtype='>i2').astype('<i2') # WAV is little-endian
+        else:
+            samples = swapInPlace(np.frombuffer(ReadInData, dtype='>i2')) # the slot is ours until it is released
+        # writeframes also rewrites the sizes in the header, so the file stays readable
+        self.output_file.writeframes(samples.view(np.uint8))
+        self.num_samples += len(samples)
+        if self.monitor is not None:
+            try:
+                self.monitor.update(samples)
+            except Exception as e: # the recording goes on without it
+                print("[ADC] skew monitor stopped:", repr(e))
+                self.monitor = None
+        if self.scope is not None:
+            try:
+                self.scope.update(samples) # decimated into a bounded deque, never waits for the GUI
+            except Exception as e:
+                print("[ADC] live scope stopped:", repr(e))
+                self.scope = None
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.output_file.close() # final header
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+        return self.num_samples
@@ -0,0 +1,73 @@
+'''
+Preallocated capture buffer for the ADC.
+
+dev.read() returns a new array.array for every call, and np.frombuffer() adds another object on top.
+SampleRing allocates all capture memory once: num_slots slots of slot_size bytes in one NumPy array.
+A reader takes a free slot, lets the USB transfer write straight into it (usb_buffers.readView, or a
+queued libusb transfer in adc_async_capture.py) and hands the filled region on as a zero-copy view.
+Whoever consumes the view releases the slot, after which it is reused for a later transfer.
+'''
+from queue import Empty, SimpleQueue
+
+import numpy as np
+
+
+class SampleRing:
+    '''
+    Usage:
+        ring = SampleRing(32, HLAF_MAX_BUFFER_SIZE)
+        slot = ring.acquire()
+        num_bytes = readView(ADC_dev, ADC_ep_in, ring.slots[slot])
+        samples = ring.view(slot, num_bytes)  # '>i2' samples, no copy
+        ...
+        ring.release(slot)
+    '''
+    def __init__(self, num_slots, slot_size, dtype='>i2'):
+        if slot_size % np.dtype(dtype).itemsize != 0:
+            raise ValueError('slot_size must be a whole number of samples')
+        self.dtype = dtype
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.buffer = np.zeros(num_slots * slot_size, dtype=np.uint8)
+        self.slots = [memoryview(self.buffer[i*slot_size:(i+1)*slot_size]) for i in range(num_slots)]
+
+        self.free = SimpleQueue()
+        for slot in range(num_slots):
+            self.free.put(slot)
+        self.min_free = num_slots # lowest number of free slots seen
+
+    def acquire(self, timeout=None):
+        '''Index of a free slot, waits until one is released (raises queue.Empty after timeout).'''
+        slot = self.free.get(timeout=timeout)
+        self.min_free = min(self.min_free, self.free.qsize())
+        return slot
+
+    def try_acquire(self):
+        '''Index of a free slot or None, never waits.'''
+        try:
+            slot = self.free.get_nowait()
+        except Empty:
+            return None
+        self.min_free = min(self.min_free, self.free.qsize())
+        return slot
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def view(self, slot, num_bytes):
+        '''
+        The first num_bytes of a slot as samples of the ring's dtype: big-endian 16-bit as sent by the Teensy,
+        or np.uint8 for packed samples (sample_format.py), which need not end on a sample boundary.
+        '''
+        start = slot * self.slot_size
+        return self.buffer[start:start + num_bytes].view(self.dtype)
+
+
+def swapInPlace(samples):
+    '''
+    Convert big-endian samples to little-endian (WAV) in their own memory and return the '<i2' view.
+    A cast onto the same memory is several times faster than ndarray.byteswap(inplace=True).
+    '''
+    little = samples.view('<i2')
+    little[...] = samples
+    return little
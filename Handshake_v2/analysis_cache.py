@@ -0,0 +1,145 @@
+'''
+On-disk memoization of the drift analysis (drift_check.py, zero_crossing.py) of WAV files.
+
+A result is stored under a key made of
+- the hash of the file content (blake2b), so a renamed or copied capture is still found and a
+  rewritten one is not. The hash of a file is remembered with its size, mtime and inode, so an
+  unchanged file is not read again,
+- the function and its parameters (f0_guess, periods_per_window, step_ratio...),
+- the hash of the analysis sources, so changing the code does not return stale results.
+Every result is a compressed .npz file in `directory`. A hit refreshes its mtime. When the
+directory grows beyond max_bytes, the least recently used results are deleted (cache_files.py).
+Files are written to a temporary name and renamed, so several processes can share a cache.
+
+Usage:
+    cache = AnalysisCache()
+    f_est, params = cache.fit_whole_sine("output.wav", 18000)             # computed once
+    freqs, phases, mses = cache.fit_sine_over_sliding_windows("output.wav", 1000, 5, 0.2, return_mse=True)
+    stats = cache.wav_period_stats("output.wav", hysteresis=0.01)
+    result = cache.memoize(function, "output.wav", *args)                 # function(wav_path, *args)
+'''
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+import drift_check
+import zero_crossing
+from cache_files import cacheSize, evict, fileHash
+
+CACHE_DIR = ".analysis_cache"
+CACHE_MAX_BYTES = 512 << 20
+HASH_INDEX = "file_hashes.json" # path -> [size, mtime_ns, inode, content hash]
+
+
+# changing any of these files invalidates every result
+SOURCE_HASH = hashlib.blake2b(b''.join(fileHash(module.__file__).encode() for module in
+                                       (drift_check, zero_crossing)) + fileHash(__file__).encode()).hexdigest()
+
+
+def _sliding_windows(wav_path, sine_freq, periods_per_window, step_ratio, return_mse, method):
+    # the samples normalized like fit_sine (parallel_drift.py does the same per batch)
+    Fs, y = wav.read(wav_path, mmap=True)
+    signal = y.astype(np.float64)
+    if np.issubdtype(y.dtype, np.integer):
+        signal /= np.iinfo(y.dtype).max
+    function = drift_check.fit_sine_over_sliding_windows_batch if method == 'batch' else drift_check.fit_sine_over_sliding_windows
+    return function(signal, Fs, sine_freq, periods_per_window, step_ratio, return_mse)
+
+
+class AnalysisCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, HASH_INDEX)
+        try:
+            with open(self.index_path) as f:
+                self.hash_index = json.load(f)
+        except (OSError, ValueError):
+            self.hash_index = {}
+
+    def contentHash(self, path):
+        '''Hash of the file content, read only if size, mtime or inode changed since the last time.'''
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        key = os.path.abspath(path)
+        entry = self.hash_index.get(key)
+        if entry is not None and entry[:3] == stamp:
+            return entry[3]
+        digest = fileHash(path)
+        self.hash_index[key] = stamp + [digest]
+        self._writeAtomic(self.index_path, json.dumps(self.hash_index).encode())
+        return digest
+
+    def key(self, function, wav_path, args, kwargs):
+        text = json.dumps([function.__module__, function.__qualname__, self.contentHash(wav_path), SOURCE_HASH,
+                           list(args), sorted(kwargs.items())], default=repr)
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def memoize(self, function, wav_path, *args, **kwargs):
+        '''function(wav_path, *args, **kwargs) from the cache, or computed and stored.'''
+        path = os.path.join(self.directory, self.key(function, wav_path, args, kwargs) + '.npz')
+        try:
+            result = self._load(path)
+            os.utime(path) # most recently used
+            self.hits += 1
+            return result
+        except (OSError, ValueError, KeyError):
+            pass # not cached (or a damaged file, which is replaced)
+        self.misses += 1
+        result = function(wav_path, *args, **kwargs)
+        self._store(path, result)
+        evict(self.directory, '.npz', self.max_bytes, keep=path)
+        return result
+
+    # the drift_check.py / zero_crossing.py analyses of a WAV file
+    def fit_whole_sine(self, wav_path, f0_guess, method='fft'):
+        return self.memoize(drift_check.fit_whole_sine, wav_path, f0_guess, method)
+
+    def fit_sine_over_sliding_windows(self, wav_path, sine_freq=1000, periods_per_window=5, step_ratio=0.5,
+                                      return_mse=False, method='curve_fit'):
+        return self.memoize(_sliding_windows, wav_path, sine_freq, periods_per_window, step_ratio, return_mse, method)
+
+    def wav_period_stats(self, wav_path, level=0, hysteresis=0, interpolation='linear'):
+        return self.memoize(zero_crossing.wav_period_stats, wav_path, level, hysteresis, interpolation)
+
+    def _store(self, path, result):
+        # a tuple of lists / arrays / numbers or a dict of numbers, rebuilt with the same types by _load
+        if isinstance(result, dict):
+            arrays = {'kind': np.array('dict'), 'keys': np.array(list(result))}
+            values = list(result.values())
+        else:
+            arrays = {'kind': np.array('tuple')}
+            values = list(result)
+        arrays['types'] = np.array(['list' if isinstance(v, list) else 'array' if isinstance(v, np.ndarray) else
+                                    'int' if isinstance(v, (int, np.integer)) else 'float' for v in values])
+        for k, v in enumerate(values):
+            arrays['v%d' % k] = np.asarray(v)
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(f.name, path)
+
+    def _load(self, path):
+        with np.load(path) as data:
+            values = []
+            for k, kind in enumerate(data['types']):
+                v = data['v%d' % k]
+                values.append(v.tolist() if kind == 'list' else v if kind == 'array' else int(v) if kind == 'int' else float(v))
+            if str(data['kind']) == 'dict':
+                return dict(zip(data['keys'].tolist(), values))
+            return tuple(values)
+
+    def _writeAtomic(self, path, data):
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def size(self):
+        '''Bytes of results in the cache.'''
+        return cacheSize(self.directory, '.npz')
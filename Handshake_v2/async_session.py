@@ -0,0 +1,356 @@
+'''
+asyncio sessions for the DAC / ADC rig.
+
+runDAC and runADC poll the boards with 10 ms read timeouts in their own threads. Here every read
+and write is a libusb transfer that stays queued until the board answers (no timeout),
+and completes an asyncio future: a single event thread sleeps in libusb for all boards
+and hands the completions to the event loop. So several rigs and the analysis can share one loop,
+nothing wakes up while waiting, and a grant or ACK is handled as soon as it arrives.
+
+Usage:
+    session = AsyncSession(getDevices(), "output.wav")
+    stats = asyncio.run(session.run(sine_blocks(180000, 18000.0, duration=60), frame_rate=180000))
+
+or with the two sides awaited separately:
+    ready, finished = asyncio.Event(), asyncio.Event()
+    num_samples, underruns = await asyncio.gather(session.capture(180000, "output.wav", ready, finished),
+                                                  session.send_stimulus(source, ready=ready, finished=finished))
+
+The stats include the CPU time of the whole process during the run (all threads, so also
+the recorder and the DAC producer) to compare with the thread version (bench_async_session.py).
+'''
+import asyncio
+import threading
+import time
+from collections import deque
+from ctypes import byref
+from itertools import count
+
+import numpy as np
+import usb.core
+from usb.backend import libusb1
+
+import DAC_ADC_pyusb
+from DAC_ADC_pyusb import (ADC_ASYNC_TRANSFERS, ADC_RING_SLOTS, DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, HLAF_MAX_BUFFER_SIZE,
+                           PACKET_SIZE, adcDecoder, adcHeader, makeSource, parseDACMessages)
+from adc_async_capture import LIBUSB_TRANSFER_TYPE_BULK, _timeval
+from adc_recorder import WavRecorder
+from adc_ring import SampleRing
+from delta_format import DeltaDecoder
+from sample_format import SAMPLE_BITS
+
+DRAIN_TIMEOUT = 0.01  # s, the ADC buffer is empty when nothing arrives for this long
+ACK_TIMEOUT = 1.0
+DAC_TAIL = 1.0        # s the ADC keeps recording after the DAC has played everything (the sleep in runDAC)
+
+
+# =============================================
+# ========= libusb transfers as futures
+# =============================================
+class UsbEventThread:
+    '''Handles the libusb events of the libusb1 backend in a thread that sleeps in libusb until something completes.'''
+    _instance = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, backend):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls(backend)
+            return cls._instance
+
+    def __init__(self, backend):
+        self.lib = backend.lib
+        self.ctx = backend.ctx
+        self.thread = threading.Thread(target=self._run, name='libusb events', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        tv = _timeval(0, 200000) # only to look at nothing, completions wake it up right away
+        while True:
+            libusb1._check(self.lib.libusb_handle_events_timeout(self.ctx, byref(tv)))
+
+
+class AsyncUsbDevice:
+    '''
+    Bulk transfers on a pyusb device (libusb1 backend) that complete asyncio futures.
+    submit(ep, buffer) reads into or writes from buffer depending on the direction of ep,
+    the future's result is the number of bytes transferred. cancel(future) ends the transfer early,
+    its future still gets the bytes transferred so far.
+    '''
+    def __init__(self, dev):
+        backend = dev._ctx.backend
+        if backend.__class__.__name__ != '_LibUSB':
+            raise ValueError('asyncio sessions need the libusb1 backend')
+        self.lib = backend.lib
+        self.lib.libusb_cancel_transfer.argtypes = [libusb1._libusb_transfer_p]
+        self.dev = dev
+        dev._ctx.managed_open()
+        self.handle = dev._ctx.handle.handle
+        self.events = UsbEventThread.get(backend)
+
+        self.callback = libusb1._libusb_transfer_cb_fn_p(self._callback)
+        self.keys = count(1)
+        self.transfers = {} # key -> (transfer, buffer, future, loop) until the completion reaches the loop
+        self.futures = {}   # future -> key
+
+    def submit(self, ep, buffer):
+        _, ep = self.dev._ctx.setup_request(self.dev, ep) # claims the interface like dev.read()/dev.write()
+        array = np.frombuffer(buffer, dtype=np.uint8)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = next(self.keys)
+
+        transfer_p = self.lib.libusb_alloc_transfer(0)
+        transfer = transfer_p.contents
+        transfer.dev_handle = self.handle
+        transfer.endpoint = ep.bEndpointAddress
+        transfer.type = LIBUSB_TRANSFER_TYPE_BULK
+        transfer.timeout = 0 # stay queued until the board answers
+        transfer.length = len(array)
+        transfer.buffer = array.ctypes.data
+        transfer.callback = self.callback
+        transfer.user_data = key
+        self.transfers[key] = (transfer_p, array, future, loop)
+        self.futures[future] = key
+        try:
+            libusb1._check(self.lib.libusb_submit_transfer(transfer_p))
+        except usb.core.USBError:
+            del self.transfers[key], self.futures[future]
+            self.lib.libusb_free_transfer(transfer_p)
+            raise
+        return future
+
+    def cancel(self, future):
+        key = self.futures.get(future)
+        if key is not None:
+            self.lib.libusb_cancel_transfer(self.transfers[key][0]) # fails harmlessly if already finished
+
+    def _callback(self, transfer_p):
+        # libusb event thread
+        transfer = transfer_p.contents
+        key = transfer.user_data
+        loop = self.transfers[key][3]
+        loop.call_soon_threadsafe(self._complete, key, transfer.actual_length, transfer.status)
+
+    def _complete(self, key, num_bytes, status):
+        # event loop
+        transfer_p, _, future, _ = self.transfers.pop(key)
+        del self.futures[future]
+        self.lib.libusb_free_transfer(transfer_p)
+        if status in (libusb1.LIBUSB_TRANSFER_COMPLETED, libusb1.LIBUSB_TRANSFER_TIMED_OUT, libusb1.LIBUSB_TRANSFER_CANCELLED):
+            future.set_result(num_bytes)
+        else:
+            future.set_exception(usb.core.USBError(libusb1._str_transfer_error[status], status, libusb1._transfer_errno[status]))
+
+
+async def transfer(device, ep, buffer, timeout=None):
+    '''
+    Await one transfer, returns the number of bytes. After timeout seconds the transfer is cancelled,
+    asyncio.TimeoutError is raised if nothing had arrived by then.
+    '''
+    future = device.submit(ep, buffer)
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        device.cancel(future)
+        num_bytes = await future # the buffer belongs to libusb until the transfer is finished
+        if num_bytes == 0:
+            raise
+        return num_bytes
+    except asyncio.CancelledError:
+        device.cancel(future)
+        await future
+        raise
+
+
+# =============================================
+# ========= Session
+# =============================================
+class AsyncSession:
+    '''
+    One DAC + ADC pair, devices is the list returned by getDevices() / fake_device.getFakeDevices().
+    make_device(dev) wraps a board for the transfers, fake_device.FakeAsyncDevice for the simulated ones.
+    '''
+    def __init__(self, devices, filename=None, make_device=None):
+        [self.DAC_dev, self.DAC_ep_in, self.DAC_ep_out, self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out] = devices
+        self.filename = DAC_ADC_pyusb.output_filename if filename is None else filename
+        make_device = AsyncUsbDevice if make_device is None else make_device
+        self.DAC = make_device(self.DAC_dev)
+        self.ADC = make_device(self.ADC_dev)
+        self.messages = bytearray(PACKET_SIZE) # DAC -> PC
+
+    # ----- DAC
+    async def _readMessages(self, timeout=None):
+        num_bytes = await transfer(self.DAC, self.DAC_ep_in, self.messages, timeout)
+        return bytes(self.messages[:num_bytes])
+
+    async def send_stimulus(self, source, credit_window=DAC_CREDIT_WINDOW, ready=None, finished=None):
+        '''
+        playSamples: send the samples of source (dac_source.py) after ready is set and wait until the DAC
+        has played them. Sets finished DAC_TAIL seconds later. Returns the underruns reported by the DAC.
+        '''
+        try:
+            if ready is not None:
+                await ready.wait()
+            header = source.frame_rate.to_bytes(4, byteorder='little')
+            if credit_window > 0:
+                header += credit_window.to_bytes(4, byteorder='little')
+                if source.sample_bits != SAMPLE_BITS:
+                    header += source.sample_bits.to_bytes(4, byteorder='little')
+            elif source.sample_bits != SAMPLE_BITS:
+                raise ValueError('packed samples need credit mode (credit_window > 0)')
+            await transfer(self.DAC, self.DAC_ep_out, header)
+
+            send_index = 0
+            credits = 0
+            rest = b''
+            end_of_file = False
+            while not end_of_file:
+                data = await self._readMessages()
+                if credit_window > 0:
+                    granted, _, rest = parseDACMessages(rest + data)
+                    credits += granted
+                else:
+                    credits += data.count(b'S') # one packet per 'S'
+                while credits > 0 and not end_of_file:
+                    chunk = source.read(send_index, credits*PACKET_SIZE)
+                    await transfer(self.DAC, self.DAC_ep_out, chunk)
+                    send_index += len(chunk)
+                    credits -= -(-len(chunk) // PACKET_SIZE)
+                    end_of_file = len(chunk) % PACKET_SIZE != 0
+            print('[DAC] sent', send_index, 'bytes')
+
+            # wait for the DAC to play its buffer, 'E' + underrun count
+            rest = b''
+            while True:
+                try:
+                    _, underruns, rest = parseDACMessages(rest + await self._readMessages(DRAIN_TIMEOUT if rest[:1] == b'E' else None))
+                except asyncio.TimeoutError:
+                    underruns = None # older firmware only sends a single 'E'
+                    break
+                if underruns is not None:
+                    break
+            print('[DAC] DAC timer ends, underruns: ', underruns)
+            await asyncio.sleep(DAC_TAIL)
+            return underruns
+        finally:
+            if finished is not None:
+                finished.set() # never leave the ADC recording forever
+
+    # ----- ADC
+    async def capture(self, frame_rate, filename=None, ready=None, finished=None, num_transfers=ADC_ASYNC_TRANSFERS):
+        '''
+        runADC: record into filename (the session's file by default) until finished is set,
+        with num_transfers reads queued at a time. Returns the number of samples written.
+        '''
+        filename = self.filename if filename is None else filename
+        scratch = bytearray(HLAF_MAX_BUFFER_SIZE)
+        try:
+            # 0: read all dummy data may exist in the input buffer
+            for _ in range(2):
+                try:
+                    await transfer(self.ADC, self.ADC_ep_in, scratch, DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+
+            # 1. send SR to ADC, 2. its ACK tells the sample format
+            await transfer(self.ADC, self.ADC_ep_out, adcHeader(frame_rate))
+            num_bytes = await transfer(self.ADC, self.ADC_ep_in, scratch, ACK_TIMEOUT)
+            decoder = adcDecoder(chr(scratch[0]) if num_bytes else '1')
+        finally:
+            if ready is not None:
+                ready.set() # never leave the DAC waiting forever
+
+        # 3. queued reads land in ring slots, completed in order and handed to the recorder thread
+        ring = SampleRing(ADC_RING_SLOTS, HLAF_MAX_BUFFER_SIZE, '>i2' if decoder is None else np.uint8)
+        recorder = WavRecorder(filename, frame_rate, ring, decoder)
+        pending = deque() # (future, slot) in submission order
+        stop = asyncio.ensure_future(finished.wait()) if finished is not None else asyncio.get_running_loop().create_future()
+        stopping = False
+        try:
+            while pending or not stopping:
+                while not stopping and len(pending) < num_transfers:
+                    slot = ring.try_acquire()
+                    if slot is None:
+                        break
+                    pending.append((self.ADC.submit(self.ADC_ep_in, ring.slots[slot]), slot))
+                if not pending: # the recorder is a whole ring behind, the Teensy buffers meanwhile
+                    await asyncio.sleep(0.001)
+                    continue
+
+                future, slot = pending[0]
+                await asyncio.wait((future, stop), return_when=asyncio.FIRST_COMPLETED)
+                if stop.done() and not stopping:
+                    stopping = True
+                    for other, _ in pending:
+                        self.ADC.cancel(other) # they still hand over what they already received
+                if future.done():
+                    pending.popleft()
+                    num_bytes = future.result()
+                    if num_bytes:
+                        recorder.put(ring.view(slot, num_bytes), slot)
+                    else:
+                        ring.release(slot)
+        finally:
+            stop.cancel()
+            for future, _ in pending:
+                self.ADC.cancel(future)
+            if pending:
+                await asyncio.wait([future for future, _ in pending])
+
+            # 4. stop the ADC timer and empty its buffer
+            await transfer(self.ADC, self.ADC_ep_out, b'e')
+            while True:
+                try:
+                    await transfer(self.ADC, self.ADC_ep_in, scratch, DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+            num = await asyncio.get_running_loop().run_in_executor(None, recorder.close) # joins the writer thread
+
+        if isinstance(decoder, DeltaDecoder):
+            print("[ADC] compression ratio: %.2f (%d bytes received)" % (decoder.compression_ratio, decoder.num_bytes))
+        print("[ADC] recording completed,", num, "samples saved as", filename)
+        return num
+
+    # ----- both
+    async def run(self, blocks=None, frame_rate=None, credit_window=DAC_CREDIT_WINDOW, sample_bits=DAC_SAMPLE_BITS):
+        '''
+        Play input_filename (or the int16 blocks of an iterator at frame_rate, see runDAC) and record it.
+        Returns {'samples', 'underruns', 'seconds', 'cpu_seconds', 'cpu_percent'}, the CPU time is
+        that of the whole process (100% is one core).
+        '''
+        source = makeSource(blocks, frame_rate, sample_bits)
+        ready, finished = asyncio.Event(), asyncio.Event()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            num_samples, underruns = await asyncio.gather(self.capture(source.frame_rate, None, ready, finished),
+                                                          self.send_stimulus(source, credit_window, ready, finished))
+        finally:
+            source.close()
+        return cpuStats({'samples': num_samples, 'underruns': underruns}, start, cpu_start)
+
+
+def cpuStats(stats, start, cpu_start):
+    stats['seconds'] = time.perf_counter() - start
+    stats['cpu_seconds'] = time.process_time() - cpu_start
+    stats['cpu_percent'] = 100 * stats['cpu_seconds'] / stats['seconds']
+    return stats
+
+
+async def runSessions(sessions, make_blocks=None, frame_rate=None):
+    '''
+    multi_rig.runRigs on one event loop: run all sessions at once, make_blocks() returns a new
+    stimulus iterator for every session. Returns the stats of every session and the CPU time of all.
+    '''
+    start, cpu_start = time.perf_counter(), time.process_time()
+    results = await asyncio.gather(*(session.run(make_blocks() if make_blocks is not None else None, frame_rate)
+                                     for session in sessions), return_exceptions=True)
+    stats = {'sessions': [r if isinstance(r, dict) else {'error': repr(r)} for r in results]}
+    stats['samples'] = sum(r.get('samples', 0) for r in stats['sessions'])
+    return cpuStats(stats, start, cpu_start)
+
+
+if __name__ == "__main__":
+    from DAC_ADC_pyusb import getDevices
+    print(asyncio.run(AsyncSession(getDevices()).run()))
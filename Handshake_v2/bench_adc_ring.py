@@ -0,0 +1,99 @@
+'''
+Benchmark: allocations and CPU time of the ADC read path, per read and per second of capture.
+
+  concat  ADC_pyusb.py before the ring: dev.read(), np.frombuffer(), np.concatenate() onto everything so far
+  read    runADC before the ring: dev.read() returns a new array, the recorder converts it with astype('<i2')
+  ring    readView() into a SampleRing slot, zero-copy view, converted in place, slot released
+
+The device hands over a full HLAF_MAX_BUFFER_SIZE buffer per read without waiting (a stand-in for the
+bulk endpoint, it copies the bytes in like the host controller would), and the samples are written to
+os.devnull, so only the host side is measured. Allocations are the peak of Python allocations during
+one read + store (tracemalloc), CPU time is scaled to one second of capture at SAMPLE_RATE.
+'''
+import os
+import time
+import tracemalloc
+from array import array
+
+import numpy as np
+
+from adc_ring import SampleRing, swapInPlace
+from usb_buffers import readView
+
+SAMPLE_RATE = 180000
+TRANSFER_SIZE = 40960 # HLAF_MAX_BUFFER_SIZE in DAC_ADC_pyusb.py
+RING_SLOTS = 32       # ADC_RING_SLOTS in DAC_ADC_pyusb.py
+DURATION = 10.0       # seconds of capture, the concat path is quadratic
+
+
+class BurstDevice:
+    '''Answers every bulk read with a full buffer of big-endian samples.'''
+    def __init__(self):
+        self.block = np.arange(TRANSFER_SIZE // 2).astype('>i2').tobytes()
+
+    def read(self, ep, size_or_buffer, timeout=None):
+        if isinstance(size_or_buffer, int):
+            return array('B', self.block[:size_or_buffer]) # what pyusb returns
+        size = len(size_or_buffer)
+        memoryview(size_or_buffer).cast('B')[:size] = self.block[:size]
+        return size
+
+
+def capture_concat(dev, sink, num_reads):
+    recorded_samples = np.array([], dtype=np.uint16)
+    def step():
+        nonlocal recorded_samples
+        ReadInData = dev.read(None, TRANSFER_SIZE, timeout=10)
+        np_data = np.frombuffer(ReadInData, dtype='>u2')
+        recorded_samples = np.concatenate((recorded_samples, np_data))
+    return step
+
+
+def capture_read(dev, sink, num_reads):
+    def step():
+        ReadInData = dev.read(None, TRANSFER_SIZE, timeout=10)
+        samples = np.frombuffer(ReadInData, dtype='>i2').astype('<i2')
+        sink.write(samples)
+    return step
+
+
+def capture_ring(dev, sink, num_reads):
+    ring = SampleRing(RING_SLOTS, TRANSFER_SIZE)
+    def step():
+        slot = ring.acquire()
+        num_bytes = readView(dev, None, ring.slots[slot], timeout=10)
+        samples = swapInPlace(ring.view(slot, num_bytes))
+        sink.write(samples.view(np.uint8))
+        ring.release(slot)
+    return step
+
+
+def measure(make_capture):
+    num_reads = int(DURATION * SAMPLE_RATE * 2 / TRANSFER_SIZE)
+    with open(os.devnull, 'wb') as sink:
+        # CPU time without tracemalloc, it slows every allocation down
+        step = make_capture(BurstDevice(), sink, num_reads)
+        start = time.process_time()
+        for _ in range(num_reads):
+            step()
+        cpu = time.process_time() - start
+
+        step = make_capture(BurstDevice(), sink, num_reads)
+        tracemalloc.start()
+        peaks = []
+        for _ in range(num_reads):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            step()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        tracemalloc.stop()
+    return cpu / DURATION, np.mean(peaks), peaks[-1]
+
+
+if __name__ == "__main__":
+    print(f"{DURATION:.0f} s of capture at {SAMPLE_RATE} Hz, {TRANSFER_SIZE} byte reads")
+    print(f"{'path':>7} {'CPU ms per s':>13} {'KB allocated per read':>22} {'KB at last read':>16}")
+    for name, make_capture in [('concat', capture_concat), ('read', capture_read), ('ring', capture_ring)]:
+        cpu, mean_peak, last_peak = measure(make_capture)
+        print(f"{name:>7} {cpu*1e3:>13.2f} {mean_peak/1e3:>22.1f} {last_peak/1e3:>16.1f}")
@@ -0,0 +1,71 @@
+'''
+Benchmark: host CPU time of the thread version (multi_rig.runRigs: runDAC / runADC threads per rig)
+against the asyncio sessions (async_session.runSessions: one event loop for all rigs).
+
+CPU time is time.process_time() of the whole process over the run, in % of one core.
+By default it runs on the simulated boards of fake_device.py, whose real-time simulation
+is stepped by the polling of either version, so part of the CPU time is the simulation itself.
+Set USE_FAKE_DEVICES = False to run it on the rigs found by multi_rig.findRigs().
+'''
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy.io import wavfile
+
+from async_session import AsyncSession, runSessions
+from fake_device import FakeADC, FakeAsyncDevice, countGaps, getFakeDevices
+from multi_rig import Rig, findRigs, runRigs
+from square_wave_generate import sine_blocks
+
+USE_FAKE_DEVICES = True
+NUM_RIGS = [1, 2, 4] # simulation only
+SAMPLE_RATE = 180000
+DURATION = 5.0       # seconds of stimulus per run
+
+
+def make_blocks():
+    return sine_blocks(SAMPLE_RATE, SAMPLE_RATE / 10, DURATION)
+
+
+def devices(num_rigs):
+    if USE_FAKE_DEVICES:
+        return [getFakeDevices() for _ in range(num_rigs)]
+    rigs = findRigs()
+    return [[rig.DAC_dev, rig.DAC_ep_in, rig.DAC_ep_out, rig.ADC_dev, rig.ADC_ep_in, rig.ADC_ep_out] for rig in rigs]
+
+
+def run_threads(all_devices, filenames):
+    make_transport = FakeADC.async_transport if USE_FAKE_DEVICES else None
+    rigs = [Rig("rig%d" % i, d, filename, make_transport) for i, (d, filename) in enumerate(zip(all_devices, filenames))]
+    start, cpu_start = time.perf_counter(), time.process_time()
+    stats = runRigs(rigs, make_blocks, SAMPLE_RATE)
+    return time.perf_counter() - start, time.process_time() - cpu_start, [r['underruns'] for r in stats['rigs']]
+
+
+def run_asyncio(all_devices, filenames):
+    make_device = FakeAsyncDevice if USE_FAKE_DEVICES else None
+    sessions = [AsyncSession(d, filename, make_device) for d, filename in zip(all_devices, filenames)]
+    stats = asyncio.run(runSessions(sessions, make_blocks, SAMPLE_RATE))
+    return stats['seconds'], stats['cpu_seconds'], [s.get('underruns') for s in stats['sessions']]
+
+
+if __name__ == "__main__":
+    rig_counts = NUM_RIGS if USE_FAKE_DEVICES else [len(devices(0))]
+    print(f"{'rigs':>5} {'version':>8} {'seconds':>8} {'CPU s':>7} {'CPU %':>6} {'gaps':>5}  underruns")
+    for num_rigs in rig_counts:
+        filenames = [os.path.join(tempfile.gettempdir(), "bench_async_%d.wav" % i) for i in range(num_rigs)]
+        for name, run in [('threads', run_threads), ('asyncio', run_asyncio)]:
+            with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+                seconds, cpu_seconds, underruns = run(devices(num_rigs), filenames)
+            gaps = 0
+            if USE_FAKE_DEVICES:
+                for filename in filenames:
+                    gaps += countGaps(wavfile.read(filename)[1].view(np.uint16))[0]
+            print(f"{num_rigs:>5} {name:>8} {seconds:>8.2f} {cpu_seconds:>7.2f} {100 * cpu_seconds / seconds:>6.1f} {gaps:>5}  {underruns}")
+        for filename in filenames:
+            os.remove(filename)
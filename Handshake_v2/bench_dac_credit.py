@@ -0,0 +1,48 @@
+'''
+Benchmark: maximum sustainable DAC sampling rate against credit window size.
+
+For every window the sampling rate is increased until the DAC reports underruns.
+Window 0 is the original one 'S' per packet handshake.
+By default it runs on the simulated DAC from fake_device.py (USB_LATENCY one way),
+set USE_FAKE_DEVICE = False to run it on the real board.
+'''
+import contextlib
+import io
+import time
+
+from DAC_ADC_pyusb import getDevices, playSamples
+from dac_source import BytesSource
+from fake_device import getFakeDevices
+
+USE_FAKE_DEVICE = True
+USB_LATENCY = 0.0005  # seconds, one way (simulation only)
+
+WINDOWS = [0, 1, 2, 4, 8, 16, 32, 64]
+SAMPLE_RATES = [50000, 100000, 150000, 180000, 250000, 350000, 500000, 750000, 1000000, 1500000, 2000000]
+DURATION = 0.5 # seconds of samples for each run
+
+
+def run_once(devices, frame_rate, window):
+    [DAC_dev, DAC_ep_in, DAC_ep_out] = devices[0:3]
+    source = BytesSource(bytes(int(frame_rate * DURATION) * 2), frame_rate)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): # playSamples prints progress
+        underruns = playSamples(DAC_dev, DAC_ep_in, DAC_ep_out, source, window)
+    return underruns, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    devices = getFakeDevices(dac_kwargs={"latency": USB_LATENCY}) if USE_FAKE_DEVICE else getDevices()
+
+    print(f"{'window':>8} {'max rate (S/s)':>16} {'first failing rate':>20} {'underruns':>10}")
+    for window in WINDOWS:
+        max_rate = 0
+        failed_rate, failed_underruns = None, None
+        for frame_rate in SAMPLE_RATES:
+            underruns, _ = run_once(devices, frame_rate, window)
+            if underruns:
+                failed_rate, failed_underruns = frame_rate, underruns
+                break
+            max_rate = frame_rate
+        label = 'S' if window == 0 else str(window)
+        print(f"{label:>8} {max_rate:>16} {str(failed_rate):>20} {str(failed_underruns):>10}")
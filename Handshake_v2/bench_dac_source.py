@@ -0,0 +1,85 @@
+'''
+Benchmark: memory and throughput of the DAC input path on a long test file.
+
+  old     wav.readframes() of the whole file, raw_data += padding, raw_data[i:i+PACKET_SIZE] per packet
+  mapped  MappedWavSource, memoryview pieces straight from the mapping
+
+Packets go to a null device, so only the host side is measured.
+Memory is the peak of Python allocations (tracemalloc); the mapped file lives in the OS page cache.
+'''
+import os
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+from dac_source import PACKET_SIZE, MappedWavSource
+from usb_buffers import writeView
+
+TEST_FILENAME = "bench_long_stimulus.wav"
+SAMPLE_RATE = 180000
+DURATION_MINUTES = 20 # 20 min at 180 kHz is a 432 MB file
+CREDIT_WINDOW = 16
+
+
+class NullDevice:
+    def write(self, ep, data, timeout=None):
+        return len(data)
+
+
+def make_test_file():
+    if os.path.exists(TEST_FILENAME):
+        return
+    block = (np.sin(2 * np.pi * np.arange(SAMPLE_RATE) / 10) * 32767).astype('<i2').tobytes() # 1 s
+    with wave.open(TEST_FILENAME, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        for _ in range(DURATION_MINUTES * 60):
+            wav.writeframes(block)
+
+
+def send_old(dev, packets_per_write):
+    with wave.open(TEST_FILENAME, "rb") as wav:
+        raw_data = wav.readframes(wav.getnframes())
+    if len(raw_data) % PACKET_SIZE == 0:
+        raw_data += b'\x00\x00'
+
+    send_index = 0
+    while send_index < len(raw_data):
+        chunk = raw_data[send_index:send_index + packets_per_write*PACKET_SIZE]
+        dev.write(None, chunk)
+        send_index += len(chunk)
+    return send_index
+
+
+def send_mapped(dev, packets_per_write):
+    with MappedWavSource(TEST_FILENAME) as source:
+        send_index = 0
+        while send_index < len(source):
+            chunk = source.read(send_index, packets_per_write*PACKET_SIZE)
+            writeView(dev, None, chunk)
+            send_index += len(chunk)
+            del chunk
+    return send_index
+
+
+def measure(send, packets_per_write):
+    tracemalloc.start()
+    start = time.perf_counter()
+    num_bytes = send(NullDevice(), packets_per_write)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return num_bytes, seconds, peak
+
+
+if __name__ == "__main__":
+    make_test_file()
+    print(f"test file: {os.path.getsize(TEST_FILENAME)/1e6:.0f} MB, {DURATION_MINUTES} min at {SAMPLE_RATE} Hz")
+    print(f"{'path':>8} {'packets/write':>14} {'peak MB':>9} {'seconds':>8} {'MB/s':>8}")
+    for packets_per_write in [1, CREDIT_WINDOW]:
+        for name, send in [('old', send_old), ('mapped', send_mapped)]:
+            num_bytes, seconds, peak = measure(send, packets_per_write)
+            print(f"{name:>8} {packets_per_write:>14} {peak/1e6:>9.1f} {seconds:>8.2f} {num_bytes/seconds/1e6:>8.0f}")
@@ -0,0 +1,51 @@
+'''
+Benchmark: compression ratio and host decode speed of the delta-compressed ADC stream (delta_format.py).
+
+The test signals are what we capture at SAMPLE_RATE: sines, a square wave, impulses, and noise
+for the worst case, all with a few LSB of noise like a real ADC.
+Decoding runs on one core over HLAF_MAX_BUFFER_SIZE transfers, like the recorder thread in runADC;
+it has to stay well above the sampling rate (> 400 kS/s).
+'''
+import time
+
+import numpy as np
+
+from delta_format import DeltaDecoder, encode
+
+SAMPLE_RATE = 180000
+DURATION = 5.0        # seconds of samples per signal
+TRANSFER_SIZE = 40960 # HLAF_MAX_BUFFER_SIZE in DAC_ADC_pyusb.py
+NOISE_LSB = 4         # standard deviation of the ADC noise
+
+
+def test_signals():
+    t = np.arange(int(DURATION * SAMPLE_RATE)) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    impulses = np.zeros(len(t))
+    impulses[::SAMPLE_RATE // 100] = 30000
+    signals = {
+        'sine 1 kHz': 30000 * np.sin(2 * np.pi * 1000 * t),
+        'sine 18 kHz': 30000 * np.sin(2 * np.pi * 18000 * t),
+        'sine 1 kHz, 1/10 FS': 3000 * np.sin(2 * np.pi * 1000 * t),
+        'square 1 kHz': 30000 * np.sign(np.sin(2 * np.pi * 1000 * t)),
+        'impulses 100 Hz': impulses,
+        'noise': rng.uniform(-32768, 32767, len(t)),
+    }
+    for name, signal in signals.items():
+        noisy = signal + rng.normal(0, NOISE_LSB, len(t))
+        yield name, np.clip(noisy, -32768, 32767).astype(np.int16)
+
+
+def decode_rate(stream):
+    decoder = DeltaDecoder()
+    start = time.process_time()
+    for offset in range(0, len(stream), TRANSFER_SIZE):
+        decoder.decode(stream[offset:offset + TRANSFER_SIZE])
+    return decoder.num_samples / (time.process_time() - start), decoder.compression_ratio
+
+
+if __name__ == "__main__":
+    print(f"{'signal':>20} {'ratio':>6} {'decode MS/s':>12}")
+    for name, samples in test_signals():
+        rate, ratio = decode_rate(encode(samples))
+        print(f"{name:>20} {ratio:>6.2f} {rate/1e6:>12.1f}")
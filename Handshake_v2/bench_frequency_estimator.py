@@ -0,0 +1,87 @@
+'''
+Benchmark: accuracy and time of the whole-capture frequency estimate in drift_check.py,
+estimate_frequency (FFT peak + block phase slope) against fit_sine (curve_fit on every sample).
+
+The signals are synthetic captures with a known skew: a sine at frequency * (1 + skew) with DC,
+noise, int16 samples and silence before and after the tone like a real recording.
+The skew error is the estimated minus the true skew in ppm.
+The large file is written to a temporary WAV and read memory mapped by fit_whole_sine,
+only with the FFT method (curve_fit would need several float64 copies of it).
+'''
+import os
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import numpy as np
+
+from drift_check import clock_skew, estimate_frequency, fit_sine, fit_whole_sine
+
+SAMPLE_RATE = 180000
+FREQUENCIES = [1000, 18000]
+SKEWS_PPM = [-50, -2, 0.5, 20, 100]
+DURATION = 2.0              # seconds of tone per signal
+SILENCE = 0.1               # seconds before and after the tone
+NOISE = 0.002               # rms, full scale = 1
+LARGE_FILE_SECONDS = 1200   # 1200 s at 180 kHz = 432 MB, 0 to skip
+CHUNK_SECONDS = 10          # the large file is written in chunks
+
+
+def tone(n, frequency, skew_ppm, phase, rng):
+    f = frequency * (1 + skew_ppm * 1e-6)
+    return 0.8 * np.sin(2 * np.pi * f * n / SAMPLE_RATE + phase) + 0.01 + rng.normal(0, NOISE, len(n))
+
+
+def capture(frequency, skew_ppm, rng):
+    silence = int(SILENCE * SAMPLE_RATE)
+    x = np.zeros(int(DURATION * SAMPLE_RATE) + 2 * silence)
+    x[silence:-silence] = tone(np.arange(len(x) - 2 * silence), frequency, skew_ppm, rng.uniform(0, 2 * np.pi), rng)
+    x[:silence] = rng.normal(0, NOISE, silence)
+    x[-silence:] = rng.normal(0, NOISE, silence)
+    return np.round(x * np.iinfo(np.int16).max).astype(np.int16)
+
+
+def write_large_file(filename, frequency, skew_ppm, rng):
+    chunk = int(CHUNK_SECONDS * SAMPLE_RATE)
+    phase = rng.uniform(0, 2 * np.pi)
+    with wave.open(filename, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        for start in range(0, int(LARGE_FILE_SECONDS * SAMPLE_RATE), chunk):
+            x = tone(np.arange(start, start + chunk), frequency, skew_ppm, phase, rng)
+            f.writeframes(np.round(x * np.iinfo(np.int16).max).astype(np.int16).tobytes())
+
+
+def timed(estimate, *args):
+    start = time.perf_counter()
+    f_est, _ = estimate(*args)
+    return f_est, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"{DURATION} s of tone at {SAMPLE_RATE} S/s, noise {NOISE} rms")
+    print(f"{'freq (Hz)':>10} {'skew (ppm)':>11} {'curve_fit error':>16} {'fft error':>10} {'curve_fit s':>12} {'fft s':>7}")
+    for frequency in FREQUENCIES:
+        for skew_ppm in SKEWS_PPM:
+            y = capture(frequency, skew_ppm, rng)
+            f_fit, seconds_fit = timed(fit_sine, y, SAMPLE_RATE, frequency)
+            f_fft, seconds_fft = timed(estimate_frequency, y, SAMPLE_RATE, frequency)
+            error_fit = clock_skew(f_fit, frequency)[0] - skew_ppm
+            error_fft = clock_skew(f_fft, frequency)[0] - skew_ppm
+            print(f"{frequency:>10} {skew_ppm:>11} {error_fit:>+16.4f} {error_fft:>+10.4f} {seconds_fit:>12.3f} {seconds_fft:>7.3f}")
+
+    if LARGE_FILE_SECONDS:
+        frequency, skew_ppm = FREQUENCIES[0], SKEWS_PPM[-2]
+        filename = os.path.join(tempfile.gettempdir(), "bench_frequency_estimator.wav")
+        write_large_file(filename, frequency, skew_ppm, rng)
+        size = os.path.getsize(filename)
+        tracemalloc.start()
+        f_fft, seconds = timed(fit_whole_sine, filename, frequency)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        os.remove(filename)
+        print(f"\n{LARGE_FILE_SECONDS} s file ({size / 1e6:.0f} MB): skew error {clock_skew(f_fft, frequency)[0] - skew_ppm:+.6f} ppm, "
+              f"{seconds:.2f} s ({size / 1e6 / seconds:.0f} MB/s), peak memory {peak / 1e6:.0f} MB")
@@ -0,0 +1,92 @@
+'''
+Benchmark: lod_viewer.py on a long synthetic capture (int16 sine with noise and a few single-sample
+impulses, written to a temporary WAV).
+
+- pyramid: building the min/max pyramid once, and loading it again (memory-mapped)
+- views: time to compute and render (Agg) the whole capture and zooms of 1 s, 50 ms and 20 ms (samples),
+  and whether the impulses are still visible in the whole-capture envelope
+- the old impulse_wav_visualize.py (every sample with markers) on OLD_SECONDS of the same capture
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.io import wavfile as wav
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # lod_viewer.py is shared
+from lod_viewer import VOLTS_PER_STEP, LodViewer, load_pyramid
+
+SAMPLE_RATE = 180000
+SECONDS = 3600
+OLD_SECONDS = 10
+CHUNK_SECONDS = 60
+IMPULSES = [123.456, 1800.0, 3599.9] # seconds
+
+
+def write_capture(filename):
+    # chunk by chunk, the file is larger than what we want in memory
+    rng = np.random.default_rng(0)
+    chunk = CHUNK_SECONDS * SAMPLE_RATE
+    wav.write(filename, SAMPLE_RATE, np.zeros(SECONDS * SAMPLE_RATE, dtype=np.int16)) # header and size
+    _, y = wav.read(filename, mmap=True)
+    offset = os.path.getsize(filename) - 2 * len(y)
+    out = np.memmap(filename, dtype='<i2', mode='r+', offset=offset, shape=len(y))
+    for start in range(0, len(y), chunk):
+        n = np.arange(start, start + chunk)
+        out[start:start + chunk] = np.round(8000 * np.sin(2 * np.pi * 1000 * n / SAMPLE_RATE) + rng.normal(0, 100, chunk))
+    for seconds in IMPULSES:
+        out[int(seconds * SAMPLE_RATE)] = 30000
+    out.flush()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def render(viewer, left, right):
+    viewer.ax.set_xlim(left, right) # triggers the redraw
+    viewer.ax.figure.canvas.draw()
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="bench_lod_viewer_")
+    try:
+        filename = os.path.join(directory, "output.wav")
+        write_capture(filename)
+        print(f"{SECONDS} s at {SAMPLE_RATE} S/s ({SECONDS * SAMPLE_RATE / 1e6:.0f} M samples, "
+              f"{os.path.getsize(filename) / 1e9:.2f} GB)")
+        _, seconds = timed(load_pyramid, filename)
+        print(f"build pyramid {seconds:.2f} s ({os.path.getsize(filename + '.lod.npy') / 1e6:.0f} MB)")
+        _, seconds = timed(load_pyramid, filename)
+        print(f"load pyramid  {1000 * seconds:.2f} ms")
+
+        viewer, seconds = timed(LodViewer, filename)
+        print(f"open viewer   {seconds:.2f} s")
+        print(f"{'view':>16} {'columns':>8} {'level':>6} {'render ms':>10}")
+        for name, left, right in [('whole capture', 0, SECONDS), ('1 s', 1800 - 0.5, 1800 + 0.5),
+                                  ('50 ms', 1800 - 0.025, 1800 + 0.025), ('20 ms', 1800 - 0.01, 1800 + 0.01), ('whole again', 0, SECONDS)]:
+            _, seconds = timed(render, viewer, left, right)
+            t, _, _, level = viewer.envelope(left * SAMPLE_RATE, right * SAMPLE_RATE)
+            print(f"{name:>16} {len(t):>8} {level:>6} {1000 * seconds:>10.1f}")
+        _, _, high, _ = viewer.envelope(0, SECONDS * SAMPLE_RATE)
+        print("impulses in the whole-capture envelope:", int(np.sum(high >= 30000 * VOLTS_PER_STEP - 1e-9)), "of", len(IMPULSES))
+        plt.close('all')
+
+        Fs, Y = wav.read(filename, mmap=True)
+        Y = Y[:OLD_SECONDS * Fs] / 65535.0 * 5
+        start = time.perf_counter()
+        plt.figure(figsize=(10, 4))
+        plt.plot(np.arange(len(Y)) / Fs, Y, marker='o', label="Audio Signal")
+        plt.gcf().canvas.draw()
+        print(f"old plot of {OLD_SECONDS} s ({len(Y) / 1e6:.1f} M samples): {time.perf_counter() - start:.1f} s")
+        plt.close('all')
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+'''
+Benchmark: time per run of short stimuli, one script run per stimulus against one LoopbackSession.
+
+  fresh    what every run of DAC_ADC_pyusb.py does: find the boards, new events,
+           runDAC / runADC threads (drain reads, 1 s sleep after the DAC has finished)
+  session  LoopbackSession.run() on boards opened once
+
+Both run on the simulated boards of fake_device.py (finding them costs nothing there, on the
+real rig getDevices() comes on top of every fresh run) and without the interpreter start-up.
+The session also reports how far its shortest capture reaches past the DAC's 'E' (the fake ADC sends
+in bursts like the firmware, a negative time would mean the end of the stimulus is missing).
+'''
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from DAC_ADC_pyusb import DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, runADC, runDAC
+from fake_device import FakeADC, getFakeDevices
+from loopback_session import LoopbackSession
+from square_wave_generate import sine_blocks
+
+SAMPLE_RATE = 180000
+STIMULUS_SECONDS = 0.1 # per run
+NUM_RUNS = 10
+
+
+def make_blocks(run):
+    return sine_blocks(SAMPLE_RATE, 1000.0 * (run + 1), STIMULUS_SECONDS)
+
+
+def run_fresh(filename):
+    start = time.perf_counter()
+    for run in range(NUM_RUNS):
+        [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out] = getFakeDevices()
+        ready, finished = threading.Event(), threading.Event()
+        thread_adc = threading.Thread(target=runADC, args=(ADC_dev, ADC_ep_in, ADC_ep_out, SAMPLE_RATE, filename, ready, finished),
+                                      kwargs={'make_transport': FakeADC.async_transport})
+        thread_dac = threading.Thread(target=runDAC, args=(DAC_dev, DAC_ep_in, DAC_ep_out, DAC_CREDIT_WINDOW, make_blocks(run),
+                                                           SAMPLE_RATE, DAC_SAMPLE_BITS, ready, finished))
+        thread_adc.start()
+        thread_dac.start()
+        thread_dac.join()
+        thread_adc.join()
+    return (time.perf_counter() - start) / NUM_RUNS
+
+
+def run_session(filename):
+    start = time.perf_counter()
+    session = LoopbackSession(getFakeDevices(), make_transport=FakeADC.async_transport)
+    past_end = []
+    for run in range(NUM_RUNS):
+        stats = session.run(make_blocks(run), SAMPLE_RATE, filename)
+        past_end.append(stats['samples'] / SAMPLE_RATE - stats['play_seconds'])
+    return (time.perf_counter() - start) / NUM_RUNS, session.summary(), min(past_end)
+
+
+if __name__ == "__main__":
+    filename = os.path.join(tempfile.gettempdir(), "bench_loopback_session.wav")
+    with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+        fresh = run_fresh(filename)
+        session, summary, past_end = run_session(filename)
+    os.remove(filename)
+
+    print(f"{NUM_RUNS} runs of {STIMULUS_SECONDS} s stimulus")
+    print(f"{'fresh':>8} {fresh:.3f} s per run")
+    print(f"{'session':>8} {session:.3f} s per run, setup {summary['setup_seconds']*1000:.1f} ms, "
+          f"play {summary['play_seconds']*1000:.1f} ms, teardown {summary['teardown_seconds']*1000:.1f} ms, "
+          f"overhead {summary['overhead_percent']:.1f}%")
+    print(f"{'':>8} shortest capture reaches {past_end*1000:.0f} ms past the DAC's 'E'")
@@ -0,0 +1,88 @@
+'''
+Benchmark: scaling of parallel_drift.py with the number of worker processes.
+
+1. sliding window fits (curve_fit per window) of one capture, in batches of windows
+2. whole-capture analysis (fit_whole_sine + zero crossings) of a directory of captures, one file per task
+
+Both run on synthetic int16 captures in a temporary directory, with 1, 2, 4, ... up to os.cpu_count()
+workers of a pool started beforehand (startPool, its start-up time is listed separately).
+The reference is the plain single process call. Speedup is against it, efficiency is the speedup per worker.
+'''
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from drift_check import fit_sine_over_sliding_windows
+from parallel_drift import analyze_file, analyze_files, sliding_windows_parallel, startPool
+
+SAMPLE_RATE = 180000
+FREQUENCY = 1000
+SKEW_PPM = 20
+SLIDING_SECONDS = 4.0    # ~4000 windows, a few ms each with curve_fit
+NUM_FILES = 16
+FILE_SECONDS = 30.0
+
+
+def write_capture(filename, seconds, rng):
+    n = np.arange(int(seconds * SAMPLE_RATE))
+    y = 20000 * np.sin(2 * np.pi * FREQUENCY * (1 + SKEW_PPM * 1e-6) * n / SAMPLE_RATE + 0.3) + rng.normal(0, 60, len(n))
+    wav.write(filename, SAMPLE_RATE, np.round(y).astype(np.int16))
+
+
+def worker_counts():
+    counts = [1]
+    while counts[-1] * 2 <= os.cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != os.cpu_count():
+        counts.append(os.cpu_count())
+    return counts
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def report(name, reference_seconds, runs):
+    print(f"\n{name}: single process {reference_seconds:.2f} s")
+    print(f"{'workers':>8} {'start-up':>9} {'seconds':>8} {'speedup':>8} {'efficiency':>11}")
+    for workers, startup, seconds in runs:
+        speedup = reference_seconds / seconds
+        print(f"{workers:>8} {startup:>9.2f} {seconds:>8.2f} {speedup:>8.2f} {100 * speedup / workers:>10.0f}%")
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp(prefix="bench_parallel_drift_")
+    try:
+        capture = os.path.join(directory, "sliding.wav")
+        write_capture(capture, SLIDING_SECONDS, rng)
+        Fs, y = wav.read(capture)
+        reference, reference_seconds = timed(fit_sine_over_sliding_windows, y / np.iinfo(y.dtype).max, Fs, FREQUENCY, 5, 0.2)
+        pools = {}
+        runs = []
+        for workers in worker_counts():
+            pools[workers], startup = timed(startPool, workers)
+            result, seconds = timed(sliding_windows_parallel, capture, sine_freq=FREQUENCY, step_ratio=0.2, pool=pools[workers])
+            assert np.allclose(result[0], reference[0], equal_nan=True), "results differ from the single process fit"
+            runs.append((workers, startup, seconds))
+        report(f"sliding windows, {len(reference[0])} windows", reference_seconds, runs)
+
+        files_directory = os.path.join(directory, "files")
+        os.mkdir(files_directory)
+        for k in range(NUM_FILES):
+            write_capture(os.path.join(files_directory, "capture_%02d.wav" % k), FILE_SECONDS, rng)
+        files = sorted(os.path.join(files_directory, name) for name in os.listdir(files_directory))
+        _, reference_seconds = timed(lambda: [analyze_file(f, FREQUENCY) for f in files])
+        runs = [(workers, startup, timed(analyze_files, files_directory, FREQUENCY, pool=pools[workers])[1])
+                for workers, startup, _ in runs]
+        report(f"{NUM_FILES} files of {FILE_SECONDS:.0f} s", reference_seconds, runs)
+        for pool in pools.values():
+            pool.shutdown()
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,96 @@
+'''
+Benchmark: lost ADC samples and DAC underruns in thread mode against process mode (process_mode.py).
+
+  thread        runDAC and runADC as threads of one process, like main()
+  ADC process   runDAC thread, ADC reader process + recorder in the main process
+  both          DAC sender and ADC reader processes
+
+Both run on the simulated boards of fake_device.py at increasing sampling rates, with LOAD_THREADS
+threads of pure-Python work next to them (a stand-in for plots and analysis in the same program),
+which hold the GIL for up to sys.getswitchinterval() at a time. Lost samples are counted by the
+simulated ADC (its ring buffer was overwritten before PC read it), gaps are checked in the file.
+The child processes print their progress, the table comes at the end.
+'''
+import contextlib
+import io
+import os
+import tempfile
+import threading
+from functools import partial
+
+import numpy as np
+from scipy.io import wavfile
+
+from DAC_ADC_pyusb import DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, runADC, runDAC
+from fake_device import FakeADC, countGaps, getFakeDevices, openFakeADC, openFakeDAC
+from process_mode import runADCProcess, runDACProcess
+from square_wave_generate import sine_blocks
+
+SAMPLE_RATES = [180000, 360000, 720000, 1440000]
+DURATION = 3.0   # seconds of stimulus per run
+LOAD_THREADS = 1 # busy pure-Python threads in the main process
+MODES = ['thread', 'ADC process', 'both']
+
+
+def busy(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(10000))
+
+
+def run_once(mode, frame_rate, filename):
+    make_blocks = partial(sine_blocks, frame_rate, frame_rate / 10, DURATION)
+    ready, finished = threading.Event(), threading.Event()
+    result = {}
+
+    if mode == 'thread':
+        [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out] = getFakeDevices()
+        def adc():
+            result['samples'] = runADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate, filename, ready, finished,
+                                       make_transport=FakeADC.async_transport)
+            result['lost'] = ADC_dev.lost
+    else:
+        def adc():
+            result['samples'], stats = runADCProcess(openFakeADC, frame_rate, filename, ready, finished,
+                                                     make_transport=FakeADC.async_transport)
+            result['lost'] = stats['lost']
+
+    if mode == 'both':
+        def dac():
+            result['underruns'] = runDACProcess(openFakeDAC, DAC_CREDIT_WINDOW, make_blocks, frame_rate, DAC_SAMPLE_BITS,
+                                                ready, finished)
+    else:
+        if mode != 'thread':
+            [DAC_dev, DAC_ep_in, DAC_ep_out] = openFakeDAC()
+        def dac():
+            result['underruns'] = runDAC(DAC_dev, DAC_ep_in, DAC_ep_out, DAC_CREDIT_WINDOW, make_blocks(), frame_rate,
+                                         DAC_SAMPLE_BITS, ready, finished)
+
+    stop = threading.Event()
+    load = [threading.Thread(target=busy, args=(stop,)) for _ in range(LOAD_THREADS)]
+    threads = [threading.Thread(target=adc), threading.Thread(target=dac)]
+    with contextlib.redirect_stdout(io.StringIO()): # runDAC / runADC print progress
+        for thread in load + threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        for thread in load:
+            thread.join()
+
+    _, samples = wavfile.read(filename)
+    result['gaps'] = countGaps(samples.view(np.uint16))[0]
+    return result
+
+
+if __name__ == "__main__":
+    filename = os.path.join(tempfile.gettempdir(), "bench_process_mode.wav")
+    rows = []
+    for frame_rate in SAMPLE_RATES:
+        for mode in MODES:
+            r = run_once(mode, frame_rate, filename)
+            rows.append(f"{frame_rate:>10} {mode:>12} {r['samples']:>9} {r['lost']:>9} {r['gaps']:>5} {str(r['underruns']):>10}")
+    os.remove(filename)
+
+    print(f"{LOAD_THREADS} busy thread(s), simulated ADC buffer {FakeADC().ring_size} bytes")
+    print(f"{'rate (S/s)':>10} {'mode':>12} {'samples':>9} {'lost':>9} {'gaps':>5} {'underruns':>10}")
+    print("\n".join(rows))
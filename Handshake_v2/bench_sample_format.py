@@ -0,0 +1,58 @@
+'''
+Benchmark: USB traffic and host CPU cost of the packed sample formats (sample_format.py).
+
+For every width it prints the bytes per second on the link at SAMPLE_RATE, the highest sampling rate
+that fits into the bandwidth 16-bit samples need at SAMPLE_RATE, and the CPU time per second of
+capture/playback to unpack the ADC stream (in HLAF_MAX_BUFFER_SIZE transfers) and pack the DAC blocks.
+'''
+import time
+
+import numpy as np
+
+from sample_format import PACKED_BITS, SAMPLE_BITS, PackedDecoder, PackedEncoder, pack, packedSize
+
+SAMPLE_RATE = 180000
+DURATION = 10.0       # seconds of samples
+TRANSFER_SIZE = 40960 # HLAF_MAX_BUFFER_SIZE in DAC_ADC_pyusb.py
+BLOCK_SIZE = 65536    # square_wave_generate.BLOCK_SIZE
+
+
+def cpu_per_second(function, *args):
+    start = time.process_time()
+    function(*args)
+    return (time.process_time() - start) / DURATION
+
+
+def unpack_stream(stream, sample_bits):
+    decoder = PackedDecoder(sample_bits)
+    for start in range(0, len(stream), TRANSFER_SIZE):
+        decoder.decode(stream[start:start + TRANSFER_SIZE])
+
+
+def pack_blocks(samples, sample_bits):
+    encoder = PackedEncoder(sample_bits)
+    for start in range(0, len(samples), BLOCK_SIZE):
+        encoder.encode(samples[start:start + BLOCK_SIZE])
+    encoder.flush()
+
+
+if __name__ == "__main__":
+    num_samples = int(DURATION * SAMPLE_RATE)
+    samples = (np.sin(2 * np.pi * np.arange(num_samples) / 10) * 32767).astype(np.int16)
+    budget = SAMPLE_RATE * 2 # bytes per second of 16-bit samples
+
+    print(f"{'bits':>5} {'kB/s at ' + str(SAMPLE_RATE//1000) + ' kHz':>16} {'headroom':>9} {'max rate kHz':>13} {'unpack ms/s':>12} {'pack ms/s':>10}")
+    for sample_bits in (SAMPLE_BITS,) + PACKED_BITS[::-1]:
+        byte_rate = packedSize(SAMPLE_RATE, sample_bits)
+        if sample_bits == SAMPLE_BITS:
+            stream = samples.astype('>i2').tobytes()
+            unpack_cpu = cpu_per_second(lambda: [np.frombuffer(stream[i:i + TRANSFER_SIZE], dtype='>i2').astype('<i2')
+                                                 for i in range(0, len(stream), TRANSFER_SIZE)])
+            pack_cpu = cpu_per_second(lambda: [samples[i:i + BLOCK_SIZE].astype('<i2').tobytes()
+                                               for i in range(0, len(samples), BLOCK_SIZE)])
+        else:
+            stream = pack(samples, sample_bits)
+            unpack_cpu = cpu_per_second(unpack_stream, stream, sample_bits)
+            pack_cpu = cpu_per_second(pack_blocks, samples, sample_bits)
+        print(f"{sample_bits:>5} {byte_rate/1e3:>16.0f} {1 - byte_rate/budget:>9.1%} {budget*8/sample_bits/1e3:>13.0f}"
+              f" {unpack_cpu*1e3:>12.2f} {pack_cpu*1e3:>10.2f}")
@@ -0,0 +1,91 @@
+'''
+Benchmark: writing a stimulus WAV file the gen_sine_wave / gen_sharp_square_wave way (the whole
+duration as float64 arrays, then wav.write) against write_sine_wave / write_square_wave
+(int16 blocks of BLOCK_SIZE samples streamed to the file).
+
+Time is wall clock including the write to a temporary directory, memory is the peak traced by
+tracemalloc (numpy arrays included). 18 kHz at 180 kHz has a period of 10 samples (copied from one
+period), 1000.0123 Hz has not (sin of every block).
+The last block of an 8 hour sine is compared to the exact value computed from the sample index
+with fractions, to show the phase does not drift.
+'''
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from fractions import Fraction
+
+import numpy as np
+from scipy.io import wavfile as wav
+
+from square_wave_generate import BLOCK_SIZE, sine_blocks, write_sine_wave, write_square_wave
+
+SAMPLE_RATE = 180000
+DURATIONS = [30, 300]
+SOAK_HOURS = 8
+
+
+def old_sine(filename, sample_rate, frequency, duration):
+    # gen_sine_wave with parameters
+    num_samples = int(sample_rate * duration)
+    t = np.linspace(0, duration, num_samples, endpoint=False)
+    sine_wave = np.sin(2 * np.pi * frequency * t)
+    max_int16 = np.iinfo(np.int16).max
+    wav.write(filename, sample_rate, (sine_wave * max_int16).astype(np.int16))
+
+
+def old_square(filename, sample_rate, frequency, duration):
+    # gen_sharp_square_wave with parameters
+    num_samples = int(sample_rate * duration)
+    samples_per_cycle = int(sample_rate // frequency)
+    half_cycle = samples_per_cycle // 2
+    square_wave = np.tile(np.concatenate((np.ones(half_cycle), np.zeros(half_cycle))), num_samples // samples_per_cycle)
+    max_int16 = np.iinfo(np.int16).max
+    wav.write(filename, sample_rate, (square_wave * max_int16).astype(np.int16))
+
+
+def measure(write, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    write(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def soak_error(frequency):
+    # the last block of SOAK_HOURS hours against sin(2 pi frequency n / Fs) with the phase reduced exactly
+    num_samples = SOAK_HOURS * 3600 * SAMPLE_RATE
+    first = (num_samples - 1) // BLOCK_SIZE * BLOCK_SIZE
+    step = Fraction(frequency) / SAMPLE_RATE
+    exact = np.array([np.sin(2 * np.pi * float((n * step) % 1)) for n in range(first, num_samples)])
+    exact = (exact * np.iinfo(np.int16).max).astype(np.int16)
+    for last in sine_blocks(SAMPLE_RATE, frequency, SOAK_HOURS * 3600):
+        pass
+    return np.max(np.abs(last.astype(np.int32) - exact))
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="bench_stimulus_writer_")
+    try:
+        filename = os.path.join(directory, "stimulus.wav")
+        print(f"{'signal':>22} {'duration':>9} {'version':>10} {'seconds':>8} {'MS/s':>6} {'peak MB':>8}")
+        runs = [('sine 18000 Hz', old_sine, write_sine_wave, 18000.0),
+                ('sine 1000.0123 Hz', old_sine, write_sine_wave, 1000.0123),
+                ('square 18000 Hz', old_square, write_square_wave, 18000.0)]
+        for duration in DURATIONS:
+            for name, old, new, frequency in runs:
+                for version, write in (('whole', old), ('streamed', new)):
+                    seconds, peak = measure(write, filename, SAMPLE_RATE, frequency, duration)
+                    print(f"{name:>22} {duration:>8}s {version:>10} {seconds:>8.2f} "
+                          f"{SAMPLE_RATE * duration / seconds / 1e6:>6.0f} {peak / 1e6:>8.1f}")
+                    if version == 'streamed':
+                        Fs, y = wav.read(filename, mmap=True)
+                        assert Fs == SAMPLE_RATE and len(y) == int(SAMPLE_RATE * duration)
+                        del y
+        for frequency in (18000.0, 1000.0123):
+            print(f"after {SOAK_HOURS} h at {frequency} Hz: max error of the last block {soak_error(frequency)} LSB")
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,64 @@
+'''
+Benchmark: the zero crossing frequency of cal_sin, the old way (whole file as float64, np.where,
+integer sample times) against zero_crossing.py (memory mapped chunks, interpolated times).
+
+The file is a synthetic int16 tone with noise at a known frequency, written to a temporary WAV.
+Throughput is samples per second of CPU time on one core, memory is the peak traced by tracemalloc
+(numpy arrays included, the memory map is not).
+'''
+import os
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from zero_crossing import wav_period_stats
+
+SAMPLE_RATE = 180000
+FREQUENCY = 1000.0123
+SECONDS = 600          # 108 M samples, 216 MB
+NOISE = 100            # rms in int16 steps
+HYSTERESIS = 0.01      # full scale
+
+
+def write_file(filename):
+    rng = np.random.default_rng(0)
+    n = np.arange(int(SECONDS * SAMPLE_RATE))
+    y = 20000 * np.sin(2 * np.pi * FREQUENCY * n / SAMPLE_RATE) + rng.normal(0, NOISE, len(n))
+    wav.write(filename, SAMPLE_RATE, np.round(y).astype(np.int16))
+
+
+def old_cal_sin(filename):
+    Fs, Y = wav.read(filename)
+    Y = Y/np.iinfo(np.int16).max
+    zero_crossings = np.where((Y[:-1] < 0) & (Y[1:] >= 0))[0]
+    return {'frequency': 1 / np.mean(np.diff(zero_crossings) / Fs), 'crossings': len(zero_crossings)}
+
+
+def measure(estimate, *args, **kwargs):
+    tracemalloc.start()
+    start = time.process_time()
+    stats = estimate(*args, **kwargs)
+    seconds = time.process_time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return stats, seconds, peak
+
+
+if __name__ == "__main__":
+    filename = os.path.join(tempfile.gettempdir(), "bench_zero_crossing.wav")
+    write_file(filename)
+    num_samples = int(SECONDS * SAMPLE_RATE)
+    print(f"{SECONDS} s at {SAMPLE_RATE} S/s ({num_samples / 1e6:.0f} M samples), {FREQUENCY} Hz, noise {NOISE} rms")
+    print(f"{'version':>24} {'crossings':>10} {'error (ppm)':>12} {'CPU s':>7} {'MS/s':>6} {'peak MB':>8}")
+    runs = [('np.where (old)', old_cal_sin, {}),
+            ('linear', wav_period_stats, {}),
+            ('cubic', wav_period_stats, {'interpolation': 'cubic'}),
+            ('cubic + hysteresis', wav_period_stats, {'interpolation': 'cubic', 'hysteresis': HYSTERESIS})]
+    for name, estimate, kwargs in runs:
+        stats, seconds, peak = measure(estimate, filename, **kwargs)
+        error = (stats['frequency'] / FREQUENCY - 1) * 1e6
+        print(f"{name:>24} {stats['crossings']:>10} {error:>+12.4f} {seconds:>7.2f} {num_samples / seconds / 1e6:>6.0f} {peak / 1e6:>8.0f}")
+    os.remove(filename)
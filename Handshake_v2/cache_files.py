@@ -0,0 +1,46 @@
+'''
+The files of an on-disk cache (analysis_cache.py, stimulus_cache.py): content hashes, and the least
+recently used entries deleted once a directory grows beyond its size cap. An entry's mtime is its
+last use, the caches refresh it on every hit.
+
+Usage:
+    digest = fileHash("output.wav")                           # blake2b of the content, hex
+    evict(".stimulus_cache", '.stim', 4 << 30, keep=path)      # after storing path
+    print(cacheSize(".stimulus_cache", '.stim'))
+'''
+import hashlib
+import os
+
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def fileHash(path):
+    '''blake2b of the file content, read in chunks (hashlib.file_digest needs Python 3.11).'''
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evict(directory, suffix, max_bytes, keep):
+    '''Delete the least recently used `suffix` files of directory until they fit in max_bytes (keep stays).'''
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix) and entry.path != keep:
+            st = entry.stat()
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + os.path.getsize(keep)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path) # a process still mapping it keeps its pages until it is closed
+        except OSError:
+            pass # another process removed it
+        total -= size
+
+
+def cacheSize(directory, suffix):
+    '''Bytes of the `suffix` files of directory.'''
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(suffix))
@@ -0,0 +1,118 @@
+'''
+Fake-device check for the asynchronous ADC capture.
+
+Captures a ramp from fake_device.FakeADC at 180 kHz (the rate of input_filename) with
+  1. the synchronous loop used in runADC (one dev.read at a time)
+  2. AsyncBulkReader with ASYNC_NUM_TRANSFERS queued transfers
+while the consumer stalls every second (like a slow disk write or plotting would),
+and counts the gaps in the received ramp. The asynchronous capture must have none.
+Then a resubmit fails (the FAILED_SUBMIT-th submit raises USBError): the reader must count
+exactly the transfers still queued, and none with every slot back in the ring after stop().
+'''
+import sys
+import time
+
+import numpy as np
+import usb.core
+
+from adc_async_capture import ASYNC_NUM_TRANSFERS, AsyncBulkReader
+from adc_ring import SampleRing
+from fake_device import FakeADC, FakeEndpoint, countGaps
+
+SAMPLE_RATE = 180000
+DURATION = 3.0        # seconds of capture
+STALL = 0.3           # seconds the consumer blocks once per second, longer than the Teensy ring buffer (0.23 s)
+TRANSFER_SIZE = 40960 # HLAF_MAX_BUFFER_SIZE in DAC_ADC_pyusb.py
+FAILED_SUBMIT = ASYNC_NUM_TRANSFERS + 6 # the 6th resubmit
+
+
+def start_fake_adc():
+    ADC_dev, ADC_ep_in, ADC_ep_out = FakeADC(), FakeEndpoint(0x84), FakeEndpoint(0x03)
+    ADC_dev.write(ADC_ep_out, SAMPLE_RATE.to_bytes(4, byteorder='little'))
+    ADC_dev.read(ADC_ep_in, 512, timeout=1000) # '1' ACK
+    return ADC_dev, ADC_ep_in, ADC_ep_out
+
+
+def make_consumer(recorded_samples_list, ring=None):
+    next_stall = [time.perf_counter() + 1.0]
+    def consumer(ReadInData, slot=None):
+        recorded_samples_list.append(np.frombuffer(ReadInData, dtype='>i2').copy())
+        if slot is not None:
+            ring.release(slot)
+        if time.perf_counter() > next_stall[0]:
+            time.sleep(STALL)
+            next_stall[0] += 1.0
+    return consumer
+
+
+def capture_sync():
+    ADC_dev, ADC_ep_in, ADC_ep_out = start_fake_adc()
+    recorded_samples_list = []
+    consumer = make_consumer(recorded_samples_list)
+
+    end = time.perf_counter() + DURATION
+    while time.perf_counter() < end:
+        try:
+            consumer(ADC_dev.read(ADC_ep_in, TRANSFER_SIZE, timeout=10))
+        except usb.core.USBTimeoutError:
+            continue
+    ADC_dev.write(ADC_ep_out, 'e')
+    return np.concatenate(recorded_samples_list), None
+
+
+def capture_async():
+    ADC_dev, ADC_ep_in, ADC_ep_out = start_fake_adc()
+    recorded_samples_list = []
+    ring = SampleRing(4 * ASYNC_NUM_TRANSFERS, TRANSFER_SIZE)
+    reader = AsyncBulkReader(ADC_dev, ADC_ep_in, make_consumer(recorded_samples_list, ring),
+                             transport=ADC_dev.async_transport(ASYNC_NUM_TRANSFERS, TRANSFER_SIZE), ring=ring)
+    reader.start()
+    end = time.perf_counter() + DURATION
+    while time.perf_counter() < end:
+        reader.poll(0.01)
+    reader.stop()
+    ADC_dev.write(ADC_ep_out, 'e')
+    return np.concatenate(recorded_samples_list), reader
+
+
+def failed_resubmit():
+    # (transfers counted in flight, queued) when the error is raised, then (in flight, free slots) after stop()
+    ADC_dev, ADC_ep_in, ADC_ep_out = start_fake_adc()
+    ring = SampleRing(4 * ASYNC_NUM_TRANSFERS, TRANSFER_SIZE)
+    transport = ADC_dev.async_transport(ASYNC_NUM_TRANSFERS, TRANSFER_SIZE)
+    submit, submits = transport.submit, [0]
+    def failing_submit(index, buffer):
+        submits[0] += 1
+        if submits[0] == FAILED_SUBMIT:
+            raise usb.core.USBError('submit failed on purpose')
+        submit(index, buffer)
+    transport.submit = failing_submit
+    reader = AsyncBulkReader(ADC_dev, ADC_ep_in, lambda data, slot: ring.release(slot), transport=transport, ring=ring)
+    reader.start()
+    try:
+        while True:
+            reader.poll(0.01)
+    except usb.core.USBError:
+        at_error = (reader.in_flight, len(transport.queue))
+    finally:
+        reader.stop()
+    ADC_dev.write(ADC_ep_out, 'e')
+    return at_error, (reader.in_flight, ring.free.qsize())
+
+
+if __name__ == "__main__":
+    print(f"{'mode':>6} {'samples':>10} {'gaps':>6} {'lost samples':>13} {'min queued':>11}")
+    for name, capture in [('sync', capture_sync), ('async', capture_async)]:
+        samples, reader = capture()
+        num_gaps, num_lost = countGaps(samples)
+        min_queued = '-' if reader is None else reader.min_in_flight
+        print(f"{name:>6} {len(samples):>10} {num_gaps:>6} {num_lost:>13} {min_queued:>11}")
+
+    if num_gaps > 0: # result of the asynchronous capture
+        sys.exit("asynchronous capture lost samples")
+
+    (in_flight, queued), (in_flight_after, free) = failed_resubmit()
+    print(f"failed resubmit: {in_flight} in flight for {queued} queued, after stop() {in_flight_after} in flight, "
+          f"{free} of {4 * ASYNC_NUM_TRANSFERS} slots free")
+    if in_flight != queued or in_flight_after != 0 or free != 4 * ASYNC_NUM_TRANSFERS:
+        sys.exit("transfers miscounted after a failed resubmit")
@@ -0,0 +1,88 @@
+'''
+Check analysis_cache.py: time of the first (computed) and second (cached) call of every analysis on a
+synthetic capture, that cached results equal the computed ones, that a changed file is recomputed,
+a copied one is not, and that the least recently used results go once the size cap is reached.
+Runs in a temporary directory. Exits with an error if any of these does not hold.
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from analysis_cache import AnalysisCache
+
+SAMPLE_RATE = 180000
+FREQUENCY = 1000
+SECONDS = 10.0
+
+
+def write_capture(filename, skew_ppm):
+    rng = np.random.default_rng(0)
+    n = np.arange(int(SECONDS * SAMPLE_RATE))
+    y = 20000 * np.sin(2 * np.pi * FREQUENCY * (1 + skew_ppm * 1e-6) * n / SAMPLE_RATE) + rng.normal(0, 60, len(n))
+    wav.write(filename, SAMPLE_RATE, np.round(y).astype(np.int16))
+
+
+def same(a, b):
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, (tuple, list, np.ndarray)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b or (np.isnan(a) and np.isnan(b))
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="check_analysis_cache_")
+    try:
+        capture = os.path.join(directory, "output.wav")
+        write_capture(capture, 20)
+        cache = AnalysisCache(os.path.join(directory, "cache"))
+        calls = [('fit_whole_sine', cache.fit_whole_sine, (capture, FREQUENCY), {}),
+                 ('fit_whole_sine curve_fit', cache.fit_whole_sine, (capture, FREQUENCY, 'curve_fit'), {}),
+                 ('sliding windows', cache.fit_sine_over_sliding_windows, (capture, FREQUENCY, 5, 0.2), {'return_mse': True}),
+                 ('wav_period_stats', cache.wav_period_stats, (capture,), {'interpolation': 'cubic'})]
+        failures = []
+        print(f"{'analysis':>26} {'computed s':>11} {'cached ms':>10}  same")
+        for name, call, args, kwargs in calls:
+            computed, seconds = timed(call, *args, **kwargs)
+            cached, cached_seconds = timed(call, *args, **kwargs)
+            print(f"{name:>26} {seconds:>11.3f} {1000 * cached_seconds:>10.2f}  {same(computed, cached)}")
+            if not same(computed, cached):
+                failures.append(f"cached {name} differs")
+        print("hits", cache.hits, "misses", cache.misses, "cache size %.1f kB" % (cache.size() / 1e3))
+
+        copy = os.path.join(directory, "copy.wav")
+        shutil.copy(capture, copy)
+        misses = cache.misses
+        cache.fit_whole_sine(copy, FREQUENCY)
+        print("copied file recomputed:", cache.misses > misses)
+        if cache.misses > misses:
+            failures.append("copied file recomputed")
+        write_capture(capture, -5)
+        misses = cache.misses
+        f_est, _ = cache.fit_whole_sine(capture, FREQUENCY)
+        print("changed file recomputed:", cache.misses > misses, "skew %.3f ppm" % ((f_est / FREQUENCY - 1) * 1e6))
+        if cache.misses == misses:
+            failures.append("changed file not recomputed")
+
+        small = AnalysisCache(os.path.join(directory, "small"), max_bytes=1)
+        small.fit_whole_sine(capture, FREQUENCY)
+        small.wav_period_stats(capture)
+        entries = len([e for e in os.listdir(small.directory) if e.endswith('.npz')])
+        print("entries left with a 1 byte cap (the last one stays):", entries)
+        if entries != 1:
+            failures.append(f"{entries} entries left with a 1 byte cap")
+    finally:
+        shutil.rmtree(directory)
+    if failures:
+        sys.exit("; ".join(failures))
@@ -0,0 +1,33 @@
+'''
+Check delta_format.py: encode / decode round trip over arbitrary lengths, so the very last packet
+holds a short block (what the firmware sends when it flushes at stop), with full-scale noise
+(widest blocks, nearly full packets) and a slow sine (narrow blocks, many per packet), decoded at once
+and through DeltaDecoder in pieces of any size. FakeADC only sends whole blocks, bench_delta_format.py
+does not get there. Exits with an AssertionError on the first mismatch.
+'''
+import numpy as np
+
+from delta_format import BLOCK_SAMPLES, DeltaDecoder, decode, encode
+
+MAX_LENGTH = 2000
+PIECE_SIZES = [512, 1000, 40960] # bytes handed to DeltaDecoder at a time
+
+
+def signals(n, rng):
+    yield 'noise', rng.integers(-32768, 32768, n).astype(np.int16)
+    yield 'sine', np.round(3000 * np.sin(np.arange(n) / 50)).astype(np.int16)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    checked = 0
+    for n in range(1, MAX_LENGTH + 1):
+        for name, samples in signals(n, rng):
+            data = encode(samples)
+            assert np.array_equal(decode(data), samples), f"{name}, {n} samples: decode differs"
+            piece = PIECE_SIZES[n % len(PIECE_SIZES)]
+            decoder = DeltaDecoder()
+            pieces = [decoder.decode(data[k:k + piece]) for k in range(0, len(data), piece)]
+            assert np.array_equal(np.concatenate(pieces), samples), f"{name}, {n} samples: DeltaDecoder differs"
+            checked += 1
+    print(f"{checked} round trips of 1 to {MAX_LENGTH} samples (last block of 1 to {BLOCK_SAMPLES}) OK")
@@ -0,0 +1,124 @@
+'''
+Check framed_format.py:
+
+1. decode speed of FramedDecoder over HLAF_MAX_BUFFER_SIZE transfers, against the byte swap of the plain stream
+2. dropouts put into an encoded ramp on purpose (packets lost on USB, a jump of the sample counter
+   like a Teensy overflow): every one must be found at its place, with the right size
+3. runADC with ADC_FRAMED on the simulated ADC of fake_device.py at rising sampling rates, with a
+   small ring so it overflows once the host cannot keep up: the gaps saved next to the WAV file
+   against the samples FakeADC dropped before the last sample recorded (later ones have no header
+   after them to show them), and the WAV file against the ramp
+
+Exits with an error if any of these comparisons fails.
+'''
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+import DAC_ADC_pyusb
+from DAC_ADC_pyusb import GAPS_SUFFIX, HLAF_MAX_BUFFER_SIZE, runADC
+from fake_device import FakeADC, getFakeDevices
+from framed_format import FRAME_SAMPLES, PACKET_SIZE, FramedDecoder, encode
+
+SAMPLE_RATE = 180000
+DURATION = 10.0          # seconds of samples for 1. and 2.
+RUN_SECONDS = 1.0
+FAKE_RATES = [180000, 1000000, 4000000, 16000000]
+FAKE_RING_SIZE = 8192    # 16 packets
+
+
+def decode_all(stream, decoder):
+    return np.concatenate([decoder.decode(stream[offset:offset + HLAF_MAX_BUFFER_SIZE])
+                           for offset in range(0, len(stream), HLAF_MAX_BUFFER_SIZE)])
+
+
+def ramp_positions(samples, gaps):
+    '''True if every sample is the ramp value of its index on the ADC, given the gaps.'''
+    step = np.ones(len(samples), dtype=np.int64)
+    for gap in gaps:
+        step[gap['sample']] += gap['missing_samples']
+    index = np.cumsum(step) - 1
+    return np.array_equal(samples.astype(np.uint16), (index % 65536).astype(np.uint16))
+
+
+def run_fake(frame_rate, filename):
+    [_, _, _, ADC_dev, ADC_ep_in, ADC_ep_out] = getFakeDevices(adc_kwargs={'ring_size': FAKE_RING_SIZE})
+    ready, finished = threading.Event(), threading.Event()
+    timer = threading.Timer(RUN_SECONDS, finished.set)
+    with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+        ready_timer = threading.Thread(target=lambda: ready.wait() and timer.start())
+        ready_timer.start()
+        runADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate, filename, ready, finished, make_transport=FakeADC.async_transport)
+        ready_timer.join()
+    return ADC_dev
+
+
+if __name__ == "__main__":
+    failures = []
+    ramp = np.arange(int(DURATION * SAMPLE_RATE)) % 65536
+    stream = encode(ramp)
+
+    print("1. decode speed")
+    plain = ramp.astype('>i2').tobytes()
+    start = time.process_time()
+    for offset in range(0, len(plain), HLAF_MAX_BUFFER_SIZE):
+        np.frombuffer(plain[offset:offset + HLAF_MAX_BUFFER_SIZE], dtype='>i2').astype('<i2')
+    swap = len(ramp) / (time.process_time() - start)
+    decoder = FramedDecoder()
+    start = time.process_time()
+    samples = decode_all(stream, decoder)
+    framed = len(samples) / (time.process_time() - start)
+    print(f"   plain byte swap {swap / 1e6:.1f} MS/s, framed {framed / 1e6:.1f} MS/s, "
+          f"{decoder.num_gaps} gaps, samples equal: {np.array_equal(samples, ramp.astype(np.int16))}")
+    if not np.array_equal(samples, ramp.astype(np.int16)) or decoder.num_gaps:
+        failures.append("1. decoded stream differs from the ramp")
+
+    print("2. dropouts on purpose")
+    packets = [stream[k:k + PACKET_SIZE] for k in range(0, len(stream), PACKET_SIZE)]
+    lost = {1000: 1, 2500: 3} # packet index -> packets lost on USB from there
+    kept = [p for k, p in enumerate(packets)
+            if not any(first <= k < first + n for first, n in lost.items())]
+    # a Teensy overflow before packet 4000: 700 samples dropped, the sequence numbers go on
+    overflow_packet, overflow_samples = 4000, 700
+    index = overflow_packet - sum(lost.values())
+    first_sample = overflow_packet * FRAME_SAMPLES + overflow_samples
+    tail = encode(np.arange(first_sample, first_sample + 100 * FRAME_SAMPLES) % 65536, first_sample, overflow_packet)
+    damaged = b''.join(kept[:index]) + tail
+    decoder = FramedDecoder()
+    samples = decode_all(damaged, decoder)
+    for gap in decoder.gaps:
+        print("  ", gap)
+    expected = [(1000 * FRAME_SAMPLES, FRAME_SAMPLES, 1), (2499 * FRAME_SAMPLES, 3 * FRAME_SAMPLES, 3),
+                ((overflow_packet - 4) * FRAME_SAMPLES, overflow_samples, 0)]
+    found = [(g['sample'], g['missing_samples'], g['lost_packets']) for g in decoder.gaps]
+    print(f"   as put in: {found == expected}, samples at their place: {ramp_positions(samples, decoder.gaps)}")
+    if found != expected or not ramp_positions(samples, decoder.gaps):
+        failures.append("2. dropouts not found as put in")
+
+    print("3. fake ADC, ring of %d packets" % (FAKE_RING_SIZE // PACKET_SIZE))
+    DAC_ADC_pyusb.ADC_FRAMED = True
+    filename = os.path.join(tempfile.gettempdir(), "check_framed_format.wav")
+    print(f"   {'S/s':>9} {'samples':>9} {'missing':>9} {'dropped by FakeADC':>19} {'gaps':>5}  at their place")
+    for frame_rate in FAKE_RATES:
+        ADC_dev = run_fake(frame_rate, filename)
+        with open(filename + GAPS_SUFFIX) as f:
+            gaps = json.load(f)
+        _, samples = wav.read(filename)
+        dropped = sum(n for first, n in ADC_dev.dropouts if first < gaps['device_samples'])
+        print(f"   {frame_rate:>9} {len(samples):>9} {gaps['missing_samples']:>9} {dropped:>19} {gaps['gaps']:>5}  "
+              f"{ramp_positions(samples, gaps['gap_list'])}")
+        if gaps['missing_samples'] != dropped or not ramp_positions(samples, gaps['gap_list']):
+            failures.append(f"3. {frame_rate} S/s: gaps differ from the samples FakeADC dropped")
+    os.remove(filename)
+    os.remove(filename + GAPS_SUFFIX)
+
+    if failures:
+        sys.exit("; ".join(failures))
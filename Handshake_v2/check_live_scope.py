@@ -0,0 +1,160 @@
+'''
+Check live_scope.py without a display (Agg):
+
+1. the writer side never waits: time of LiveScope.update per 20480-sample buffer at 180 kS/s, with
+   nobody drawing and with a GUI thread that takes 1 s per frame, and the buffers dropped meanwhile
+2. the trigger: a 1 kHz sine with noise in buffers of random size, the phase of the tone at the
+   trigger of every frame (0 degrees is the rising zero crossing), at TRIGGER_RATES: every sample
+   a column, and several samples per column
+3. the cost of a frame (compute + Agg render) at sample rates from 50 kS/s to 5 MS/s, 5 ms across the screen
+4. a capture on the simulated boards of fake_device.py with a scope on runADC: the scope got every sample
+
+Exits with an error if an update takes more than UPDATE_LIMIT of a buffer, a frame is not triggered
+or off by more than PHASE_TOLERANCE, or the scope misses samples of the capture.
+'''
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from DAC_ADC_pyusb import DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, runADC, runDAC
+from fake_device import FakeADC, getFakeDevices
+from live_scope import LiveScope
+from square_wave_generate import sine_blocks
+
+SAMPLE_RATE = 180000
+BUFFER_SAMPLES = 20480 # HLAF_MAX_BUFFER_SIZE / 2
+TONE = 1000.0
+TRIGGER_RATES = [SAMPLE_RATE, 1000000]
+UPDATE_LIMIT = 0.1     # of the time of one buffer
+PHASE_TOLERANCE = 5.0  # degrees
+
+
+def feed(scope, seconds, stop=None):
+    # buffers at the pace of the ADC, returns the time of every update call
+    y = (8000 * np.sin(2 * np.pi * TONE * np.arange(BUFFER_SAMPLES) / SAMPLE_RATE)).astype(np.int16)
+    times = []
+    start = time.perf_counter()
+    for k in range(int(seconds * SAMPLE_RATE / BUFFER_SAMPLES)):
+        begin = time.perf_counter()
+        scope.update(y)
+        times.append(time.perf_counter() - begin)
+        time.sleep(max(0.0, start + (k + 1) * BUFFER_SAMPLES / SAMPLE_RATE - time.perf_counter()))
+    if stop is not None:
+        stop.set()
+    return np.array(times)
+
+
+def slow_gui(scope, stop):
+    while not stop.is_set():
+        scope.frame()
+        time.sleep(1.0)
+
+
+def render(scope, ax, line, fill):
+    t, low, high = scope.frame()
+    if low is high:
+        line.set_data(t, high)
+        fill.set_verts([])
+    else:
+        line.set_data([], [])
+        fill.set_verts([np.column_stack((np.concatenate((t, t[::-1])), np.concatenate((high, low[::-1]))))])
+    ax.figure.canvas.draw()
+    return len(t)
+
+
+if __name__ == "__main__":
+    failures = []
+    print("1. update() per buffer")
+    for name in ('no GUI', 'GUI at 1 frame/s'):
+        scope = LiveScope(SAMPLE_RATE, timebase=0.005, max_blocks=4)
+        stop = threading.Event()
+        gui = threading.Thread(target=slow_gui, args=(scope, stop)) if name != 'no GUI' else None
+        if gui is not None:
+            gui.start()
+        times = feed(scope, 5.0, stop)
+        if gui is not None:
+            gui.join()
+        print(f"   {name:>16}: mean {1e6 * times.mean():.0f} us, max {1e6 * times.max():.0f} us, "
+              f"{scope.dropped_blocks} of {len(times)} buffers dropped")
+        if times.max() > UPDATE_LIMIT * BUFFER_SAMPLES / SAMPLE_RATE:
+            failures.append(f"update() took {1e6 * times.max():.0f} us, {name}")
+
+    print("2. trigger phase")
+    rng = np.random.default_rng(0)
+    for rate in TRIGGER_RATES:
+        scope = LiveScope(rate, timebase=5 / TONE)
+        position, errors, auto = 0, [], 0
+        for frame in range(200):
+            for _ in range(rng.integers(1, 4)):
+                n = np.arange(position, position + rng.integers(500, 20000) * rate // SAMPLE_RATE)
+                scope.update(np.round(8000 * np.sin(2 * np.pi * TONE * n / rate) + rng.normal(0, 100, len(n))).astype(np.int16))
+                position = n[-1] + 1
+            scope.frame()
+            if scope.trigger is None:
+                auto += 1
+                continue
+            errors.append((TONE * scope.trigger / rate + 0.5) % 1 - 0.5)
+        errors = 360 * np.array(errors)
+        print(f"   {rate:>7} S/s, {scope.group} per column: {len(errors)} triggered frames, {auto} auto: "
+              f"phase at the trigger {errors.mean():+.3f} deg, std {errors.std():.3f} deg, max {np.abs(errors).max():.3f} deg")
+        if auto or np.abs(errors).max() > PHASE_TOLERANCE:
+            failures.append(f"{rate} S/s: {auto} frames not triggered, phase at the trigger up to {np.abs(errors).max():.3f} deg")
+
+    print("3. frame cost, 5 ms across the screen")
+    print(f"   {'S/s':>9} {'columns':>8} {'compute ms':>11} {'render ms':>10}")
+    for rate in (50000, 180000, 1000000, 5000000):
+        scope = LiveScope(rate, timebase=0.005)
+        fig, ax = plt.subplots(figsize=(10, 4))
+        (line,) = ax.plot([], [])
+        fill = ax.fill_between([], [], [])
+        ax.set_xlim(-0.0005, 0.0045)
+        ax.set_ylim(-1, 1)
+        n = np.arange(int(0.05 * rate))
+        block = (20000 * np.sin(2 * np.pi * TONE * 3 * n / rate)).astype(np.int16)
+        compute, draw = [], []
+        for _ in range(10):
+            scope.update(block)
+            start = time.perf_counter()
+            scope.frame()
+            compute.append(time.perf_counter() - start)
+            scope.update(block)
+            start = time.perf_counter()
+            columns = render(scope, ax, line, fill)
+            draw.append(time.perf_counter() - start)
+        plt.close(fig)
+        print(f"   {rate:>9} {columns:>8} {1000 * np.median(compute):>11.2f} {1000 * np.median(draw):>10.1f}")
+
+    print("4. capture on the fake boards")
+    filename = os.path.join(tempfile.gettempdir(), "check_live_scope.wav")
+    [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out] = getFakeDevices()
+    scope = LiveScope(SAMPLE_RATE, timebase=0.005)
+    ready, finished, result = threading.Event(), threading.Event(), {}
+    with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+        thread_adc = threading.Thread(target=lambda: result.update(samples=runADC(ADC_dev, ADC_ep_in, ADC_ep_out, SAMPLE_RATE, filename,
+                                                                                  ready, finished, scope=scope,
+                                                                                  make_transport=FakeADC.async_transport)))
+        thread_dac = threading.Thread(target=runDAC, args=(DAC_dev, DAC_ep_in, DAC_ep_out, DAC_CREDIT_WINDOW,
+                                                           sine_blocks(SAMPLE_RATE, TONE, 0.5), SAMPLE_RATE, DAC_SAMPLE_BITS, ready, finished))
+        thread_adc.start()
+        thread_dac.start()
+        while thread_adc.is_alive():
+            scope.frame()
+            time.sleep(0.05)
+        thread_dac.join()
+    os.remove(filename)
+    print(f"   recorded {result['samples']} samples, the scope received {scope.received_samples} "
+          f"in {scope.frames} frames, {scope.dropped_blocks} buffers dropped")
+    if scope.received_samples != result['samples'] or scope.dropped_blocks:
+        failures.append("the scope missed samples of the capture")
+
+    if failures:
+        sys.exit("; ".join(failures))
@@ -0,0 +1,57 @@
+'''
+Check skew_monitor.py on a synthetic capture: a tone with a known skew, DC, noise and silence before
+the DAC starts, fed to SkewMonitor in buffers of the size the ADC reads (HLAF_MAX_BUFFER_SIZE bytes).
+Prints the published estimates against the true skew, the whole-capture estimate of
+drift_check.estimate_frequency for comparison, and the CPU time the monitor adds per buffer.
+Exits with an error if the final estimate is off by more than SKEW_TOLERANCE_PPM or the limit is not reported.
+'''
+import sys
+import time
+
+import numpy as np
+
+from drift_check import clock_skew, estimate_frequency
+from skew_monitor import SkewMonitor
+
+SAMPLE_RATE = 180000
+FREQUENCY = 18000
+SKEW_PPM = 12.5
+DURATION = 10.0          # seconds of tone
+SILENCE = 0.3            # seconds before the tone
+BUFFER_SAMPLES = 20480   # HLAF_MAX_BUFFER_SIZE // 2
+LIMIT_PPM = 10
+SKEW_TOLERANCE_PPM = 0.01
+
+
+def capture(rng):
+    silence = int(SILENCE * SAMPLE_RATE)
+    n = np.arange(int(DURATION * SAMPLE_RATE))
+    f = FREQUENCY * (1 + SKEW_PPM * 1e-6)
+    x = np.concatenate((rng.normal(0, 0.002, silence), 0.8 * np.sin(2 * np.pi * f * n / SAMPLE_RATE + 1.0) + 0.01 + rng.normal(0, 0.002, len(n))))
+    return np.round(x * np.iinfo(np.int16).max).astype(np.int16)
+
+
+if __name__ == "__main__":
+    y = capture(np.random.default_rng(0))
+    limit = []
+    monitor = SkewMonitor(SAMPLE_RATE, FREQUENCY, limit_ppm=LIMIT_PPM, on_limit=lambda: limit.append(monitor.estimate['seconds']))
+
+    cpu = 0.0
+    for start in range(0, len(y), BUFFER_SAMPLES):
+        buffer = y[start:start + BUFFER_SAMPLES]
+        cpu_start = time.process_time()
+        monitor.update(buffer)
+        cpu += time.process_time() - cpu_start
+    estimate = monitor.publish()
+
+    num_buffers = -(-len(y) // BUFFER_SAMPLES)
+    print(f"true skew {SKEW_PPM:+.3f} ppm, monitor {estimate['skew_ppm']:+.4f} +- {estimate['skew_ppm_error']:.4f} ppm,"
+          f" estimate_frequency {clock_skew(estimate_frequency(y, SAMPLE_RATE, FREQUENCY)[0], FREQUENCY)[0]:+.4f} ppm")
+    print(f"limit of {LIMIT_PPM} ppm reported at {limit[0] if limit else None} s")
+    print(f"monitor CPU time {1e6 * cpu / num_buffers:.0f} us per buffer of {BUFFER_SAMPLES} samples"
+          f" ({100 * cpu / (len(y) / SAMPLE_RATE):.2f}% of one core in real time)")
+
+    if not abs(estimate['skew_ppm'] - SKEW_PPM) <= SKEW_TOLERANCE_PPM:
+        sys.exit("monitor estimate is off by more than %g ppm" % SKEW_TOLERANCE_PPM)
+    if not limit:
+        sys.exit("skew beyond the limit was not reported")
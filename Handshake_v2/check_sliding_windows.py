@@ -0,0 +1,93 @@
+'''
+Check fit_sine_over_sliding_windows_batch against fit_sine_over_sliding_windows (curve_fit per window)
+in drift_check.py: same frequencies, phases and MSEs, and how much faster it is.
+
+The signal is a 180 kHz capture of a 1 kHz tone with a clock offset, DC and noise like the ADC,
+or the WAV file given on the command line (normalized like the commented example in drift_check.py).
+curve_fit returns A < 0 with the phase shifted by pi for some windows and does not wrap the phase,
+so its phases are brought to the same form (A >= 0, -pi < phi <= pi) before comparing.
+Exits with an error if a difference is beyond the tolerances below.
+
+Usage:
+    python check_sliding_windows.py [capture.wav [tone_frequency]]
+'''
+import sys
+import time
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from drift_check import fit_sine_over_sliding_windows, fit_sine_over_sliding_windows_batch
+
+SAMPLE_RATE = 180000
+SINE_FREQ = 1000
+OFFSET_PPM = 20
+DURATION = 2.0        # seconds, curve_fit takes a few ms per window
+CAPTURE_SECONDS = 30  # time for a capture of this length is extrapolated
+PERIODS_PER_WINDOW = 5
+STEP_RATIO = 0.2
+BATCH_RUNS = 5        # the batch fit takes a few ms, best of BATCH_RUNS
+FREQ_TOLERANCE = 1e-4   # Hz, largest difference to curve_fit
+PHASE_TOLERANCE = 1e-5  # rad
+MSE_TOLERANCE = 1e-6    # relative
+
+
+def test_signal():
+    rng = np.random.default_rng(0)
+    n = np.arange(int(DURATION * SAMPLE_RATE))
+    f = SINE_FREQ * (1 + OFFSET_PPM * 1e-6)
+    return 0.8 * np.sin(2 * np.pi * f * n / SAMPLE_RATE + 0.3) + 0.01 + rng.normal(0, 0.002, len(n)), SAMPLE_RATE, SINE_FREQ
+
+
+def capture(filename, sine_freq):
+    Fs, rx = wav.read(filename)
+    rx = rx[:int(DURATION * Fs)].astype(np.uint16) / np.iinfo(np.uint16).max
+    return rx, Fs, sine_freq
+
+
+def curve_fit_phases(signal, Fs, sine_freq):
+    freqs, phases, mses = fit_sine_over_sliding_windows(signal, Fs, sine_freq, PERIODS_PER_WINDOW, STEP_RATIO, return_mse=True)
+    return np.array(freqs), np.array(phases), np.array(mses)
+
+
+def wrap(phases):
+    return np.angle(np.exp(1j * np.asarray(phases)))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        signal, Fs, sine_freq = capture(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else SINE_FREQ)
+    else:
+        signal, Fs, sine_freq = test_signal()
+
+    start = time.perf_counter()
+    freqs_ref, phases_ref, mses_ref = curve_fit_phases(signal, Fs, sine_freq)
+    seconds_ref = time.perf_counter() - start
+
+    seconds = np.inf
+    for _ in range(BATCH_RUNS):
+        start = time.perf_counter()
+        freqs, phases, mses = fit_sine_over_sliding_windows_batch(signal, Fs, sine_freq, PERIODS_PER_WINDOW, STEP_RATIO, return_mse=True)
+        seconds = min(seconds, time.perf_counter() - start)
+    freqs, phases, mses = np.array(freqs), np.array(phases), np.array(mses)
+
+    # A < 0 in curve_fit is the same sine with phi + pi
+    phase_diff = np.abs(wrap(phases - phases_ref))
+    flipped = phase_diff > np.pi / 2
+    phase_diff[flipped] = np.abs(wrap(phases[flipped] - phases_ref[flipped] - np.pi))
+    valid = ~np.isnan(freqs_ref)
+    freq_diff = np.max(np.abs(freqs - freqs_ref)[valid])
+    mse_diff = np.max(np.abs(mses - mses_ref)[valid] / mses_ref[valid])
+
+    print(f"{len(freqs)} windows of {PERIODS_PER_WINDOW} periods, step {STEP_RATIO}")
+    print(f"largest difference  frequency {freq_diff:.3e} Hz,"
+          f"  phase {np.max(phase_diff[valid]):.3e} rad,"
+          f"  MSE {mse_diff:.3e} (relative)")
+    print(f"mean frequency      curve_fit {np.mean(freqs_ref[valid]):.6f} Hz, batch {np.mean(freqs):.6f} Hz")
+    print(f"curve_fit failures  {np.count_nonzero(~valid)}, windows with A < 0: {np.count_nonzero(flipped)}")
+    print(f"time                curve_fit {seconds_ref:.2f} s, batch {seconds:.3f} s, {seconds_ref / seconds:.0f}x faster")
+    scale = CAPTURE_SECONDS * Fs / len(signal)
+    print(f"{CAPTURE_SECONDS} s capture     curve_fit ~{seconds_ref * scale:.0f} s, batch ~{seconds * scale:.1f} s")
+
+    if not (freq_diff <= FREQ_TOLERANCE and np.max(phase_diff[valid]) <= PHASE_TOLERANCE and mse_diff <= MSE_TOLERANCE):
+        sys.exit("batch fit differs from curve_fit")
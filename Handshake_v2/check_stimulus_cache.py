@@ -0,0 +1,99 @@
+'''
+Check stimulus_cache.py: the cached stream is byte for byte what BlockStreamSource sends for the
+same generator (16-bit and packed, with and without tail padding), the time to get a stimulus the
+first time (generated) and from the cache, the old way (write the WAV, then MappedWavSource) for
+comparison, least recently used eviction, and a LoopbackSession run from a cached stimulus on the
+simulated boards of fake_device.py. Runs in a temporary directory, exits with an error if any of
+these does not hold.
+'''
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from dac_source import PACKET_SIZE, BlockStreamSource, MappedWavSource
+from fake_device import FakeADC, getFakeDevices
+from loopback_session import LoopbackSession
+from square_wave_generate import sine_blocks, square_blocks, write_sine_wave
+from stimulus_cache import StimulusCache
+
+STIMULI = [('sine', 180000, 18000.0, 60, 16),
+           ('sine', 180000, 1000.0123, 10, 12),
+           ('square', 150000, 75000, 2.56, 16)]  # 384000 samples, a multiple of PACKET_SIZE bytes: padded
+SESSION_SECONDS = 0.5
+WAVEFORMS = {'sine': sine_blocks, 'square': square_blocks}
+
+
+def stream(source):
+    # every piece the sender would send, concatenated
+    pieces, offset = [], 0
+    while True:
+        piece = source.read(offset, PACKET_SIZE)
+        if len(piece) == 0:
+            break
+        pieces.append(bytes(piece))
+        offset += len(piece)
+    source.close()
+    return b''.join(pieces)
+
+
+def wav_and_map(filename, rate, frequency, duration):
+    # what a campaign did before: write the WAV file, then map it for runDAC
+    write_sine_wave(filename, rate, frequency, duration)
+    MappedWavSource(filename).close()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="check_stimulus_cache_")
+    try:
+        stimuli = StimulusCache(os.path.join(directory, "cache"))
+        failures = []
+        print(f"{'stimulus':>38} {'generated s':>12} {'cached ms':>10} {'WAV + map s':>12}  same bytes")
+        for waveform, rate, frequency, duration, bits in STIMULI:
+            _, generated = timed(stimuli.path, waveform, rate, frequency, duration, sample_bits=bits)
+            source, cached = timed(stimuli.source, waveform, rate, frequency, duration, sample_bits=bits)
+            expected = stream(BlockStreamSource(WAVEFORMS[waveform](rate, frequency, duration), rate, sample_bits=bits))
+            same = stream(source) == expected
+            old = ''
+            if waveform == 'sine' and bits == 16:
+                filename = os.path.join(directory, "stimulus.wav")
+                _, seconds = timed(wav_and_map, filename, rate, frequency, duration)
+                old = f"{seconds:.3f}"
+            name = f"{waveform} {rate} {frequency} Hz {duration} s {bits} bits"
+            print(f"{name:>38} {generated:>12.3f} {1000 * cached:>10.2f} {old:>12}  {same}")
+            if not same:
+                failures.append(f"{name}: cached stream differs")
+        print("hits", stimuli.hits, "misses", stimuli.misses, "cache size %.1f MB" % (stimuli.size() / 1e6))
+        misses = stimuli.misses
+        stimuli.path('sine', 180000, 18000, 60.0) # same stimulus written differently
+        print("18000 Hz, 60.0 s regenerated:", stimuli.misses > misses)
+        if stimuli.misses > misses:
+            failures.append("18000 Hz, 60.0 s regenerated")
+
+        small = StimulusCache(os.path.join(directory, "small"), max_bytes=1)
+        small.path('sine', 180000, 1000.0, 1)
+        small.path('sine', 180000, 2000.0, 1)
+        left = len(os.listdir(small.directory))
+        print("stimuli left with a 1 byte cap (the last one stays):", left)
+        if left != 1:
+            failures.append(f"{left} stimuli left with a 1 byte cap")
+
+        with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+            session = LoopbackSession(getFakeDevices(), make_transport=FakeADC.async_transport)
+            stats = session.run(stimuli.source('sine', 180000, 18000.0, SESSION_SECONDS), 180000, os.path.join(directory, "capture.wav"))
+        print("session run from the cache: samples", stats['samples'], "underruns", stats['underruns'])
+        if stats['samples'] < SESSION_SECONDS * 180000:
+            failures.append("session recorded less than the stimulus")
+    finally:
+        shutil.rmtree(directory)
+    if failures:
+        sys.exit("; ".join(failures))
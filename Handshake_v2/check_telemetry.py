@@ -0,0 +1,101 @@
+'''
+Check telemetry.py:
+
+1. histogram accuracy: percentiles of lognormal values against np.percentile (within 1/2**(SUB_BITS-1))
+2. cost of RunTelemetry.record and of the wrapped ADC consumer per call, and what that is per second
+   at the packet rate of a 180 kS/s run
+3. runDAC / runADC on the simulated boards of fake_device.py in credit and in handshake mode with
+   telemetry on: the report, the JSON summary, and the time of the run with and without telemetry
+
+Exits with an error if a percentile is off by more than the bound, or the JSON summary lacks a
+histogram of the run or one of DAC_HISTOGRAMS / ADC_HISTOGRAMS.
+'''
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from DAC_ADC_pyusb import DAC_SAMPLE_BITS, PACKET_SIZE, runADC, runDAC
+from fake_device import FakeADC, getFakeDevices
+from square_wave_generate import sine_blocks
+from telemetry import PERCENTILES, SUB_BITS, Histogram, RunTelemetry
+
+SAMPLE_RATE = 180000
+RUN_SECONDS = 1.0
+DAC_HISTOGRAMS = ['dac.request_to_write_ns', 'dac.write_ns', 'dac.write_bytes']
+ADC_HISTOGRAMS = ['adc.buffer_bytes', 'adc.buffer_gap_ns', 'adc.put_ns']
+
+
+def run(credit_window, telemetry, filename):
+    [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out] = getFakeDevices()
+    ready, finished = threading.Event(), threading.Event()
+    thread_adc = threading.Thread(target=runADC, args=(ADC_dev, ADC_ep_in, ADC_ep_out, SAMPLE_RATE, filename, ready, finished),
+                                  kwargs={'telemetry': telemetry, 'make_transport': FakeADC.async_transport})
+    thread_dac = threading.Thread(target=runDAC, args=(DAC_dev, DAC_ep_in, DAC_ep_out, credit_window, sine_blocks(SAMPLE_RATE, 1000.0, RUN_SECONDS),
+                                                       SAMPLE_RATE, DAC_SAMPLE_BITS, ready, finished), kwargs={'telemetry': telemetry})
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()): # progress printouts
+        thread_adc.start()
+        thread_dac.start()
+        thread_dac.join()
+        thread_adc.join()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    failures = []
+    print("1. histogram percentiles")
+    values = np.random.default_rng(0).lognormal(np.log(200000), 1.0, 200000).astype(np.int64) # ns
+    histogram = Histogram()
+    for value in values.tolist():
+        histogram.record(value)
+    for p in PERCENTILES:
+        exact = np.percentile(values, p, method='inverted_cdf')
+        print(f"   p{p:<5g} histogram {histogram.percentile(p):>10} exact {exact:>10} "
+              f"error {100 * (histogram.percentile(p) / exact - 1):+.2f}% (bound {100 / 2 ** (SUB_BITS - 1):.2f}%)")
+        if abs(histogram.percentile(p) / exact - 1) > 1 / 2 ** (SUB_BITS - 1):
+            failures.append(f"p{p:g} off by more than the bound")
+
+    print("2. cost per call")
+    telemetry = RunTelemetry()
+    n = 200000
+    start = time.perf_counter()
+    for value in range(n):
+        telemetry.record('dac.write_ns', value)
+    record = (time.perf_counter() - start) / n
+    consumer = telemetry.wrapConsumer(lambda data, slot: None)
+    data = np.zeros(10240, dtype='>i2')
+    start = time.perf_counter()
+    for _ in range(n):
+        consumer(data, None)
+    wrapped = (time.perf_counter() - start) / n
+    packets = SAMPLE_RATE * 2 / PACKET_SIZE
+    print(f"   record {1e6 * record:.2f} us, wrapped consumer {1e6 * wrapped:.2f} us; "
+          f"3 records per packet at {packets:.0f} packets/s: {100 * 3 * record * packets:.3f}% of a core")
+
+    print("3. fake boards")
+    filename = os.path.join(tempfile.gettempdir(), "check_telemetry.wav")
+    for name, credit_window in (('credit', 16), ('handshake', 0)):
+        without = run(credit_window, None, filename)
+        telemetry = RunTelemetry()
+        seconds = run(credit_window, telemetry, filename)
+        telemetry.dump(filename + '.telemetry.json')
+        with open(filename + '.telemetry.json') as f:
+            summary = json.load(f)
+        print(f"   {name}: run {without:.2f} s without telemetry, {seconds:.2f} s with, "
+              f"{len(summary['histograms'])} histograms in the JSON summary")
+        telemetry.report()
+        missing = set(DAC_HISTOGRAMS + ADC_HISTOGRAMS + list(telemetry.histograms)) - set(summary['histograms'])
+        if missing:
+            failures.append(f"{name}: {', '.join(sorted(missing))} not in the JSON summary")
+    os.remove(filename)
+    os.remove(filename + '.telemetry.json')
+
+    if failures:
+        sys.exit("; ".join(failures))
@@ -0,0 +1,44 @@
+'''
+Check zero_crossing.py on random signals of random lengths, cut into chunks of random size:
+
+1. without hysteresis, one crossing between p and p + 1 for every p of np.where((y[:-1] < 0) & (y[1:] >= 0)),
+   the old cal_sin way, including the ones between the first two and the last two samples
+2. with hysteresis, the same crossings whatever the chunk size (against the signal in one chunk)
+
+Exits with an AssertionError on the first mismatch.
+'''
+import numpy as np
+
+from zero_crossing import rising_crossings
+
+SIGNALS = 300
+MAX_LENGTH = 3000
+MAX_CHUNK = 500
+HYSTERESIS = 300
+
+
+def signal(k, rng):
+    n = int(rng.integers(1, MAX_LENGTH))
+    if k % 2:
+        return np.round(100 * rng.normal(0, 1, n).cumsum()).astype(np.int16) # random walk, long segments
+    return rng.integers(-5, 5, n).astype(np.int16)                          # a crossing every few samples
+
+
+def crossings(y, hysteresis, interpolation, chunk_samples):
+    return np.concatenate(list(rising_crossings(y, hysteresis=hysteresis, interpolation=interpolation, chunk_samples=chunk_samples)))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    for k in range(SIGNALS):
+        y = signal(k, rng)
+        reference = np.flatnonzero((y[:-1] < 0) & (y[1:] >= 0))
+        for interpolation in ('linear', 'cubic'):
+            chunk_samples = int(rng.integers(1, MAX_CHUNK))
+            times = crossings(y, 0, interpolation, chunk_samples)
+            assert len(times) == len(reference) and np.all((times >= reference) & (times <= reference + 1)), \
+                f"signal {k}, {len(y)} samples, {interpolation}, chunks of {chunk_samples}: {len(times)} crossings, np.where {len(reference)}"
+            whole = crossings(y, HYSTERESIS, interpolation, len(y))
+            assert np.array_equal(crossings(y, HYSTERESIS, interpolation, chunk_samples), whole), \
+                f"signal {k}, {len(y)} samples, {interpolation}, hysteresis: chunks of {chunk_samples} differ"
+    print(f"{SIGNALS} signals of 1 to {MAX_LENGTH} samples, linear and cubic, chunks of 1 to {MAX_CHUNK} samples OK")
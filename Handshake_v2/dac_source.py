@@ -0,0 +1,190 @@
+'''
+Sample sources for the DAC sender.
+
+The DAC protocol sends PACKET_SIZE chunks and marks the end of file with a shorter last chunk,
+so a stream whose length is a multiple of PACKET_SIZE gets 2 zero bytes (one sample) appended.
+A source gives contiguous pieces of that stream with read(offset, size), offsets are sequential:
+  MappedWavSource    memory-maps the data chunk of a WAV file, pieces are memoryview slices of the mapping
+  BytesSource        wraps samples that are already in memory
+  BlockStreamSource  pulls int16 blocks from any iterator (generator, lazily decoded file, ...)
+  MappedStreamSource memory-maps a file holding the stream exactly as sent (stimulus_cache.py)
+The padding is returned as its own piece, so nothing is ever copied to append it.
+BlockStreamSource can also pack the samples (sample_format.py), the padding then follows the packed length.
+'''
+import mmap
+import struct
+import threading
+import wave
+from queue import Queue
+
+import numpy as np
+
+from sample_format import SAMPLE_BITS, PackedEncoder
+
+PACKET_SIZE = 512 # same as DAC_ADC_pyusb.py
+TAIL_PADDING = b'\x00\x00'
+
+
+class BytesSource:
+    '''Little-endian 16-bit samples already in memory (bytes, bytearray or int16 array).'''
+    sample_bits = SAMPLE_BITS
+
+    def __init__(self, raw_data, frame_rate):
+        self.frame_rate = frame_rate
+        self.data = memoryview(raw_data).cast('B')
+        self.padding = TAIL_PADDING if len(self.data) % PACKET_SIZE == 0 else b''
+
+    def __len__(self):
+        return len(self.data) + len(self.padding)
+
+    def read(self, offset, size):
+        '''Contiguous piece of at most size bytes starting at offset, b'' at the end.'''
+        if offset < len(self.data):
+            return self.data[offset:offset + size]
+        return self.padding[offset - len(self.data):][:size]
+
+    def close(self):
+        self.data.release()
+
+
+class MappedWavSource(BytesSource):
+    '''
+    Memory-mapped PCM WAV file, the samples are never loaded or copied:
+    the OS pages the file in while it is sent and can drop the pages again afterwards.
+    '''
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data_offset, data_size = self._parse_header()
+        self.num_frames = data_size // (self.num_channels * self.sample_width)
+        self.data = memoryview(self.mapping)[data_offset:data_offset + data_size]
+        self.padding = TAIL_PADDING if len(self.data) % PACKET_SIZE == 0 else b''
+
+    def _parse_header(self):
+        riff, _, wave_id = struct.unpack_from('<4sI4s', self.mapping, 0)
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError('not a WAV file')
+
+        pos = 12
+        while pos + 8 <= len(self.mapping):
+            chunk_id, chunk_size = struct.unpack_from('<4sI', self.mapping, pos)
+            if chunk_id == b'fmt ':
+                fmt_tag, self.num_channels, self.frame_rate, _, _, bits = struct.unpack_from('<HHIIHH', self.mapping, pos + 8)
+                if fmt_tag != 1:
+                    raise ValueError('only PCM WAV files are supported')
+                self.sample_width = bits // 8
+            elif chunk_id == b'data':
+                # the size in the header can be wrong for files that were not closed properly
+                return pos + 8, min(chunk_size, len(self.mapping) - pos - 8)
+            pos += 8 + chunk_size + (chunk_size & 1) # chunks are word aligned
+        raise ValueError('WAV file has no data chunk')
+
+    def close(self):
+        self.data.release()
+        self.mapping.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class MappedStreamSource(BytesSource):
+    '''
+    Memory-mapped file that holds the stream exactly as it is sent from offset on: the samples
+    (packed if sample_bits < 16) with the tail padding already appended (stimulus_cache.py).
+    '''
+    def __init__(self, filename, frame_rate, sample_bits=SAMPLE_BITS, offset=0):
+        self.frame_rate = frame_rate
+        self.sample_bits = sample_bits
+        self.file = open(filename, 'rb')
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.data = memoryview(self.mapping)[offset:]
+        self.padding = b''
+
+    def close(self):
+        self.data.release()
+        self.mapping.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BlockStreamSource:
+    '''
+    Samples produced on the fly by an iterator of int16 NumPy blocks, e.g. sine_blocks() in
+    square_wave_generate.py or wav_blocks() below. A thread pulls the blocks ahead of the sender
+    into a queue of at most read_ahead blocks, so memory stays constant however long the run is.
+    The total length is not known in advance, the padding is decided when the iterator ends.
+    With sample_bits < 16 the producer thread also packs the blocks for the DAC.
+    '''
+    def __init__(self, blocks, frame_rate, read_ahead=8, sample_bits=SAMPLE_BITS):
+        self.frame_rate = frame_rate
+        self.sample_bits = sample_bits
+        self.queue = Queue(maxsize=read_ahead)
+        self.pending = bytearray()  # received from the queue, not sent yet
+        self.total = 0              # bytes taken from the iterator
+        self.finished = False
+        self.error = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._produce, args=(blocks,), daemon=True)
+        self.thread.start()
+
+    def _produce(self, blocks):
+        encoder = PackedEncoder(self.sample_bits) if self.sample_bits != SAMPLE_BITS else None
+        try:
+            for block in blocks:
+                if self.closed:
+                    return
+                if encoder is None:
+                    self.queue.put(np.asarray(block, dtype='<i2').tobytes())
+                else:
+                    self.queue.put(encoder.encode(block))
+            if encoder is not None:
+                self.queue.put(encoder.flush())
+        except Exception as e:
+            self.error = e
+        self.queue.put(None)
+
+    def read(self, offset, size):
+        '''Next piece of at most size bytes, shorter only at the end of the stream.'''
+        while len(self.pending) < size and not self.finished:
+            block = self.queue.get()
+            if block is None:
+                if self.error is not None:
+                    raise self.error
+                self.finished = True
+                if self.total % PACKET_SIZE == 0:
+                    self.pending += TAIL_PADDING
+            else:
+                self.pending += block
+                self.total += len(block)
+
+        chunk = bytes(self.pending[:size])
+        del self.pending[:size]
+        return chunk
+
+    def close(self):
+        self.closed = True
+        while self.thread.is_alive(): # unblock the producer if the queue is full
+            while not self.queue.empty():
+                self.queue.get()
+            self.thread.join(0.01)
+
+
+def wav_blocks(filename, block_size=65536):
+    '''Decode a 16-bit WAV file lazily, block_size frames at a time.'''
+    with wave.open(filename, "rb") as wav:
+        while True:
+            data = wav.readframes(block_size)
+            if len(data) == 0:
+                return
+            yield np.frombuffer(data, dtype='<i2')
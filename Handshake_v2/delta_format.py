@@ -0,0 +1,163 @@
+'''
+Lossless delta-compressed ADC stream.
+
+Neighbouring samples of the signals we capture are close, so the firmware sends differences instead of
+16-bit words. Samples are grouped in blocks of BLOCK_SAMPLES: a block is its first sample plus the
+zigzag-coded differences to the previous sample, all with the number of bits the largest one needs
+(block floating point, 0 bits for a constant block). Every PACKET_SIZE packet holds whole blocks and is
+decoded on its own:
+
+    byte 0               number of blocks n
+    byte 1               samples in the last block (BLOCK_SAMPLES, fewer only in the very last packet)
+    n bytes              bit width of every block
+    n x 2 bytes          first sample of every block, big-endian
+    ...                  the differences of every block, MSB first, each block starting on a new byte
+    ...                  zero padding up to PACKET_SIZE
+
+The difference is taken modulo 2**16, so it always fits in 16 bits. A block costs at most 33 bytes
+instead of 32 (an incompressible signal is 3% bigger), a slowly changing one only a few.
+decode() is vectorized over all packets of a USB transfer; encode() is the reference encoder used by
+fake_device.FakeADC and to check the firmware.
+'''
+import numpy as np
+
+DELTA_FORMAT = 256 # sent instead of sample bits in the ADC header, ACK 'D'
+BLOCK_SAMPLES = 16
+PACKET_SIZE = 512
+HEADER_SIZE = 2
+
+
+def _zigzag(deltas):
+    deltas = deltas.astype(np.int16).astype(np.int32)
+    return ((deltas << 1) ^ (deltas >> 15)).astype(np.uint16)
+
+
+def _bitWidth(values):
+    '''Bits needed for the largest value of every row.'''
+    largest = np.bitwise_or.reduce(values, axis=1).astype(np.uint32)
+    width = np.zeros(len(values), dtype=np.uint8)
+    for bits in range(16):
+        width += (largest >> bits) != 0
+    return width
+
+
+def encode(samples):
+    '''Compress 16-bit samples (int16 or uint16) into whole packets.'''
+    samples = np.asarray(samples).astype(np.uint16)
+    if len(samples) == 0:
+        return b''
+    num_blocks = -(-len(samples) // BLOCK_SAMPLES)
+    last_count = len(samples) - (num_blocks - 1) * BLOCK_SAMPLES
+    padded = np.zeros(num_blocks * BLOCK_SAMPLES, dtype=np.uint16)
+    padded[:len(samples)] = samples
+    blocks = padded.reshape(num_blocks, BLOCK_SAMPLES)
+
+    counts = np.full(num_blocks, BLOCK_SAMPLES - 1)
+    counts[-1] = last_count - 1
+    zigzag = _zigzag(np.diff(blocks, axis=1))
+    zigzag[np.arange(BLOCK_SAMPLES - 1) >= counts[:, None]] = 0 # padding of the last block
+    width = _bitWidth(zigzag)
+    payload_size = (counts * width + 7) // 8
+
+    # bit stream of every block: bit q of a block is bit (q % width) of difference q // width
+    q = np.arange((BLOCK_SAMPLES - 1) * 16)
+    w = np.maximum(width.astype(np.int64), 1)[:, None]
+    index = np.minimum(q // w, BLOCK_SAMPLES - 2)
+    bit = (zigzag[np.arange(num_blocks)[:, None], index] >> (w - 1 - q % w)) & 1
+    bit[q >= (counts * width)[:, None]] = 0
+    payload = np.packbits(bit[q < (payload_size * 8)[:, None]].astype(np.uint8))
+    payload_end = np.cumsum(payload_size)
+
+    # greedy: as many blocks per packet as fit
+    packets = []
+    start = 0
+    while start < num_blocks:
+        end = start
+        used = HEADER_SIZE
+        while end < num_blocks and used + 3 + payload_size[end] <= PACKET_SIZE:
+            used += 3 + payload_size[end]
+            end += 1
+        packet = np.zeros(PACKET_SIZE, dtype=np.uint8)
+        n = end - start
+        packet[0] = n
+        packet[1] = last_count if end == num_blocks else BLOCK_SAMPLES
+        packet[2:2 + n] = width[start:end]
+        packet[2 + n:2 + 3*n] = blocks[start:end, 0].astype('>u2').view(np.uint8)
+        first_byte = payload_end[start] - payload_size[start]
+        body = payload[first_byte:payload_end[end - 1]]
+        packet[2 + 3*n:2 + 3*n + len(body)] = body
+        packets.append(packet.tobytes())
+        start = end
+    return b''.join(packets)
+
+
+def decode(data):
+    '''Whole packets to little-endian int16 samples ('<i2', the WAV format).'''
+    packets = np.frombuffer(data, dtype=np.uint8)
+    if len(packets) % PACKET_SIZE != 0:
+        raise ValueError('compressed data must be whole packets')
+    packets = packets.reshape(-1, PACKET_SIZE)
+    num_blocks = packets[:, 0].astype(np.int64)
+    total = int(num_blocks.sum())
+    if total == 0:
+        return np.zeros(0, dtype='<i2')
+
+    # packet and position of every block
+    packet = np.repeat(np.arange(len(packets)), num_blocks)
+    first_block = np.cumsum(num_blocks) - num_blocks
+    index = np.arange(total) - first_block[packet]
+    n = num_blocks[packet]
+
+    width = packets[packet, HEADER_SIZE + index].astype(np.int64)
+    first = (packets[packet, HEADER_SIZE + n + 2*index].astype(np.uint16) << 8) | packets[packet, HEADER_SIZE + n + 2*index + 1]
+    counts = np.where(index == n - 1, packets[packet, 1].astype(np.int64), BLOCK_SAMPLES) - 1
+    payload_size = (counts * width + 7) // 8
+
+    # byte offset of every block's differences: after the header, behind the blocks before it in the packet
+    end = np.cumsum(payload_size)
+    start = end - payload_size
+    start -= start[first_block][packet]
+    offset = packet * PACKET_SIZE + HEADER_SIZE + 3*n + start
+
+    # every difference fits in the 3 bytes starting at its first byte (at most 7 + 16 bits); positions
+    # past a short last block are read too (and masked below), they reach up to 2 * (BLOCK_SAMPLES - 1) bytes further
+    flat = np.concatenate((packets.reshape(-1), np.zeros(2 * (BLOCK_SAMPLES - 1) + 3, dtype=np.uint8))).astype(np.uint32)
+    bit = offset[:, None] * 8 + np.arange(BLOCK_SAMPLES - 1) * width[:, None]
+    byte = bit >> 3
+    window = (flat[byte] << 16) | (flat[byte + 1] << 8) | flat[byte + 2]
+    zigzag = (window >> (24 - (bit & 7) - width[:, None]).astype(np.uint32)) & ((1 << width[:, None]) - 1).astype(np.uint32)
+    zigzag = zigzag.astype(np.int32)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+
+    samples = np.empty((total, BLOCK_SAMPLES), dtype=np.int64)
+    samples[:, 0] = first
+    samples[:, 1:] = deltas
+    samples = np.cumsum(samples, axis=1).astype(np.uint16) # modulo 2**16 like the encoder
+    valid = np.arange(BLOCK_SAMPLES) <= counts[:, None]
+    return samples[valid].view('<i2')
+
+
+class DeltaDecoder:
+    '''
+    Decode a compressed ADC stream buffer by buffer (USB transfers are whole packets,
+    an incomplete one is kept for the next buffer) and keep the numbers for the compression ratio.
+    '''
+    def __init__(self):
+        self.carry = b''
+        self.num_bytes = 0
+        self.num_samples = 0
+
+    def decode(self, data):
+        if self.carry:
+            data = self.carry + bytes(data)
+        whole = len(data) - len(data) % PACKET_SIZE
+        self.carry = bytes(data[whole:])
+        samples = decode(data[:whole])
+        self.num_bytes += whole
+        self.num_samples += len(samples)
+        return samples
+
+    @property
+    def compression_ratio(self):
+        '''Bytes 16-bit samples would have needed per byte received.'''
+        return 2 * self.num_samples / self.num_bytes if self.num_bytes else 1.0
@@ -4,33 +4,21 @@ import matplotlib.pyplot as plt
 from numpy import polyfit
 from scipy.optimize import curve_fit
 
-def cal_sin():
+from zero_crossing import wav_period_stats
+
+def cal_sin(tx_filename='./wavefile/12.0kHz_1000Hz_sine.wav', rx_filename='output_12k_1000.wav', hysteresis=0, interpolation='linear'):
     '''
     Calculate the mean period by zero crossings at rising edge to get actual mean frequency
+    (zero_crossing.py: files memory mapped, sub-sample crossing times, hysteresis in full scale units)
     '''
-    Fs_tx, Yt = wav.read('./wavefile/12.0kHz_1000Hz_sine.wav')
-    Yt = Yt/np.iinfo(np.int16).max  # Normalize to [-1, 1]
-
-    # Find zero-crossing indices (rising edges)
-    zero_crossings_tx = np.where((Yt[:-1] < 0) & (Yt[1:] >= 0))[0]
-    
-    # Calculate time between consecutive zero-crossings
-    t_diff_tx = np.diff(zero_crossings_tx) / Fs_tx
-    period_tx = np.mean(t_diff_tx)                # Average period (seconds)
-    f_tx = 1 / period_tx                          # Measured frequency (Hz) for tx
+    tx = wav_period_stats(tx_filename, hysteresis=hysteresis, interpolation=interpolation)
+    f_tx = tx['frequency']                        # Measured frequency (Hz) for tx
 
     # Same for RX
-    Fs_rx, Yr = wav.read('output_12k_1000.wav')
-    Yr = Yr/np.iinfo(np.int16).max  # Normalize to [-1, 1]
-
-    # Find zero-crossing indices (rising edges)
-    zero_crossings_rx = np.where((Yr[:-1] < 0) & (Yr[1:] >= 0))[0]
-
-    # Calculate time between consecutive zero-crossings
-    t_diff_rx = np.diff(zero_crossings_rx) / Fs_rx
-    period_rx = np.mean(t_diff_rx)                # Average period (seconds)
-    f_rx = 1 / period_rx                          # Measured frequency (Hz) for rx
+    rx = wav_period_stats(rx_filename, hysteresis=hysteresis, interpolation=interpolation)
+    f_rx = rx['frequency']                        # Measured frequency (Hz) for rx
 
+    print(f"period jitter (std): tx {tx['period_std']:.3e} s, rx {rx['period_std']:.3e} s")
     print(f"transmit frequency: {f_tx}")
     print(f"receive frequency: {f_rx}")
 
@@ -90,8 +78,104 @@ def fit_sine_over_sliding_windows(signal, Fs, sine_freq=1000, periods_per_window
     else:
         return freqs, phases
 
-def fit_whole_sine(wav_path, f0_guess):
-    Fs, y = wav.read(wav_path)
+SERIES_TERMS = 16   # Taylor terms of the frequency shift in fit_sine_over_sliding_windows_batch
+SERIES_LIMIT = 1.5  # largest shift from sine_freq over one window (radians) the series is exact for (< 1e-11)
+
+def _geometric_sum(theta, N):
+    # sum of exp(1j*theta*n) for n = 0..N-1, one theta per window
+    z = np.exp(1j * theta)
+    near_one = np.abs(1 - z) < 1e-9
+    return np.where(near_one, N, (1 - np.exp(1j * theta * N)) / np.where(near_one, 1, 1 - z))
+
+def _project(omega, F, sum_y, sum_yy, N):
+    # least squares of y on [sin(omega*n), cos(omega*n), 1] for every window, from F = sum(y*exp(1j*omega*n)):
+    # returns a, b, C and the squared residual. C is eliminated first, which leaves a 2x2 system
+    E1 = _geometric_sum(omega, N)
+    E2 = _geometric_sum(2 * omega, N)
+    ss = N/2 - E2.real/2 - E1.imag**2/N
+    cc = N/2 + E2.real/2 - E1.real**2/N
+    sc = E2.imag/2 - E1.imag*E1.real/N
+    ys = F.imag - E1.imag*sum_y/N
+    yc = F.real - E1.real*sum_y/N
+    det = ss*cc - sc**2
+    a = (cc*ys - sc*yc) / det
+    b = (ss*yc - sc*ys) / det
+    C = (sum_y - a*E1.imag - b*E1.real) / N
+    return a, b, C, sum_yy - sum_y**2/N - a*ys - b*yc
+
+def fit_sine_over_sliding_windows_batch(signal, Fs, sine_freq=1000, periods_per_window=5, step_ratio=0.5, return_mse=False,
+                                        refine_iterations=4, chunk_windows=4096):
+    """
+    Same windows, model and outputs as fit_sine_over_sliding_windows, without a curve_fit per window.
+
+    The windows are a strided view of the signal. At a fixed frequency w the model
+    A*sin(w*n + phi) + C = a*sin(w*n) + b*cos(w*n) + C is linear: a, b, C and the residual follow from
+    sum(y*exp(1j*w*n)), sum(y), sum(y**2) and the closed-form sums of the sines (3x3 solve per window).
+    sum(y*exp(1j*w*n)) of every window for any w near sine_freq is a Taylor series in the shift
+    whose coefficients sum(y*(n/N)**k*exp(1j*w0*n)) come from one matrix product over all windows.
+    Each refinement iteration is a Newton step of every window's frequency on that residual,
+    so the result is the exact least squares fit like curve_fit's.
+    refine_iterations=0 fits every window at sine_freq. Windows whose frequency is further than
+    SERIES_LIMIT radians per window from sine_freq get nan, like a window curve_fit cannot fit.
+    chunk_windows bounds the memory (windows per matrix product). Checked by check_sliding_windows.py.
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    samples_per_period = Fs / sine_freq
+    window_size = int(samples_per_period * periods_per_window)
+    step_size = int(window_size * step_ratio)
+
+    num_windows = len(range(0, len(signal) - window_size, step_size))
+    windows = np.lib.stride_tricks.sliding_window_view(signal, window_size)[::step_size][:num_windows]
+    N = window_size
+    n = np.arange(N, dtype=np.float64)
+    omega0 = 2 * np.pi * sine_freq / Fs
+
+    # moments of every window: sum(y * u**k * exp(1j*omega0*n)), u = n/N
+    powers = (n / N)[:, None] ** np.arange(SERIES_TERMS)
+    basis = np.concatenate((powers * np.cos(omega0 * n)[:, None], powers * np.sin(omega0 * n)[:, None]), axis=1)
+    moments = np.empty((num_windows, SERIES_TERMS), dtype=complex)
+    sum_y = np.empty(num_windows)
+    sum_yy = np.empty(num_windows)
+    for first in range(0, num_windows, chunk_windows):
+        y = windows[first:first + chunk_windows]
+        m = y @ basis
+        moments[first:first + len(y)] = m[:, :SERIES_TERMS] + 1j * m[:, SERIES_TERMS:]
+        sum_y[first:first + len(y)] = y.sum(axis=1)
+        sum_yy[first:first + len(y)] = np.einsum('ij,ij->i', y, y)
+
+    def residual(delta):
+        # delta: frequency shift in rad/sample of every window (last axis), the series by Horner's rule
+        x = 1j * delta * N
+        F = moments[:, -1]
+        for k in range(SERIES_TERMS - 2, -1, -1):
+            F = F * x / (k + 1) + moments[:, k]
+        return _project(omega0 + delta, F, sum_y, sum_yy, N)
+
+    delta = np.zeros(num_windows)
+    h = 1e-3 / N           # finite difference step, 1 mrad over the window
+    max_step = 0.5 / N     # less than a tenth of the main lobe
+    for _ in range(refine_iterations):
+        Jm, J0, Jp = residual(np.stack((delta - h, delta, delta + h)))[3]
+        curvature = Jp - 2*J0 + Jm
+        slope = Jp - Jm
+        step = np.where(curvature > 0, -h * slope / (2 * np.where(curvature > 0, curvature, 1)), -np.sign(slope) * max_step)
+        delta = delta + np.clip(step, -max_step, max_step)
+
+    a, b, C, J = residual(delta)
+    freqs = (omega0 + delta) * Fs / (2 * np.pi)
+    phases = np.arctan2(b, a) # A*sin(w*n + phi) = A*cos(phi)*sin(w*n) + A*sin(phi)*cos(w*n)
+    mses = J / N
+    outside = np.abs(delta) * N > SERIES_LIMIT
+    for values in (freqs, phases, mses):
+        values[outside] = np.nan
+
+    if return_mse:
+        return freqs.tolist(), phases.tolist(), mses.tolist()
+    else:
+        return freqs.tolist(), phases.tolist()
+
+def fit_sine(y, Fs, f0_guess):
+    '''Fit one sine to the whole signal y (int16 samples), returns the frequency and [A, f, phi, C].'''
     y = y.astype(np.float64) / np.iinfo(y.dtype).max          # normalize
     n = np.arange(len(y))                                     # sample index
 
@@ -105,25 +189,109 @@ def fit_whole_sine(wav_path, f0_guess):
     A, f_est, phi, C = params
     return f_est, params
 
+COARSE_SEGMENTS = 8        # segments spread over the signal whose spectra locate the tone
+COARSE_SEGMENT_SAMPLES = 1 << 16
+COARSE_PADDING = 4         # zero padding of the coarse FFT
+SEARCH_WIDTH = 0.1         # the tone is looked for within f0_guess * (1 +- SEARCH_WIDTH)
+BLOCK_SAMPLES = 1 << 14    # samples per single-bin DFT of the phase refinement
+CHUNK_BLOCKS = 64          # blocks read (and converted to float64) at a time
+ACTIVE_LEVEL = 0.1         # blocks below this part of the strongest one (silence) are left out
 
-# output_wavfile = "./wavefile/bulk_receive/12k_1.2kHz.wav"
-output_wavfile = "output.wav"
-f0_guess = 18000
+def _coarse_frequency(y, Fs, f0_guess, scale):
+    # peak of the mean power spectrum of a few Hann windowed, zero padded segments, interpolated
+    L = min(COARSE_SEGMENT_SAMPLES, len(y))
+    window = np.hanning(L)
+    power = 0
+    for start in np.linspace(0, len(y) - L, min(COARSE_SEGMENTS, len(y) // L)).astype(np.int64):
+        segment = y[start:start + L].astype(np.float64) / scale
+        power = power + np.abs(np.fft.rfft((segment - segment.mean()) * window, COARSE_PADDING * L))**2
+    freqs = np.fft.rfftfreq(COARSE_PADDING * L, 1 / Fs)
+    if f0_guess:
+        band = (freqs > f0_guess * (1 - SEARCH_WIDTH)) & (freqs < f0_guess * (1 + SEARCH_WIDTH))
+    else:
+        band = freqs > 2 * COARSE_PADDING * Fs / (COARSE_PADDING * L) # not DC
+    k = np.flatnonzero(band)[np.argmax(power[band])]
+    if 0 < k < len(power) - 1: # parabola through the log power (exact for a Gaussian peak)
+        l, c, r = np.log(power[k - 1:k + 2] + 1e-300)
+        k = k + 0.5 * (l - r) / (l - 2*c + r)
+    return k * Fs / (COARSE_PADDING * L)
+
+def estimate_frequency(y, Fs, f0_guess=None):
+    '''
+    Frequency of the sine in y without curve_fit, returns the frequency and [A, f, phi, C] like fit_sine.
+    The tone is located by a zero padded FFT of a few segments, then the DFT at that frequency of every
+    BLOCK_SAMPLES block (Hann window, phase referred to sample 0) gives the phase along the signal:
+    its slope is the remaining frequency offset (weighted least squares, silent blocks and the blocks
+    where the tone starts or stops left out).
+    y is read CHUNK_BLOCKS blocks at a time, so a memory mapped WAV of any size works.
+    '''
+    scale = np.iinfo(y.dtype).max if np.issubdtype(y.dtype, np.integer) else 1
+    f1 = _coarse_frequency(y, Fs, f0_guess, scale)
 
-f_est, params = fit_whole_sine(output_wavfile, f0_guess)
-A, f_est, phi, C = params
-print(f"Estimated frequency: {f_est:.3f} Hz")
+    L = max(min(BLOCK_SAMPLES, len(y) // 16), 16)
+    num_blocks = len(y) // L
+    window = np.hanning(L)
+    kernel = window * np.exp(-2j * np.pi * f1 / Fs * np.arange(L))
+    X = np.empty(num_blocks, dtype=complex)
+    total = 0.0
+    for first in range(0, num_blocks, CHUNK_BLOCKS):
+        blocks = y[first * L:min(first + CHUNK_BLOCKS, num_blocks) * L].astype(np.float64).reshape(-1, L) / scale
+        total += blocks.sum()
+        X[first:first + len(blocks)] = blocks @ kernel
+    starts = np.arange(num_blocks, dtype=np.int64) * L
+    X *= np.exp(-2j * np.pi * np.mod(f1 / Fs * starts, 1)) # phase of every block referred to sample 0
 
-f_nom = f0_guess
+    strong = np.abs(X) >= ACTIVE_LEVEL * np.abs(X).max()
+    active = strong.copy() # without the blocks where the tone starts or stops, their phase is off
+    active[1:] &= strong[:-1]
+    active[:-1] &= strong[1:]
+    if not active.any():
+        active = strong
+    t = starts[active] + (L - 1) / 2
+    phase = np.unwrap(np.angle(X[active]))
+    if np.count_nonzero(active) > 1:
+        slope, intercept = np.polyfit(t, phase, 1, w=np.abs(X[active]))
+    else:
+        slope, intercept = 0.0, phase[0]
+    f_est = f1 + slope * Fs / (2 * np.pi)
+
+    A = 2 * np.average(np.abs(X[active]), weights=np.abs(X[active])) / window.sum()
+    phi = np.angle(np.exp(1j * (intercept + np.pi/2))) # A*sin(w*n + phi) = A*cos(w*n + phi - pi/2)
+    C = total / (num_blocks * L)
+    return f_est, np.array([A, f_est, phi, C])
+
+def fit_whole_sine(wav_path, f0_guess, method='fft'):
+    '''Frequency of the sine in a WAV file: estimate_frequency (method='fft', memory mapped) or fit_sine ('curve_fit').'''
+    if method == 'curve_fit':
+        Fs, y = wav.read(wav_path)
+        return fit_sine(y, Fs, f0_guess)
+    Fs, y = wav.read(wav_path, mmap=True)
+    return estimate_frequency(y, Fs, f0_guess)
+
+def clock_skew(f_est, f_nom):
+    '''Skew in ppm of the measured against the nominal frequency, and the seconds until one cycle slips.'''
+    diff_f   = f_est - f_nom
+    skew_ratio = diff_f / f_nom
+    skew_ppm   = skew_ratio * 1000000 
+    T_slip   = 1 / diff_f if diff_f != 0 else np.inf
+    return skew_ppm, T_slip
+
+
+if __name__ == "__main__":
+    # output_wavfile = "./wavefile/bulk_receive/12k_1.2kHz.wav"
+    output_wavfile = "output.wav"
+    f0_guess = 18000
+
+    f_est, params = fit_whole_sine(output_wavfile, f0_guess)
+    A, f_est, phi, C = params
+    print(f"Estimated frequency: {f_est:.3f} Hz")
 
-diff_f   = f_est - f_nom
-skew_ratio = diff_f / f_nom
-skew_ppm   = skew_ratio * 1000000 
-T_slip   = 1 / diff_f
-print(f"One cycle slip every {T_slip:.1f} s")
+    f_nom = f0_guess
+    skew_ppm, T_slip = clock_skew(f_est, f_nom)
+    print(f"One cycle slip every {T_slip:.1f} s")
 
-# ppm - 0.0001% shift
-print(f"clock skew: {skew_ppm:+.3f} ppm")
+    # ppm - 0.0001% shift
+    print(f"clock skew: {skew_ppm:+.3f} ppm")
 
 # if __name__ == "__main__":
 #     input_wavfile = "./wavefile/12.0kHz_1000Hz_sine.wav"
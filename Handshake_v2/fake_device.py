@@ -0,0 +1,435 @@
+'''
+Software stand-ins for the Teensy boards, so the host code can be run and benchmarked without hardware.
+
+The fakes follow the pyusb calls used in DAC_ADC_pyusb.py (dev.read(ep, size, timeout) / dev.write(ep, data))
+and simulate the firmware in real time: the DAC plays its ring buffer at the sampling rate,
+every USB message takes `latency` seconds to arrive on the other side.
+The ADC samples a ramp (sample k has the value k mod 2**16), so lost samples show up as a jump.
+Both also speak the packed sample formats of sample_format.py.
+'''
+import asyncio
+import time
+from array import array
+from collections import deque
+
+import numpy as np
+import usb.core
+from usb.backend import libusb1
+
+import delta_format
+import framed_format
+from sample_format import SAMPLE_BITS, adcBurstSize, groupSize, pack
+
+
+class FakeEndpoint:
+    def __init__(self, bEndpointAddress):
+        self.bEndpointAddress = bEndpointAddress
+
+
+# =============================================
+# ========= DAC (usb_serial_try.ino)
+# =============================================
+class FakeDAC:
+    '''
+    Simulates usb_serial_try.ino: 'S' handshake mode (4 byte header) and credit mode (8 byte header,
+    12 bytes with packed samples). The timer starts when half of the ring buffer is filled, then consumes
+    2 bytes per sample (sample_bits/8 when packed).
+    Underruns are counted in samples and reported after 'E' like the firmware does.
+    '''
+    def __init__(self, latency=0.0005, ring_size=102400, packet_size=512):
+        self.latency = latency
+        self.ring_size = ring_size
+        self.packet_size = packet_size
+        self._reset()
+
+    def _reset(self):
+        self.receiving = False
+        self.credit_mode = False
+        self.window = 1
+        self.bytes_per_sample = 2.0
+        self.byte_rate = 0.0
+
+        self.level = 0.0              # bytes in ring buffer
+        self.in_flight = []           # (arrival time, number of bytes) of packets on their way to MCU
+        self.outstanding = 0          # bytes requested/granted but not arrived yet
+        self.messages = []            # (ready time, bytes) on their way to PC
+        self.end_of_file = False
+        self.timer_start = None       # time of last consumption update, None while timer is stopped
+        self.underruns = 0
+        self.total_received = 0
+
+    # ----- pyusb interface
+    def write(self, ep, data, timeout=None):
+        now = time.perf_counter()
+        data = bytes(data)
+        if not self.receiving:
+            self._reset()
+            if len(data) == 12:
+                sample_bits = int.from_bytes(data[8:12], byteorder='little')
+                if 8 <= sample_bits < 16:
+                    self.bytes_per_sample = sample_bits / 8
+            self.byte_rate = int.from_bytes(data[0:4], byteorder='little') * self.bytes_per_sample
+            if len(data) >= 8:
+                self.credit_mode = True
+                self.window = min(max(int.from_bytes(data[4:8], byteorder='little'), 1), 255)
+            self.receiving = True
+        else:
+            self.in_flight.append((now + self.latency, len(data)))
+        return len(data)
+
+    def read(self, ep, size, timeout=None):
+        deadline = time.perf_counter() + (timeout or 1000) / 1000
+        while True:
+            now = time.perf_counter()
+            self._advance(now)
+
+            ready = [m for m in self.messages if m[0] <= now]
+            if ready:
+                self.messages = [m for m in self.messages if m[0] > now]
+                return array('B', b''.join(m[1] for m in ready)[:size])
+
+            if now >= deadline:
+                raise usb.core.USBTimeoutError('Operation timed out')
+            time.sleep(min(deadline - now, 0.0002))
+
+    # ----- firmware simulation
+    def _consume(self, t):
+        # play samples until time t
+        if self.timer_start is None:
+            return
+        want = (t - self.timer_start) * self.byte_rate
+        self.timer_start = t
+        if want <= self.level:
+            self.level -= want
+        else:
+            if not self.end_of_file:
+                self.underruns += int((want - self.level) / self.bytes_per_sample)
+            self.level = 0.0
+
+    def _advance(self, now):
+        # deliver packets that have arrived, in order, playing samples in between
+        while self.in_flight and self.in_flight[0][0] <= now:
+            arrival, count = self.in_flight.pop(0)
+            self._consume(arrival)
+            self.level += count
+            self.total_received += count
+            self.outstanding = max(self.outstanding - count, 0)
+            if count % self.packet_size != 0:
+                self.end_of_file = True
+            if self.timer_start is None and (self.level >= self.ring_size / 2 or self.end_of_file):
+                self.timer_start = arrival
+        self._consume(now)
+
+        if not self.receiving:
+            return
+
+        if self.end_of_file:
+            if self.level == 0:
+                self.messages.append((now + self.latency, b'E' + self.underruns.to_bytes(4, byteorder='little')))
+                self.receiving = False
+                self.timer_start = None
+            return
+
+        free_packets = int((self.ring_size - self.packet_size - self.level - self.outstanding) // self.packet_size)
+        if self.credit_mode:
+            credits = min(free_packets, self.window - self.outstanding // self.packet_size)
+            if credits > 0 and credits >= (self.window + 1) // 2:
+                self.messages.append((now + self.latency, bytes([ord('C'), credits])))
+                self.outstanding += credits * self.packet_size
+        elif self.outstanding == 0 and free_packets > 0:
+            self.messages.append((now + self.latency, b'S'))
+            self.outstanding = self.packet_size
+
+
+# =============================================
+# ========= ADC (ADC_usb_serial.ino)
+# =============================================
+class FakeADC:
+    '''
+    Simulates ADC_usb_serial.ino: after the 4 byte sampling rate (8 bytes with sample bits) it answers
+    '1' ('P' if the samples are packed) and starts sampling into a ring buffer of ring_size bytes,
+    which is sent to PC in PACKET_SIZE packets, a burst of half the firmware's ring buffer at a time
+    (sample_format.adcBurstSize). What has not made a whole burst when the timer stops is never sent.
+    Data that PC does not pick up in time is overwritten (lost), any further write stops the timer.
+    Packed ramp values keep only the top bits, sample k is (k mod 2**sample_bits) << (16 - sample_bits).
+    With DELTA_FORMAT in the header the ramp is sent as delta_format packets, compressed every
+    compress_chunk samples (the firmware does it block by block, only the packet filling differs).
+    With FRAMED_FORMAT the ramp is sent as framed_format packets from a ring of ring_size / packet_size
+    packets; samples taken while it is full are dropped (whole packets of them here) but still counted,
+    so they show up as a jump of the sample counter.
+    '''
+    compress_chunk = 4096
+
+    def __init__(self, latency=0.0005, ring_size=81920, packet_size=512):
+        self.latency = latency
+        self.ring_size = ring_size
+        self.packet_size = packet_size
+        self.running = False
+        self.messages = []
+        self.lost = 0
+
+    # ----- pyusb interface
+    def write(self, ep, data, timeout=None):
+        now = time.perf_counter()
+        if not self.running and len(data) in (4, 8):
+            data = bytes(data)
+            self.sample_rate = int.from_bytes(data[0:4], byteorder='little')
+            self.sample_bits = SAMPLE_BITS
+            code = int.from_bytes(data[4:8], byteorder='little') if len(data) == 8 else SAMPLE_BITS
+            if 8 <= code < 16:
+                self.sample_bits = code
+            self.compressed = code == delta_format.DELTA_FORMAT
+            self.framed = code == framed_format.FRAMED_FORMAT
+            # the stream is made of groups of whole bytes (1 sample in 2 bytes, 2 samples in 3 bytes, ...)
+            self.group_samples, self.group_bytes = groupSize(self.sample_bits)
+            self.burst_size = min(adcBurstSize(self.sample_rate), self.ring_size // 2)
+            self.packets = deque() # compressed: (packet, number of samples) not sent yet
+            self.encoded = 0       # compressed: samples already in packets
+            self.sent = 0          # compressed: samples sent to PC or lost
+            self.sample_index = 0  # framed: samples already in packets or dropped
+            self.sequence = 0      # framed: sequence number of the next packet
+            self.dropouts = []     # framed: (index of the first sample dropped, number of samples)
+            if self.compressed:
+                self.messages.append(b'D')
+            elif self.framed:
+                self.messages.append(b'F')
+            else:
+                self.messages.append(b'1' if self.sample_bits == SAMPLE_BITS else b'P')
+            self.running = True
+            self.t0 = now + self.latency
+            self.next_byte = 0 # first byte of the stream not sent to PC yet
+            self.lost = 0
+        else:
+            self.running = False # 'e': stop timer and reset, unsent samples are dropped
+        return len(data)
+
+    def read(self, ep, size_or_buffer, timeout=None):
+        deadline = time.perf_counter() + (timeout or 1000) / 1000
+        size = size_or_buffer if isinstance(size_or_buffer, int) else len(size_or_buffer)
+        while True:
+            if self.messages:
+                data = self.messages.pop(0)
+                break
+
+            now = time.perf_counter()
+            num_packets = min(self._pending(now), size) // self.packet_size
+            if num_packets > 0:
+                data = self._take(num_packets * self.packet_size)
+                break
+
+            if now >= deadline:
+                raise usb.core.USBTimeoutError('Operation timed out')
+            time.sleep(min(deadline - now, 0.0005))
+
+        if isinstance(size_or_buffer, int):
+            return array('B', data)
+        memoryview(size_or_buffer).cast('B')[:len(data)] = data
+        return len(data)
+
+    # ----- firmware simulation
+    def _pending(self, now, extra_space=0):
+        # bytes waiting in the ring buffer, overwrite the oldest ones when it is full
+        if not self.running:
+            return 0
+        if self.compressed:
+            return self._pendingCompressed(now, extra_space)
+        if self.framed:
+            return self._pendingFramed(now, extra_space)
+        produced = max(int((now - self.latency - self.t0) * self.sample_rate), 0)
+        produced = produced // self.group_samples * self.group_bytes
+        pending = produced - self.next_byte
+        overflow = pending - self.ring_size - extra_space
+        if overflow > 0:
+            lost_groups = -(-overflow // self.group_bytes) # whole groups, so PC stays aligned
+            self.lost += lost_groups * self.group_samples
+            self.next_byte += lost_groups * self.group_bytes
+        # only whole bursts are sent
+        return max(produced // self.burst_size * self.burst_size - self.next_byte, 0)
+
+    def _pendingCompressed(self, now, extra_space):
+        produced = max(int((now - self.latency - self.t0) * self.sample_rate), 0)
+        while produced - self.encoded >= self.compress_chunk:
+            ramp = np.arange(self.encoded, self.encoded + self.compress_chunk) % 65536
+            data = delta_format.encode(ramp)
+            for start in range(0, len(data), self.packet_size):
+                packet = data[start:start + self.packet_size]
+                num_samples = int(delta_format.decode(packet).size)
+                self.packets.append((packet, num_samples))
+            self.encoded += self.compress_chunk
+
+        # the ring buffer holds raw samples, queued transfers take whole packets
+        queued = list(self.packets)[:extra_space // self.packet_size]
+        space = self.ring_size // 2 + sum(num_samples for _, num_samples in queued)
+        while produced - self.sent > space and self.packets:
+            _, num_samples = self.packets.popleft()
+            self.lost += num_samples
+            self.sent += num_samples
+        return len(self.packets) * self.packet_size
+
+    def _pendingFramed(self, now, extra_space):
+        produced = max(int((now - self.latency - self.t0) * self.sample_rate), 0)
+        full = (produced - self.sample_index) // framed_format.FRAME_SAMPLES
+        # free packets of the ring, queued transfers take whole packets
+        room = max((self.ring_size + extra_space) // self.packet_size - len(self.packets), 0)
+        stored = min(full, room)
+        if stored > 0:
+            ramp = np.arange(self.sample_index, self.sample_index + stored * framed_format.FRAME_SAMPLES) % 65536
+            data = framed_format.encode(ramp, self.sample_index, self.sequence)
+            self.packets.extend(data[start:start + self.packet_size] for start in range(0, len(data), self.packet_size))
+            self.sample_index += stored * framed_format.FRAME_SAMPLES
+            self.sequence += stored
+        if full > stored:
+            dropped = (full - stored) * framed_format.FRAME_SAMPLES
+            self.dropouts.append((self.sample_index, dropped))
+            self.lost += dropped
+            self.sample_index += dropped
+        return len(self.packets) * self.packet_size
+
+    def _take(self, num_bytes):
+        if self.framed:
+            return b''.join(self.packets.popleft() for _ in range(num_bytes // self.packet_size))
+        if self.compressed:
+            packets = [self.packets.popleft() for _ in range(num_bytes // self.packet_size)]
+            self.sent += sum(num_samples for _, num_samples in packets)
+            return b''.join(packet for packet, _ in packets)
+        first_group = self.next_byte // self.group_bytes
+        end_group = -(-(self.next_byte + num_bytes) // self.group_bytes)
+        ramp = np.arange(first_group * self.group_samples, end_group * self.group_samples)
+        if self.sample_bits == SAMPLE_BITS:
+            data = (ramp % 65536).astype('>u2').tobytes()
+        else:
+            data = pack((ramp % (1 << self.sample_bits)) << (16 - self.sample_bits), self.sample_bits)
+        start = self.next_byte - first_group * self.group_bytes
+        self.next_byte += num_bytes
+        return data[start:start + num_bytes]
+
+    def async_transport(self, num_transfers, transfer_size):
+        '''Transport of the queued transfers, FakeADC.async_transport is the make_transport of captureADC / runADC.'''
+        return FakeBulkTransport(self, num_transfers, transfer_size)
+
+
+class FakeBulkTransport:
+    '''
+    Stand-in for adc_async_capture.Libusb1BulkTransport on a FakeADC.
+    Queued transfers keep absorbing packets while Python is busy (like the host controller does),
+    only the completion callbacks wait for handle_events().
+    '''
+    def __init__(self, adc, num_transfers, transfer_size):
+        self.adc = adc
+        self.transfer_size = transfer_size
+        self.on_complete = None
+        self.queue = []  # [index, buffer, bytes received, cancelled] in submission order
+
+    def submit(self, index, buffer):
+        self.queue.append([index, buffer, 0, False])
+
+    def cancel(self, index):
+        for transfer in self.queue:
+            if transfer[0] == index:
+                transfer[3] = True
+
+    def close(self):
+        self.queue = []
+
+    def _fill(self, now):
+        free = sum(self.transfer_size - t[2] for t in self.queue if not t[3])
+        pending = self.adc._pending(now, extra_space=free)
+        packet_size = self.adc.packet_size
+        for transfer in self.queue:
+            if transfer[3]:
+                continue
+            space = (self.transfer_size - transfer[2]) // packet_size
+            count = min(space, pending // packet_size) * packet_size
+            if count > 0:
+                transfer[1][transfer[2]:transfer[2] + count] = self.adc._take(count)
+                transfer[2] += count
+                pending -= count
+
+    def handle_events(self, timeout):
+        deadline = time.perf_counter() + timeout
+        while True:
+            now = time.perf_counter()
+            self._fill(now)
+            finished = [t for t in self.queue if t[3] or t[2] == self.transfer_size]
+            if finished or now >= deadline:
+                break
+            time.sleep(min(deadline - now, 0.0005))
+
+        for transfer in finished:
+            self.queue.remove(transfer)
+            status = libusb1.LIBUSB_TRANSFER_CANCELLED if transfer[3] else libusb1.LIBUSB_TRANSFER_COMPLETED
+            self.on_complete(transfer[0], transfer[2], status)
+
+
+class FakeAsyncDevice:
+    '''
+    Stand-in for async_session.AsyncUsbDevice on a FakeDAC or FakeADC (the make_device of AsyncSession). Writes complete at once,
+    queued reads are served in order by a task that steps the simulation every poll_interval.
+    Like a bulk transfer, a read completes when its buffer is full or a short packet arrives.
+    '''
+    poll_interval = 0.001
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.reads = {}     # endpoint address -> deque of [future, buffer, bytes received, cancelled]
+        self.servers = {}   # endpoint address -> task serving its reads
+
+    def submit(self, ep, buffer):
+        future = asyncio.get_running_loop().create_future()
+        if ep.bEndpointAddress & 0x80 == 0:
+            future.set_result(self.dev.write(ep, buffer))
+            return future
+        queue = self.reads.setdefault(ep.bEndpointAddress, deque())
+        queue.append([future, memoryview(buffer).cast('B'), 0, False])
+        server = self.servers.get(ep.bEndpointAddress)
+        if server is None or server.done():
+            self.servers[ep.bEndpointAddress] = asyncio.ensure_future(self._serve(ep, queue))
+        return future
+
+    def cancel(self, future):
+        for queue in self.reads.values():
+            for request in queue:
+                if request[0] is future:
+                    request[3] = True
+
+    async def _serve(self, ep, queue):
+        while queue:
+            request = queue[0]
+            future, buffer, received, cancelled = request
+            if not cancelled:
+                try:
+                    data = self.dev.read(ep, len(buffer) - received, timeout=1e-6) # doesn't wait
+                except usb.core.USBTimeoutError:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                buffer[received:received + len(data)] = data
+                request[2] = received = received + len(data)
+                if received < len(buffer) and len(data) % 512 == 0:
+                    continue
+            queue.popleft()
+            future.set_result(received)
+
+
+def countGaps(samples, sample_bits=SAMPLE_BITS):
+    '''Number of discontinuities and lost samples in a ramp received from FakeADC.'''
+    ramp = samples.astype(np.uint16) >> (16 - sample_bits)
+    steps = np.diff(ramp.astype(np.int64)) % (1 << sample_bits)
+    jumps = steps[steps != 1]
+    return len(jumps), int(np.sum(jumps - 1))
+
+
+def getFakeDevices(dac_kwargs={}, adc_kwargs={}):
+    '''Same list as getDevices() in DAC_ADC_pyusb.py, with simulated boards.'''
+    DAC_dev = FakeDAC(**dac_kwargs)
+    ADC_dev = FakeADC(**adc_kwargs)
+    return [DAC_dev, FakeEndpoint(0x83), FakeEndpoint(0x03), ADC_dev, FakeEndpoint(0x84), FakeEndpoint(0x03)]
+
+
+def openFakeDAC(**kwargs):
+    '''[dev, ep_in, ep_out] of a simulated DAC, for process_mode.py.'''
+    return [FakeDAC(**kwargs), FakeEndpoint(0x83), FakeEndpoint(0x03)]
+
+
+def openFakeADC(**kwargs):
+    '''[dev, ep_in, ep_out] of a simulated ADC, for process_mode.py.'''
+    return [FakeADC(**kwargs), FakeEndpoint(0x84), FakeEndpoint(0x03)]
@@ -0,0 +1,135 @@
+'''
+Framed ADC stream: every packet says where its samples belong, so dropouts are found instead of
+silently joining the samples on both sides.
+
+Every PACKET_SIZE packet is a header and up to FRAME_SAMPLES 16-bit samples, big-endian like the plain stream:
+
+    bytes 0-1      sequence number of the packet (counts packets sent, modulo 2**16)
+    bytes 2-5      sample counter: index of the packet's first sample since the ADC started (modulo 2**32)
+    bytes 6-7      number of samples in the packet (FRAME_SAMPLES, fewer only in the very last packet)
+    bytes 8-511    the samples, unused ones are zero
+
+The firmware counts every sample the timer takes, also those it has to drop because its ring of
+packets is full, so a sample counter that jumps is a ring buffer overflow on the Teensy and a
+sequence number that jumps is a packet lost between the Teensy and the file. The header costs
+8 bytes per packet (1.6% of the bandwidth).
+
+parse() and decode() are vectorized over all packets of a USB transfer; encode() is the reference
+encoder used by fake_device.FakeADC and to check the firmware. FramedDecoder checks the continuity
+of every transfer with a few array operations and records where samples are missing.
+'''
+import numpy as np
+
+FRAMED_FORMAT = 257 # sent instead of sample bits in the ADC header, ACK 'F'
+PACKET_SIZE = 512
+HEADER_SIZE = 8
+FRAME_SAMPLES = (PACKET_SIZE - HEADER_SIZE) // 2
+MAX_GAPS = 100000   # gaps kept with their position, the totals count all of them
+
+
+def encode(samples, first_sample=0, first_sequence=0):
+    '''Samples (int16 / uint16) to packets, numbered from first_sequence, counting samples from first_sample.'''
+    samples = np.asarray(samples).astype(np.uint16)
+    num_packets = -(-len(samples) // FRAME_SAMPLES)
+    packets = np.zeros((num_packets, PACKET_SIZE), dtype=np.uint8)
+    k = np.arange(num_packets, dtype=np.int64)
+    sequence = (first_sequence + k) % (1 << 16)
+    counter = (first_sample + k * FRAME_SAMPLES) % (1 << 32)
+    count = np.minimum(len(samples) - k * FRAME_SAMPLES, FRAME_SAMPLES)
+    packets[:, 0:2] = sequence.astype('>u2').view(np.uint8).reshape(-1, 2)
+    packets[:, 2:6] = counter.astype('>u4').view(np.uint8).reshape(-1, 4)
+    packets[:, 6:8] = count.astype('>u2').view(np.uint8).reshape(-1, 2)
+    payload = np.zeros(num_packets * FRAME_SAMPLES, dtype='>u2')
+    payload[:len(samples)] = samples
+    packets[:, HEADER_SIZE:] = payload.view(np.uint8).reshape(num_packets, -1)
+    return packets.tobytes()
+
+
+def parse(data):
+    '''Whole packets to (sequence, first sample, count, samples '>i2' of shape (packets, FRAME_SAMPLES)).'''
+    packets = np.frombuffer(data, dtype=np.uint8)
+    if len(packets) % PACKET_SIZE != 0:
+        raise ValueError('framed data must be whole packets')
+    packets = packets.reshape(-1, PACKET_SIZE)
+    headers = packets[:, :HEADER_SIZE].astype(np.int64)
+    sequence = headers[:, 0] << 8 | headers[:, 1]
+    first = headers[:, 2] << 24 | headers[:, 3] << 16 | headers[:, 4] << 8 | headers[:, 5]
+    count = headers[:, 6] << 8 | headers[:, 7]
+    if np.any(count > FRAME_SAMPLES):
+        raise ValueError('not a framed packet (sample count above FRAME_SAMPLES)')
+    samples = packets[:, HEADER_SIZE:].copy().view('>i2')
+    return sequence, first, count, samples
+
+
+def _payload(samples, count):
+    # the valid samples of every packet, in order, little-endian ('<i2', the WAV format)
+    if np.all(count == FRAME_SAMPLES):
+        return samples.reshape(-1).astype('<i2')
+    return samples[np.arange(FRAME_SAMPLES) < count[:, None]].astype('<i2')
+
+
+def decode(data):
+    '''Whole packets to little-endian int16 samples, without checking the continuity.'''
+    _, _, count, samples = parse(data)
+    return _payload(samples, count)
+
+
+class FramedDecoder:
+    '''
+    Decode a framed ADC stream buffer by buffer (an incomplete packet is kept for the next buffer)
+    and check it: every packet must follow the previous one in sequence and in sample counter.
+    A gap is recorded as a dict:
+        sample            samples decoded before the gap (where it is in the WAV file)
+        device_sample     index of the first missing sample, counted by the ADC since it started
+        missing_samples   number of samples missing
+        lost_packets      packets missing in sequence (lost on the way to PC, 0 for a Teensy overflow)
+    '''
+    def __init__(self):
+        self.carry = b''
+        self.num_bytes = 0
+        self.num_samples = 0
+        self.next_sequence = 0
+        self.next_sample = 0    # absolute sample counter expected next
+        self.missing_samples = 0
+        self.lost_packets = 0
+        self.num_gaps = 0
+        self.gaps = []
+
+    def decode(self, data):
+        if self.carry:
+            data = self.carry + bytes(data)
+        whole = len(data) - len(data) % PACKET_SIZE
+        self.carry = bytes(data[whole:])
+        sequence, first, count, samples = parse(data[:whole])
+        self.num_bytes += whole
+        if len(count) == 0:
+            return np.zeros(0, dtype='<i2')
+
+        # continuity with the packet before, modulo the width of the header fields
+        expected_sequence = np.concatenate(([self.next_sequence], sequence[:-1] + 1))
+        lost = (sequence - expected_sequence) % (1 << 16)
+        expected_first = np.concatenate(([self.next_sample], first[:-1] + count[:-1]))
+        missing = (first - expected_first) % (1 << 32)
+        position = self.num_samples + np.cumsum(count) - count
+        start = self.next_sample + np.cumsum(missing) - missing + np.cumsum(count) - count # absolute, without the wrap
+
+        for k in np.flatnonzero((lost != 0) | (missing != 0)):
+            self.num_gaps += 1
+            if len(self.gaps) < MAX_GAPS:
+                self.gaps.append({'sample': int(position[k]), 'device_sample': int(start[k]),
+                                  'missing_samples': int(missing[k]), 'lost_packets': int(lost[k])})
+        self.missing_samples += int(missing.sum())
+        self.lost_packets += int(lost.sum())
+        self.next_sequence = int(sequence[-1] + 1) % (1 << 16)
+        self.next_sample = int(start[-1] + missing[-1] + count[-1])
+
+        out = _payload(samples, count)
+        self.num_samples += len(out)
+        return out
+
+    def metadata(self):
+        '''Summary and gaps of the capture, for the JSON file next to the WAV file.'''
+        return {'format': 'framed', 'packets': self.num_bytes // PACKET_SIZE, 'samples': self.num_samples,
+                'device_samples': self.next_sample, 'missing_samples': self.missing_samples,
+                'lost_packets': self.lost_packets, 'gaps': self.num_gaps,
+                'gaps_truncated': self.num_gaps > len(self.gaps), 'gap_list': self.gaps}
@@ -1,31 +1,15 @@
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy.io import wavfile as wav
-
-# Fs, Y = wav.read("100.0kHz_10000Hz_30_sine.wav")
-# Fs, Y = wav.read("1.0kHz_100Hz_30_sine.wav")
-Fs, Y = wav.read("output.wav")
-Y = Y.astype(np.int16)
-# print(Y)
-# Fs = 100000
-Y = (Y / 65535.0)  *5
+import os
+import sys
 
-# Y = Y[-200000:]
-# Y = Y [0:100000] # Y are 16-bit samples 
-# Y = Y[100000:400000]
+import matplotlib.pyplot as plt
 
-# Y = Y[-100:]
-# Y = Y [0:100] # Y are 16-bit samples 
- 
-time = np.arange(len(Y)) / Fs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')) # lod_viewer.py is shared
+from lod_viewer import LodViewer
 
+# The whole capture is memory-mapped and only what is visible is drawn: a min/max envelope
+# (cached next to the file as .lod.npy) or, once zoomed in, every sample. No need to slice Y any more.
+# viewer = LodViewer("100.0kHz_10000Hz_30_sine.wav")
+# viewer = LodViewer("1.0kHz_100Hz_30_sine.wav")
+viewer = LodViewer("output.wav")
 
-plt.figure(figsize=(10, 4))
-plt.plot(time, Y, marker='o', label="Audio Signal")
-# plt.scatter(time, Y, label="Audio Signal Pt")
-plt.xlabel("Time (seconds)")
-plt.ylabel("Amplitude")
-plt.title(f"Waveform (Sampling Rate: {Fs} Hz)")
-plt.legend()
-plt.grid()
-plt.show()
\ No newline at end of file
+plt.show()
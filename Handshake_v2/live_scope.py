@@ -0,0 +1,164 @@
+'''
+Live oscilloscope view of the ADC stream while runADC is recording.
+
+The recorder's writer thread hands every decoded buffer to LiveScope.update, which decimates it on
+the fly: every `group` samples (the screen over `points`, so a rate set by the timebase alone) become
+one column, their min, max and mean, and only the columns are appended to a deque of at most
+max_blocks buffers. It never waits for the GUI, and if the GUI falls behind the oldest buffers are
+dropped (counted in dropped_blocks). The USB reader and the WAV file never see the scope. Each frame
+(fps per second, on the GUI's timer) takes the columns that arrived since the last one, keeps the
+newest 2 screens of them, and triggers like a scope: the last rising crossing of level by the means
+(with hysteresis, zero_crossing.py) that still has a full screen after it, at its interpolated time
+so the trace does not jitter by a column. Without a trigger the newest screen is shown (auto mode).
+Below `points` samples per screen the columns are the samples themselves. What is kept, triggered
+on and drawn, and the time it takes, is the same at any sample rate.
+
+Usage:
+    scope = LiveScope(180000, timebase=5 / 18000)          # 5 periods of an 18 kHz tone across the screen
+    thread_adc = threading.Thread(target=runADC, args=(ADC_dev, ADC_ep_in, ADC_ep_out, 180000), kwargs={'scope': scope})
+    thread_adc.start()
+    scope.show(until=lambda: not thread_adc.is_alive())   # in the main thread, closes when the capture ends
+'''
+from collections import deque
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from zero_crossing import ZeroCrossingDetector
+
+FRAME_RATE = 20          # frames per second
+SCREEN_POINTS = 1000     # columns drawn at most
+PRE_TRIGGER = 0.1        # part of the screen before the trigger
+MAX_BLOCKS = 256         # buffers waiting for the next frame at most
+VOLTS_PER_STEP = 5 / 65535.0 # as impulse_wav_visualize.py
+
+
+class LiveScope:
+    def __init__(self, frame_rate, timebase=0.001, level=0, hysteresis=300, fps=FRAME_RATE, points=SCREEN_POINTS,
+                 max_blocks=MAX_BLOCKS, scale=VOLTS_PER_STEP):
+        self.frame_rate = frame_rate
+        screen = max(int(round(timebase * frame_rate)), 2) # samples across the screen
+        self.group = -(-screen // points)                  # samples per column
+        self.screen = max(screen // self.group, 2)          # columns across the screen
+        self.pre = int(PRE_TRIGGER * self.screen)
+        self.level = level
+        self.hysteresis = hysteresis
+        self.fps = fps
+        self.points = points
+        self.scale = scale
+        self.blocks = deque(maxlen=max_blocks)
+        self.partial = np.zeros(0, dtype=np.int16) # samples of the next column received so far
+        self.columns = 0        # columns made so far
+        self.history = (np.zeros(0), np.zeros(0), np.zeros(0)) # low, high, mean of the newest columns
+        self.history_end = 0    # columns made before the end of history
+        self.received_samples = 0
+        self.dropped_blocks = 0
+        self.frames = 0
+        self.trigger = None     # trigger of the last frame in samples from the first one received, None in auto mode
+
+    # ----- writer thread
+    def update(self, samples):
+        '''Called by WavRecorder with every decoded buffer, never blocks.'''
+        self.received_samples += len(samples)
+        columns = []
+        if len(self.partial): # the column started by the previous buffer
+            need = self.group - len(self.partial)
+            self.partial = np.concatenate((self.partial, samples[:need]))
+            samples = samples[need:]
+            if len(self.partial) < self.group:
+                return
+            columns.append(self._reduce(self.partial))
+        whole = len(samples) // self.group * self.group
+        if whole:
+            columns.append(self._reduce(samples[:whole]))
+        self.partial = samples[whole:].copy() # the recorder reuses its ring slots
+        if not columns:
+            return
+        low, high, mean = (np.concatenate(c) for c in zip(*columns)) if len(columns) > 1 else columns[0]
+        self.columns += len(low)
+        if len(self.blocks) == self.blocks.maxlen:
+            self.dropped_blocks += 1 # the append pushes the oldest one out
+        self.blocks.append((self.columns, low, high, mean))
+
+    def _reduce(self, samples):
+        # (low, high, mean) of every group samples, new arrays
+        if self.group == 1:
+            samples = samples.copy()
+            return samples, samples, samples
+        groups = samples.reshape(-1, self.group)
+        return groups.min(axis=1), groups.max(axis=1), groups.mean(axis=1)
+
+    # ----- GUI thread
+    def frame(self):
+        '''(times, low, high) of the screen for the samples received so far, times in seconds from the trigger.'''
+        keep = 2 * self.screen
+        new = []
+        while self.blocks: # only this thread takes from the deque, the writer may still append
+            new.append(self.blocks.popleft())
+        count = 0
+        for first in range(len(new) - 1, -1, -1): # older ones would not be kept anyway
+            count += len(new[first][1])
+            if count >= keep:
+                new = new[first:]
+                break
+        if new:
+            self.history = tuple(np.concatenate([old] + [block[k + 1] for block in new])[-keep:]
+                                 for k, old in enumerate(self.history))
+            self.history_end = new[-1][0]
+        self.frames += 1
+
+        low, high, mean = self.history
+        trigger = self._trigger(mean)
+        # a column stands at the middle of its samples, as the mean the trigger is found on
+        center = (self.group - 1) / 2
+        self.trigger = None if trigger is None else (self.history_end - len(mean) + trigger) * self.group + center
+        if trigger is None:
+            trigger = float(max(len(mean) - self.screen + self.pre, self.pre))
+        first = max(int(trigger) - self.pre, 0)
+        t = (np.arange(first, min(first + self.screen, len(mean))) - trigger) * self.group / self.frame_rate # the trigger is at t = 0
+        if self.group == 1:
+            y = high[first:first + self.screen] * self.scale
+            return t, y, y # low is high: the samples themselves
+        return t, low[first:first + self.screen] * self.scale, high[first:first + self.screen] * self.scale
+
+    def _trigger(self, y):
+        # the last rising crossing with pre columns before it and a full screen after it
+        if len(y) < self.screen:
+            return None
+        times = ZeroCrossingDetector(self.level, self.hysteresis).update(y)
+        times = times[(times >= self.pre) & (times <= len(y) - self.screen + self.pre - 1)]
+        return float(times[-1]) if len(times) else None
+
+    def show(self, until=None, ax=None):
+        '''Refresh a plot fps times per second until until() is true or the window is closed (blocks).'''
+        if ax is None:
+            plt.figure(figsize=(10, 4))
+            ax = plt.gca()
+        (line,) = ax.plot([], [], label="ADC")
+        fill = ax.fill_between([], [], [], color=line.get_color())
+        ax.set_xlabel("Time from trigger (seconds)")
+        ax.set_ylabel("Amplitude")
+        ax.set_xlim(-self.pre * self.group / self.frame_rate, (self.screen - self.pre) * self.group / self.frame_rate)
+        ax.set_ylim(-1.05 * 32768 * self.scale, 1.05 * 32768 * self.scale)
+        ax.grid()
+        timer = ax.figure.canvas.new_timer(interval=int(1000 / self.fps))
+
+        def refresh():
+            if until is not None and until():
+                timer.stop()
+                plt.close(ax.figure)
+                return
+            t, low, high = self.frame()
+            if len(t) and low is high:
+                line.set_data(t, high)
+                fill.set_verts([])
+            else:
+                line.set_data([], [])
+                fill.set_verts([np.column_stack((np.concatenate((t, t[::-1])), np.concatenate((high, low[::-1]))))])
+            ax.set_title(f"{self.frame_rate} S/s, {'auto' if self.trigger is None else 'triggered'}, "
+                         f"{self.received_samples} samples, {self.dropped_blocks} buffers dropped")
+            ax.figure.canvas.draw_idle()
+
+        timer.add_callback(refresh)
+        timer.start()
+        plt.show()
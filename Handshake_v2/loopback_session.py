@@ -0,0 +1,146 @@
+'''
+A DAC + ADC rig kept open for many stimulus/capture runs (sweeps, repeated measurements).
+
+Running DAC_ADC_pyusb.py once per stimulus pays for finding and configuring both boards, two 10 ms
+reads to drain the ADC, a 1 s sleep after the DAC has finished and fresh capture buffers every time,
+and its module-level events can only be used for one run. LoopbackSession opens the boards once,
+keeps its ring slots, clears its own events before every run, drains the ADC only before the first
+run (stopADC leaves it empty) or after a failed one, and records for only `tail` seconds after the
+DAC's 'E'. The ADC firmware sends 16-bit and packed samples in bursts of half its ring buffer
+(40960 bytes at 100 kS/s and up: 0.114 s at 180 kS/s, 0.2 s at 100 kS/s) and drops the part of a
+burst it has not sent when it stops, so by default the tail is one burst plus RUN_TAIL_MARGIN (runTail).
+
+Every run returns its stats, with the time spent before the DAC could start (setup) and after it
+had played everything (teardown); summary() averages them over all runs.
+
+Usage:
+    session = LoopbackSession()                   # getDevices(), or a list like it (with make_transport for fake_device.py)
+    for frequency in frequencies:
+        stats = session.run(sine_blocks(180000, frequency, duration=0.5), 180000, "sweep_%d.wav" % frequency)
+    printSummary(session.summary())
+'''
+import threading
+import time
+
+import numpy as np
+
+import DAC_ADC_pyusb
+from DAC_ADC_pyusb import (ADC_RING_SLOTS, DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, HLAF_MAX_BUFFER_SIZE, adcDecoder,
+                           captureADC, getDevices, makeSource, playSamples, startADC, stopADC)
+from adc_recorder import WavRecorder
+from adc_ring import SampleRing
+from sample_format import SAMPLE_BITS, adcBurstSeconds
+
+RUN_TAIL_MARGIN = 0.05 # s on top of one ADC burst (USB transfer, thread wake-ups)
+
+
+def runTail(frame_rate):
+    '''Seconds the ADC keeps recording after the DAC's 'E', long enough for the burst holding the last samples.'''
+    # delta and framed packets are sent one by one, a burst of 16-bit samples is the upper bound for them
+    framed = DAC_ADC_pyusb.ADC_COMPRESSION or DAC_ADC_pyusb.ADC_FRAMED
+    return adcBurstSeconds(frame_rate, SAMPLE_BITS if framed else DAC_ADC_pyusb.ADC_SAMPLE_BITS) + RUN_TAIL_MARGIN
+
+
+class LoopbackSession:
+    def __init__(self, devices=None, credit_window=DAC_CREDIT_WINDOW, sample_bits=DAC_SAMPLE_BITS, tail=None, make_transport=None):
+        start = time.perf_counter()
+        self.devices = getDevices() if devices is None else devices
+        [self.DAC_dev, self.DAC_ep_in, self.DAC_ep_out, self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out] = self.devices
+        self.open_seconds = time.perf_counter() - start
+
+        self.credit_window = credit_window
+        self.sample_bits = sample_bits
+        self.tail = tail # None: runTail(frame_rate) of every run
+        self.make_transport = make_transport # of the ADC's queued transfers, see captureADC
+        self.ADC_ready = threading.Event()
+        self.DAC_finished = threading.Event()
+        self.rings = {} # dtype -> SampleRing, allocated once
+        self.drain = True # stale ADC data is possible before the first run and after a failed one
+        self.runs = []
+
+    def _ring(self, dtype):
+        if dtype not in self.rings:
+            self.rings[dtype] = SampleRing(ADC_RING_SLOTS, HLAF_MAX_BUFFER_SIZE, dtype)
+        return self.rings[dtype]
+
+    def run(self, blocks=None, frame_rate=None, filename=None):
+        '''
+        Play input_filename (or the int16 blocks of an iterator at frame_rate, see runDAC) and record it
+        into filename (output_filename by default). Returns the stats of the run, also kept in self.runs.
+        '''
+        start = time.perf_counter()
+        self.ADC_ready.clear()
+        self.DAC_finished.clear()
+        source = makeSource(blocks, frame_rate, self.sample_bits)
+        result = {'errors': []}
+        thread_adc = threading.Thread(target=self._capture, args=(source.frame_rate, filename or DAC_ADC_pyusb.output_filename, result))
+        thread_adc.start()
+        try:
+            self._play(source, result, runTail(source.frame_rate) if self.tail is None else self.tail)
+        except Exception as e:
+            result['errors'].append(e)
+        finally:
+            self.DAC_finished.set() # never leave the ADC recording forever
+            thread_adc.join()
+            source.close()
+        end = time.perf_counter()
+
+        if result['errors']:
+            self.drain = True
+            raise result['errors'][0]
+        self.drain = False
+        stats = {'samples': result['samples'],
+                 'underruns': result['underruns'],
+                 'seconds': end - start,
+                 'setup_seconds': result['ready'] - start,
+                 'play_seconds': result['played'] - result['ready'],
+                 'teardown_seconds': end - result['played']}
+        stats['overhead_seconds'] = stats['setup_seconds'] + stats['teardown_seconds']
+        self.runs.append(stats)
+        return stats
+
+    def _play(self, source, result, tail):
+        self.ADC_ready.wait()
+        result['underruns'] = playSamples(self.DAC_dev, self.DAC_ep_in, self.DAC_ep_out, source, self.credit_window)
+        result['played'] = time.perf_counter()
+        time.sleep(tail)
+
+    def _capture(self, frame_rate, filename, result):
+        try:
+            decoder = adcDecoder(startADC(self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out, frame_rate, self.drain))
+            ring = self._ring('>i2' if decoder is None else np.uint8)
+            recorder = WavRecorder(filename, frame_rate, ring, decoder)
+            try:
+                result['ready'] = time.perf_counter()
+                self.ADC_ready.set()
+                captureADC(self.ADC_dev, self.ADC_ep_in, ring, recorder.put, self.DAC_finished, make_transport=self.make_transport)
+                stopADC(self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out)
+            except BaseException:
+                try:
+                    recorder.close() # stop the writer thread and close the WAV file all the same
+                except Exception:
+                    pass # the capture error is the one to report
+                raise
+            result['samples'] = recorder.close()
+        except Exception as e:
+            result['errors'].append(e)
+        finally:
+            self.ADC_ready.set() # never leave the DAC waiting forever
+
+    def summary(self):
+        '''Mean time per run and the share of it that is not playing the stimulus.'''
+        if not self.runs:
+            return {'runs': 0}
+        summary = {'runs': len(self.runs), 'open_seconds': self.open_seconds}
+        for key in ['seconds', 'setup_seconds', 'play_seconds', 'teardown_seconds', 'overhead_seconds']:
+            summary[key] = sum(run[key] for run in self.runs) / len(self.runs)
+        summary['overhead_percent'] = 100 * summary['overhead_seconds'] / summary['seconds']
+        return summary
+
+
+def printSummary(summary):
+    print("runs:", summary['runs'], " opening the boards: %.3f s" % summary.get('open_seconds', 0))
+    if summary['runs']:
+        print("per run: %.3f s = setup %.3f + play %.3f + teardown %.3f, overhead %.1f%%" % (
+            summary['seconds'], summary['setup_seconds'], summary['play_seconds'], summary['teardown_seconds'],
+            summary['overhead_percent']))
@@ -0,0 +1,174 @@
+'''
+Several loopback rigs (one DAC + one ADC Teensy each) on one host.
+
+findRigs() enumerates every DAC and ADC board and tells them apart by USB serial number
+(by port path, e.g. "1-4.2", if the serial number cannot be read). RIG_PAIRS says which ADC records
+which DAC; without it the boards are paired in sorted order, which stays the same as long as
+every board keeps its serial number / port.
+runRigs() runs the DAC and ADC streams of all rigs at the same time, each rig with its own
+ready/finished events and output file, and returns per-rig and aggregate stats.
+
+Usage:
+    rigs = findRigs()
+    stats = runRigs(rigs, lambda: sine_blocks(180000, 18000.0, duration=60), frame_rate=180000)
+    printStats(stats)
+'''
+import threading
+import time
+
+import usb.core
+
+from DAC_ADC_pyusb import (ADC_EP_IN, ADC_PRODUCT_ID, DAC_CREDIT_WINDOW, DAC_EP_IN, DAC_PRODUCT_ID,
+                           DAC_SAMPLE_BITS, VENDOR_ID, getEndpoints, runADC, runDAC)
+
+# {DAC id: ADC id}, ids are serial numbers or port paths as printed by findRigs()
+RIG_PAIRS = {}
+OUTPUT_PATTERN = "output_{name}.wav"
+USE_FAKE_DEVICES = 0 # number of simulated rigs (fake_device.py) to run instead of the USB boards
+
+
+def portPath(dev):
+    return str(dev.bus) + "-" + ".".join(str(port) for port in (dev.port_numbers or ()))
+
+
+def deviceId(dev):
+    '''Serial number of a board, its port path if the serial number cannot be read.'''
+    try:
+        serial = dev.serial_number
+    except (usb.core.USBError, ValueError, NotImplementedError):
+        serial = None
+    return serial if serial else portPath(dev)
+
+
+def findBoards(product_id):
+    '''{id: device} of all boards with product_id.'''
+    boards = {}
+    for dev in usb.core.find(find_all=True, idVendor=VENDOR_ID, idProduct=product_id):
+        boards[deviceId(dev)] = dev
+    return boards
+
+
+class Rig:
+    '''One DAC + ADC pair with its own events, output file and results.'''
+    def __init__(self, name, devices, output_filename=None, make_transport=None):
+        [self.DAC_dev, self.DAC_ep_in, self.DAC_ep_out, self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out] = devices
+        self.make_transport = make_transport # of the ADC's queued transfers, see captureADC
+        self.name = name
+        self.output_filename = output_filename or OUTPUT_PATTERN.format(name=name)
+        self.ADC_ready = threading.Event()
+        self.DAC_finished = threading.Event()
+
+        # results of the last run
+        self.underruns = None
+        self.num_samples = None
+        self.seconds = None
+        self.errors = []
+        self.threads = []
+
+    def start(self, blocks=None, frame_rate=None, credit_window=DAC_CREDIT_WINDOW, sample_bits=DAC_SAMPLE_BITS):
+        self.ADC_ready.clear()
+        self.DAC_finished.clear()
+        self.underruns = None
+        self.num_samples = None
+        self.errors = []
+        self.start_time = time.perf_counter()
+        self.threads = [threading.Thread(target=self._runADC, args=(frame_rate,)),
+                        threading.Thread(target=self._runDAC, args=(credit_window, blocks, frame_rate, sample_bits))]
+        for thread in self.threads:
+            thread.start()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        self.seconds = time.perf_counter() - self.start_time
+
+    def _runDAC(self, credit_window, blocks, frame_rate, sample_bits):
+        try:
+            self.underruns = runDAC(self.DAC_dev, self.DAC_ep_in, self.DAC_ep_out, credit_window, blocks, frame_rate, sample_bits,
+                                    self.ADC_ready, self.DAC_finished)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.DAC_finished.set() # never leave the ADC recording forever
+
+    def _runADC(self, frame_rate):
+        try:
+            self.num_samples = runADC(self.ADC_dev, self.ADC_ep_in, self.ADC_ep_out, frame_rate,
+                                      self.output_filename, self.ADC_ready, self.DAC_finished, make_transport=self.make_transport)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.ADC_ready.set() # never leave the DAC waiting forever
+
+
+def findRigs(pairs=None):
+    '''All connected rigs, sorted by DAC id.'''
+    pairs = RIG_PAIRS if pairs is None else pairs
+    DAC_boards = findBoards(DAC_PRODUCT_ID)
+    ADC_boards = findBoards(ADC_PRODUCT_ID)
+    print("DAC boards:", sorted(DAC_boards))
+    print("ADC boards:", sorted(ADC_boards))
+
+    if pairs:
+        missing = [DAC_id for DAC_id in pairs if DAC_id not in DAC_boards] + \
+                  [ADC_id for ADC_id in pairs.values() if ADC_id not in ADC_boards]
+        if missing:
+            raise ValueError('boards not found: ' + ', '.join(missing))
+        pairing = sorted(pairs.items())
+    else:
+        if len(DAC_boards) != len(ADC_boards):
+            raise ValueError('%d DAC and %d ADC boards found, set RIG_PAIRS' % (len(DAC_boards), len(ADC_boards)))
+        pairing = list(zip(sorted(DAC_boards), sorted(ADC_boards)))
+
+    rigs = []
+    for i, (DAC_id, ADC_id) in enumerate(pairing):
+        DAC_dev = DAC_boards[DAC_id]
+        ADC_dev = ADC_boards[ADC_id]
+        DAC_ep_in, DAC_ep_out = getEndpoints(DAC_dev, "DAC", DAC_EP_IN)
+        ADC_ep_in, ADC_ep_out = getEndpoints(ADC_dev, "ADC", ADC_EP_IN)
+        rig = Rig("rig%d" % i, [DAC_dev, DAC_ep_in, DAC_ep_out, ADC_dev, ADC_ep_in, ADC_ep_out])
+        print(rig.name, "DAC", DAC_id, "ADC", ADC_id, "->", rig.output_filename)
+        rigs.append(rig)
+    return rigs
+
+
+def runRigs(rigs, make_blocks=None, frame_rate=None):
+    '''
+    Run all rigs at once and wait for them. make_blocks() returns a new stimulus iterator for every rig
+    (see runDAC), without it every rig plays DAC_ADC_pyusb.input_filename.
+    '''
+    start = time.perf_counter()
+    for rig in rigs:
+        rig.start(make_blocks() if make_blocks is not None else None, frame_rate)
+    for rig in rigs:
+        rig.join()
+    seconds = time.perf_counter() - start
+
+    per_rig = []
+    for rig in rigs:
+        num_samples = rig.num_samples or 0
+        per_rig.append({'name': rig.name, 'output': rig.output_filename, 'samples': num_samples,
+                        'seconds': rig.seconds, 'MB/s': num_samples * 2 / rig.seconds / 1e6,
+                        'underruns': rig.underruns, 'errors': [repr(e) for e in rig.errors]})
+    total_samples = sum(r['samples'] for r in per_rig)
+    return {'rigs': per_rig,
+            'samples': total_samples,
+            'seconds': seconds,
+            'MB/s': total_samples * 2 / seconds / 1e6,
+            'failed': [r['name'] for r in per_rig if r['errors']]}
+
+
+def printStats(stats):
+    print(f"{'rig':>8} {'samples':>12} {'seconds':>8} {'MB/s':>7} {'underruns':>10}  errors")
+    for r in stats['rigs']:
+        print(f"{r['name']:>8} {r['samples']:>12} {r['seconds']:>8.2f} {r['MB/s']:>7.2f} {str(r['underruns']):>10}  {'; '.join(r['errors'])}")
+    print(f"{'total':>8} {stats['samples']:>12} {stats['seconds']:>8.2f} {stats['MB/s']:>7.2f}")
+
+
+if __name__ == "__main__":
+    if USE_FAKE_DEVICES:
+        from fake_device import getFakeDevices
+        rigs = [Rig("rig%d" % i, getFakeDevices()) for i in range(USE_FAKE_DEVICES)]
+    else:
+        rigs = findRigs()
+    printStats(runRigs(rigs))
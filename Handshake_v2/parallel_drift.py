@@ -0,0 +1,144 @@
+'''
+The drift analysis of drift_check.py on all cores: sliding window fits of one capture split into
+batches of windows, or whole captures (fit_whole_sine, cal_sin's zero crossings) one file per task.
+
+No samples are pickled. A worker opens the WAV file memory mapped and reads only the samples of
+its batch (the batches overlap by one window less one step, so every window lies in one batch),
+or, for an array, attaches to a shared memory copy made once by the parent.
+Results come back in window / file order whatever the order the workers finish in.
+
+Usage:
+    freqs, phases, mses = sliding_windows_parallel("output.wav", sine_freq=1000, step_ratio=0.2, return_mse=True)
+    rows = analyze_files("captures/", f0_guess=18000)  # one dict per file, sorted by name
+    pool = startPool()                                  # for many calls: workers started once
+    rows = analyze_files(files, 18000, pool=pool)
+'''
+import contextlib
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from drift_check import (clock_skew, fit_sine_over_sliding_windows, fit_sine_over_sliding_windows_batch,
+                         fit_whole_sine)
+from zero_crossing import wav_period_stats
+
+BATCH_WINDOWS = 256 # windows per task, enough to hide the task overhead, small enough to balance the cores
+SLIDING_METHODS = {'curve_fit': fit_sine_over_sliding_windows, 'batch': fit_sine_over_sliding_windows_batch}
+
+
+def _ready(seconds):
+    time.sleep(seconds) # keeps this worker busy so the next task starts another one
+
+
+def startPool(workers=None):
+    '''
+    A process pool with all its workers started and this module (drift_check, scipy...) imported,
+    for several calls in a row: a spawned worker takes about a second to start.
+    '''
+    workers = workers or os.cpu_count()
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    list(pool.map(_ready, [0.1] * workers))
+    return pool
+
+
+def _pool(workers, pool):
+    # the caller's pool stays open, a new one is shut down after the call
+    if pool is not None:
+        return contextlib.nullcontext(pool)
+    return ProcessPoolExecutor(workers or os.cpu_count(), mp_context=multiprocessing.get_context('spawn'))
+
+
+def _samples(source):
+    # (file name) or (shared memory name, dtype, length) -> samples and what to close afterwards
+    if isinstance(source, str):
+        return wav.read(source, mmap=True)[1], None
+    name, dtype, length = source
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(length, dtype=dtype, buffer=shm.buf), shm
+
+
+def _fitWindows(source, start, stop, Fs, sine_freq, periods_per_window, step_ratio, method):
+    # the windows of samples[start:stop], normalized like fit_sine
+    samples, shm = _samples(source)
+    try:
+        signal = samples[start:stop].astype(np.float64)
+        if np.issubdtype(samples.dtype, np.integer):
+            signal /= np.iinfo(samples.dtype).max
+        return SLIDING_METHODS[method](signal, Fs, sine_freq, periods_per_window, step_ratio, return_mse=True)
+    finally:
+        del samples
+        if shm is not None:
+            shm.close()
+
+
+def sliding_windows_parallel(signal, Fs=None, sine_freq=1000, periods_per_window=5, step_ratio=0.5, return_mse=False,
+                             method='curve_fit', workers=None, batch_windows=BATCH_WINDOWS, pool=None):
+    '''
+    fit_sine_over_sliding_windows (method='curve_fit') or its batch version ('batch') of a WAV file
+    or an array, in batches of batch_windows windows on `workers` processes (all cores by default)
+    or on the workers of pool (startPool).
+    Integer samples are normalized by their dtype's maximum like fit_sine. Same outputs, in order.
+    '''
+    shm = None
+    if isinstance(signal, str):
+        Fs, samples = wav.read(signal, mmap=True)
+        source, length = signal, len(samples)
+        del samples
+    else:
+        signal = np.asarray(signal)
+        shm = shared_memory.SharedMemory(create=True, size=max(signal.nbytes, 1))
+        np.ndarray(signal.shape, dtype=signal.dtype, buffer=shm.buf)[:] = signal
+        source, length = (shm.name, signal.dtype.str, len(signal)), len(signal)
+
+    window_size = int(Fs / sine_freq * periods_per_window)
+    step_size = int(window_size * step_ratio)
+    num_windows = len(range(0, length - window_size, step_size))
+    try:
+        with _pool(workers, pool) as pool:
+            futures = []
+            for first in range(0, num_windows, batch_windows):
+                count = min(batch_windows, num_windows - first)
+                start = first * step_size
+                stop = start + (count - 1) * step_size + window_size + 1 # exactly `count` windows
+                futures.append(pool.submit(_fitWindows, source, start, stop, Fs, sine_freq, periods_per_window, step_ratio, method))
+            freqs, phases, mses = [], [], []
+            for future in futures:
+                f, p, m = future.result()
+                freqs += f
+                phases += p
+                mses += m
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    return (freqs, phases, mses) if return_mse else (freqs, phases)
+
+
+def analyze_file(filename, f0_guess, method='fft', hysteresis=0):
+    '''Whole-capture frequency and skew (fit_whole_sine) and the zero crossing frequency (cal_sin) of one file.'''
+    row = {'file': filename, 'f_est': np.nan, 'skew_ppm': np.nan, 'slip_seconds': np.nan, 'amplitude': np.nan,
+           'zero_crossing_frequency': np.nan, 'period_std': np.nan, 'error': ''}
+    try:
+        f_est, params = fit_whole_sine(filename, f0_guess, method)
+        row['f_est'], row['amplitude'] = f_est, abs(params[0])
+        row['skew_ppm'], row['slip_seconds'] = clock_skew(f_est, f0_guess)
+        stats = wav_period_stats(filename, hysteresis=hysteresis)
+        row['zero_crossing_frequency'], row['period_std'] = stats['frequency'], stats['period_std']
+    except (RuntimeError, ValueError, OSError) as e: # no convergence, not a WAV file...
+        row['error'] = repr(e)
+    return row
+
+
+def analyze_files(paths, f0_guess, method='fft', hysteresis=0, workers=None, pool=None):
+    '''analyze_file for every file (a list, or every .wav in a directory), one per task, rows in the same order.'''
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(os.path.join(paths, '*.wav')))
+    with _pool(workers, pool) as pool:
+        futures = [pool.submit(analyze_file, path, f0_guess, method, hysteresis) for path in paths]
+        return [future.result() for future in futures]
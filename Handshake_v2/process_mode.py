@@ -0,0 +1,176 @@
+'''
+Run the ADC reader, and optionally the DAC sender, in processes of their own.
+
+In thread mode the USB loops share the GIL with the recorder, the DAC producer and whatever else runs
+in the main process (plots, analysis), so a busy thread can keep the ADC reader from picking up
+its data in time. Here the reader process owns the ADC, captures like runADC and copies every
+transfer into a SharedRing (shm_ring.py); the main process decodes and records from that ring.
+The events stay simple: ready/finished can be the usual threading.Events, every process
+gets a multiprocessing.Event of its own that is set from here.
+
+USB handles cannot be passed to another process, so a process opens its board itself with
+open_device(), a picklable callable returning [dev, ep_in, ep_out]: functools.partial(openBoard, ...)
+for a Teensy (by the id from multi_rig.deviceId), fake_device.openFakeADC/openFakeDAC for the simulation
+(with make_transport=FakeADC.async_transport for the ADC's queued transfers).
+The board must not be open in the main process (usb.util.dispose_resources(dev) closes it).
+The child processes read the settings (ADC_ASYNC_TRANSFERS, ADC_SAMPLE_BITS, ...) from DAC_ADC_pyusb.py.
+
+Usage:
+    ADC_id = deviceId(ADC_dev); usb.util.dispose_resources(ADC_dev)
+    runADCProcess(partial(openBoard, ADC_PRODUCT_ID, "ADC", ADC_EP_IN, ADC_id), 180000)
+'''
+import multiprocessing
+import queue
+import time
+import wave
+
+import numpy as np
+
+import DAC_ADC_pyusb
+from DAC_ADC_pyusb import (ADC_RING_SLOTS, DAC_CREDIT_WINDOW, DAC_SAMPLE_BITS, HLAF_MAX_BUFFER_SIZE, adcDecoder,
+                           captureADC, getEndpoints, runDAC, saveGaps, startADC, stopADC)
+from adc_recorder import WavRecorder
+from adc_ring import SampleRing
+from framed_format import FramedDecoder
+from multi_rig import findBoards
+from shm_ring import SharedRing
+
+SHARED_RING_SIZE = 8 << 20 # bytes, > 20 s of 16-bit samples at 180 kHz
+POLL_INTERVAL = 0.001
+
+
+def openBoard(product_id, name, ep_in_address, board_id=None):
+    '''[dev, ep_in, ep_out] of the board with board_id (serial number or port path), the first one if None.'''
+    boards = findBoards(product_id)
+    if not boards:
+        raise ValueError(name + '_device not found')
+    dev = boards[board_id] if board_id is not None else boards[sorted(boards)[0]]
+    return [dev] + getEndpoints(dev, name, ep_in_address)
+
+
+def _context():
+    return multiprocessing.get_context('spawn') # the same on Windows and Linux, no forked USB state
+
+
+def _waitStatus(process, status):
+    '''Next message of a child process, raises if the process died without sending it.'''
+    while True:
+        try:
+            return status.get(timeout=0.1)
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(process.name + ' exited with code %s' % process.exitcode)
+
+
+# =============================================
+# ========= ADC
+# =============================================
+def _readerMain(open_device, frame_rate, ring_name, stop, status, make_transport):
+    ADC_dev, ADC_ep_in, ADC_ep_out = open_device()
+    shared = SharedRing(name=ring_name)
+    status.put(startADC(ADC_dev, ADC_ep_in, ADC_ep_out, frame_rate))
+
+    # transfers land in local slots and are copied to the shared ring right away
+    ring = SampleRing(ADC_RING_SLOTS, HLAF_MAX_BUFFER_SIZE, np.uint8)
+    def forward(data, slot):
+        shared.write(data)
+        ring.release(slot)
+
+    captureADC(ADC_dev, ADC_ep_in, ring, forward, stop, make_transport=make_transport)
+    stopADC(ADC_dev, ADC_ep_in, ADC_ep_out)
+    status.put({'lost': getattr(ADC_dev, 'lost', None)}) # only the simulation counts lost samples
+    shared.close()
+
+
+def runADCProcess(open_device, frame_rate=None, filename=None, ready=None, finished=None, make_transport=None):
+    '''
+    runADC with the USB side in a reader process. Returns (number of samples written, stats of the reader).
+    make_transport goes to captureADC in the reader process, so it must be picklable (FakeADC.async_transport is).
+    '''
+    filename = DAC_ADC_pyusb.output_filename if filename is None else filename
+    ready = DAC_ADC_pyusb.ADC_ready if ready is None else ready
+    finished = DAC_ADC_pyusb.DAC_finished if finished is None else finished
+    if frame_rate is None:
+        with wave.open(DAC_ADC_pyusb.input_filename, "rb") as wav:
+            frame_rate = wav.getframerate()
+
+    context = _context()
+    shared = SharedRing(SHARED_RING_SIZE)
+    stop = context.Event()
+    status = context.Queue()
+    process = context.Process(target=_readerMain, name='ADC reader',
+                              args=(open_device, frame_rate, shared.name, stop, status, make_transport), daemon=True)
+    process.start()
+    try:
+        decoder = adcDecoder(_waitStatus(process, status))
+        ready.set()
+
+        ring = SampleRing(ADC_RING_SLOTS, HLAF_MAX_BUFFER_SIZE, '>i2' if decoder is None else np.uint8)
+        recorder = WavRecorder(filename, frame_rate, ring, decoder)
+        multiple = 2 if decoder is None else 1 # the '>i2' view needs whole samples
+        max_used = 0
+        while True:
+            if finished.is_set():
+                stop.set()
+            max_used = max(max_used, shared.available())
+            slot = ring.acquire()
+            num_bytes = shared.readinto(ring.slots[slot], multiple)
+            if num_bytes > 0:
+                recorder.put(ring.view(slot, num_bytes), slot)
+                continue
+            ring.release(slot)
+            if not process.is_alive() or not status.empty():
+                if shared.available() < multiple:
+                    break
+                continue
+            time.sleep(POLL_INTERVAL)
+        stats = _waitStatus(process, status)
+        num = recorder.close()
+    finally:
+        stop.set()
+        process.join()
+        shared.close()
+        shared.unlink()
+
+    stats['max_shared_bytes'] = max_used
+    print("[ADC] byte num", num*2)
+    print("[ADC] most bytes waiting in the shared ring: ", max_used)
+    if isinstance(decoder, FramedDecoder):
+        saveGaps(decoder, filename)
+    print("[ADC] recording completed. Saved as", filename)
+    return num, stats
+
+
+# =============================================
+# ========= DAC
+# =============================================
+def _senderMain(open_device, credit_window, make_blocks, frame_rate, sample_bits, start, status):
+    DAC_dev, DAC_ep_in, DAC_ep_out = open_device()
+    blocks = make_blocks() if make_blocks is not None else None
+    status.put(runDAC(DAC_dev, DAC_ep_in, DAC_ep_out, credit_window, blocks, frame_rate, sample_bits, start))
+
+
+def runDACProcess(open_device, credit_window=DAC_CREDIT_WINDOW, make_blocks=None, frame_rate=None, sample_bits=DAC_SAMPLE_BITS,
+                  ready=None, finished=None):
+    '''
+    runDAC in a sender process. make_blocks() is called there to create the stimulus iterator,
+    so it has to be picklable (a module function or functools.partial, e.g. partial(sine_blocks, 180000, 18000.0, 60)).
+    Returns the number of underruns reported by the DAC.
+    '''
+    ready = DAC_ADC_pyusb.ADC_ready if ready is None else ready
+    finished = DAC_ADC_pyusb.DAC_finished if finished is None else finished
+
+    context = _context()
+    start = context.Event()
+    status = context.Queue()
+    process = context.Process(target=_senderMain, name='DAC sender', daemon=True,
+                              args=(open_device, credit_window, make_blocks, frame_rate, sample_bits, start, status))
+    process.start()
+    try:
+        ready.wait()
+        start.set()
+        underruns = _waitStatus(process, status)
+    finally:
+        finished.set() # never leave the ADC recording forever
+        process.join()
+    return underruns
@@ -0,0 +1,128 @@
+'''
+Packed sample formats for the USB link.
+
+By default both boards move 16-bit words (ADC -> PC big-endian '>i2', PC -> DAC little-endian like the WAV file).
+When the converter does not use all 16 bits, only the top sample_bits bits of every word are sent,
+MSB first as one continuous bit stream, e.g. 12 bits: 2 samples in 3 bytes (25% less USB traffic),
+14 bits: 4 samples in 7 bytes (12.5% less). Unpacking shifts the bits back to the top of a 16-bit word,
+so captures keep the same scale as in 16-bit mode.
+
+The format is negotiated in the header PC sends first (see runADC / playSamples in DAC_ADC_pyusb.py):
+  ADC  4 bytes rate                              -> ACK '1', 16-bit samples
+       8 bytes rate + sample_bits                -> ACK 'P' packed, or '1' if the firmware stays at 16 bits
+       8 bytes rate + DELTA_FORMAT               -> ACK 'D' compressed packets (delta_format.py)
+  DAC  12 bytes rate + credit window + sample_bits (credit mode only)
+The stream does not restart at USB packet boundaries, so PackedDecoder/PackedEncoder carry
+incomplete groups from one buffer to the next.
+'''
+from math import gcd
+
+import numpy as np
+
+SAMPLE_BITS = 16           # plain 16-bit words
+PACKED_BITS = (10, 12, 14) # widths the firmware can pack
+ADC_BUFFER_SIZES = [(100000, 81920), (50000, 40960), (20000, 4096), (0, 1024)] # lowest rate -> ring buffer of ADC_usb_serial.ino
+
+
+def groupSize(sample_bits):
+    '''(samples, bytes) of the smallest group that ends on a byte boundary, e.g. 12 bits: (2, 3).'''
+    num_samples = 8 // gcd(sample_bits, 8)
+    return num_samples, num_samples * sample_bits // 8
+
+
+def adcBurstSize(frame_rate):
+    '''
+    Bytes the ADC firmware sends at a time in 16-bit and packed mode: half of its ring buffer, which
+    it sizes by the sampling rate. On 'e' it stops without sending the half that is not full.
+    '''
+    for lowest_rate, size in ADC_BUFFER_SIZES:
+        if frame_rate >= lowest_rate:
+            return size // 2
+
+
+def adcBurstSeconds(frame_rate, sample_bits=SAMPLE_BITS):
+    '''Time the ADC takes to fill one burst, the longest a sample waits on the board.'''
+    return adcBurstSize(frame_rate) * 8 / (sample_bits * frame_rate)
+
+
+def packedSize(num_samples, sample_bits):
+    '''Bytes needed for num_samples samples, the last byte is padded with zero bits.'''
+    return (num_samples * sample_bits + 7) // 8
+
+
+def pack(samples, sample_bits):
+    '''Top sample_bits bits of 16-bit samples (int16 or uint16, any byte order) as a packed byte string.'''
+    words = np.asarray(samples).astype(np.uint16) >> (16 - sample_bits)
+    group_samples, group_bytes = groupSize(sample_bits)
+    num_samples = len(words)
+
+    num_groups = -(-num_samples // group_samples)
+    if num_groups * group_samples != num_samples:
+        words = np.concatenate((words, np.zeros(num_groups * group_samples - num_samples, dtype=np.uint16)))
+    words = words.reshape(num_groups, group_samples).astype(np.uint64)
+
+    # one integer of group_bytes bytes per group, first sample in the most significant bits
+    groups = np.zeros(num_groups, dtype=np.uint64)
+    for i in range(group_samples):
+        groups |= words[:, i] << np.uint64(sample_bits * (group_samples - 1 - i))
+
+    packed = np.empty((num_groups, group_bytes), dtype=np.uint8)
+    for j in range(group_bytes):
+        packed[:, j] = groups >> np.uint64(8 * (group_bytes - 1 - j))
+    return packed.reshape(-1)[:packedSize(num_samples, sample_bits)].tobytes()
+
+
+def unpack(data, sample_bits):
+    '''Whole groups of packed bytes to little-endian int16 samples ('<i2', the WAV format).'''
+    group_samples, group_bytes = groupSize(sample_bits)
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) % group_bytes != 0:
+        raise ValueError('packed data must be a whole number of groups')
+    data = data.reshape(-1, group_bytes)
+
+    groups = np.zeros(len(data), dtype=np.uint64)
+    for j in range(group_bytes):
+        groups |= data[:, j].astype(np.uint64) << np.uint64(8 * (group_bytes - 1 - j))
+
+    words = np.empty((len(data), group_samples), dtype=np.uint16)
+    mask = np.uint64((1 << sample_bits) - 1)
+    for i in range(group_samples):
+        words[:, i] = ((groups >> np.uint64(sample_bits * (group_samples - 1 - i))) & mask) << np.uint64(16 - sample_bits)
+    return words.reshape(-1).view('<i2')
+
+
+class PackedDecoder:
+    '''Unpack a packed ADC stream buffer by buffer, keeping an incomplete group for the next one.'''
+    def __init__(self, sample_bits):
+        self.sample_bits = sample_bits
+        self.group_bytes = groupSize(sample_bits)[1]
+        self.carry = b''
+
+    def decode(self, data):
+        if self.carry:
+            data = self.carry + bytes(data)
+        whole = len(data) - len(data) % self.group_bytes
+        self.carry = bytes(data[whole:])
+        return unpack(data[:whole], self.sample_bits)
+
+
+class PackedEncoder:
+    '''Pack blocks of samples for the DAC, samples of an incomplete group wait for the next block.'''
+    def __init__(self, sample_bits):
+        self.sample_bits = sample_bits
+        self.group_samples = groupSize(sample_bits)[0]
+        self.carry = np.zeros(0, dtype=np.int16)
+
+    def encode(self, block):
+        block = np.asarray(block, dtype=np.int16)
+        if len(self.carry):
+            block = np.concatenate((self.carry, block))
+        whole = len(block) - len(block) % self.group_samples
+        self.carry = block[whole:]
+        return pack(block[:whole], self.sample_bits)
+
+    def flush(self):
+        '''The remaining samples, the last byte padded with zero bits.'''
+        data = pack(self.carry, self.sample_bits)
+        self.carry = self.carry[:0]
+        return data
@@ -0,0 +1,102 @@
+'''
+Single-producer single-consumer byte ring in shared memory, for passing ADC data between processes.
+
+The segment starts with two byte counters that only ever grow: the write index, changed only by the
+producer, and the read index, changed only by the consumer, each on its own cache line.
+A side copies its data first and then publishes the new index with one aligned 8-byte store,
+so no lock is needed. A child process attaches with SharedRing(name=ring.name).
+'''
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+HEADER_SIZE = 128 # write index at byte 0, read index at 64, capacity at 8
+WRITE, CAPACITY, READ = 0, 1, 8 # positions in the uint64 header
+POLL_INTERVAL = 0.0005
+
+
+class SharedRing:
+    '''
+    Usage:
+        ring = SharedRing(capacity=4 << 20)              # creating process
+        other = SharedRing(name=ring.name)               # attaching process
+        ring.write(data)                                  # producer, waits while the ring is full
+        num_bytes = other.readinto(buffer)                # consumer, 0 if nothing is there
+        other.close(); ring.close(); ring.unlink()
+    '''
+    def __init__(self, capacity=None, name=None):
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+            self.header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shm.buf)
+            self.header[:] = 0
+            self.header[CAPACITY] = capacity
+        else:
+            # child processes share the resource tracker of their parent, only the creator unlinks
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.header = np.ndarray(HEADER_SIZE // 8, dtype=np.uint64, buffer=self.shm.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.data = np.ndarray(self.capacity, dtype=np.uint8, buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def available(self):
+        '''Bytes written but not read yet.'''
+        return int(self.header[WRITE] - self.header[READ])
+
+    # ----- producer
+    def write(self, data, timeout=None):
+        '''Copy all of data into the ring, waiting for space. Returns False on timeout.'''
+        data = np.frombuffer(data, dtype=np.uint8)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        write_index = int(self.header[WRITE])
+        done = 0
+        while done < len(data):
+            free = self.capacity - (write_index - int(self.header[READ]))
+            if free == 0:
+                if deadline is not None and time.perf_counter() > deadline:
+                    return False
+                time.sleep(POLL_INTERVAL)
+                continue
+            count = self._copy(self.data, write_index, data[done:done + free], into_ring=True)
+            write_index += count
+            done += count
+            self.header[WRITE] = write_index # publish after the data is in place
+        return True
+
+    # ----- consumer
+    def readinto(self, buffer, multiple=1):
+        '''
+        Move up to len(buffer) bytes out of the ring, a multiple of `multiple` bytes (e.g. 2 for whole
+        16-bit samples). Returns the number of bytes, 0 if there is not enough data.
+        '''
+        buffer = np.frombuffer(buffer, dtype=np.uint8)
+        read_index = int(self.header[READ])
+        count = min(int(self.header[WRITE]) - read_index, len(buffer))
+        count -= count % multiple
+        if count == 0:
+            return 0
+        self._copy(self.data, read_index, buffer[:count], into_ring=False)
+        self.header[READ] = read_index + count # release the space after the data is copied out
+        return count
+
+    def _copy(self, ring_data, index, other, into_ring):
+        # at most two pieces: up to the end of the ring, then from its start
+        start = index % self.capacity
+        first = min(len(other), self.capacity - start)
+        if into_ring:
+            ring_data[start:start + first] = other[:first]
+            ring_data[:len(other) - first] = other[first:]
+        else:
+            other[:first] = ring_data[start:start + first]
+            other[first:] = ring_data[:len(other) - first]
+        return len(other)
+
+    def close(self):
+        del self.header, self.data # views must go before the mapping is closed
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
@@ -0,0 +1,122 @@
+'''
+Clock skew of the ADC against the DAC while the capture is running, from a known test tone.
+
+The recorder's writer thread hands every decoded buffer to SkewMonitor.update. The samples are cut
+into blocks of block_samples, and each block's DFT at the nominal tone frequency (Hann window,
+phase referred to the first sample) gives the tone's phase. The phase drifts by 2*pi*(f - f_nom)
+per second, so the slope of a weighted least squares line through the phases is the frequency
+offset, like estimate_frequency in drift_check.py. The line is kept as running sums, so a
+block costs one dot product and a few float operations however long the capture is.
+Blocks without the tone (before the DAC starts, after it stops) and the block where it starts
+are left out. Offsets up to +-frame_rate / (2 * block_samples) are tracked (22 Hz at 180 kHz).
+
+Every `interval` seconds of capture, the estimate is printed and passed to callback(estimate), a dict:
+    seconds          capture time so far
+    frequency        estimated tone frequency (Hz)
+    skew_ppm         (frequency - nominal) / nominal in ppm, like clock_skew in drift_check.py
+    skew_ppm_error   standard error of skew_ppm (1 sigma)
+    slip_seconds     seconds until one cycle slips
+    blocks           blocks used so far
+With limit_ppm, on_limit() is called once the skew is more than 2 sigma beyond it.
+
+Usage:
+    monitor = SkewMonitor(180000, 18000, limit_ppm=50, on_limit=DAC_finished.set) # stop a run that has drifted
+    runADC(ADC_dev, ADC_ep_in, ADC_ep_out, 180000, monitor=monitor)
+'''
+import numpy as np
+
+BLOCK_SAMPLES = 4096
+ACTIVE_LEVEL = 0.1 # blocks below this part of the strongest one so far are silence
+
+
+class SkewMonitor:
+    def __init__(self, frame_rate, nominal_frequency, interval=1.0, callback=None, limit_ppm=None, on_limit=None,
+                 block_samples=BLOCK_SAMPLES, verbose=True):
+        self.frame_rate = frame_rate
+        self.nominal_frequency = nominal_frequency
+        self.callback = callback
+        self.limit_ppm = limit_ppm
+        self.on_limit = on_limit
+        self.verbose = verbose
+        self.block_samples = block_samples
+        self.report_blocks = max(1, round(interval * frame_rate / block_samples))
+
+        window = np.hanning(block_samples)
+        self.kernel = window * np.exp(-2j * np.pi * nominal_frequency / frame_rate * np.arange(block_samples))
+        self.pending = np.empty(0) # samples of an incomplete block
+        self.num_blocks = 0
+        self.max_level = 0.0
+        self.previous = None       # phase of the previous block (unwrapped) if it had the tone
+        # weighted running means and co-moments of (time, phase), Welford's update
+        self.weight = 0.0
+        self.mean_t = self.mean_phase = 0.0
+        self.Stt = self.Stp = self.Spp = 0.0
+        self.used = 0
+        self.estimate = None
+        self.limit_reached = False
+
+    def update(self, samples):
+        '''Add the next samples of the capture (any length).'''
+        samples = np.concatenate((self.pending, samples))
+        num = len(samples) // self.block_samples
+        self.pending = samples[num * self.block_samples:]
+        if num == 0:
+            return
+        X = samples[:num * self.block_samples].reshape(num, self.block_samples) @ self.kernel
+        starts = (self.num_blocks + np.arange(num)) * self.block_samples
+        X *= np.exp(-2j * np.pi * np.mod(self.nominal_frequency / self.frame_rate * starts, 1))
+        for k in range(num):
+            self._add(abs(X[k]), np.angle(X[k]), (starts[k] + self.block_samples / 2) / self.frame_rate)
+            self.num_blocks += 1
+            if self.num_blocks % self.report_blocks == 0:
+                self.publish()
+
+    def _add(self, level, angle, t):
+        self.max_level = max(self.max_level, level)
+        if level < ACTIVE_LEVEL * self.max_level:
+            self.previous = None
+            return
+        if self.previous is None: # the tone starts in this block
+            self.previous = angle
+            return
+        phase = self.previous + np.angle(np.exp(1j * (angle - self.previous)))
+        self.previous = phase
+
+        w = level * level
+        self.weight += w
+        dt = t - self.mean_t
+        dp = phase - self.mean_phase
+        self.mean_t += w / self.weight * dt
+        self.mean_phase += w / self.weight * dp
+        self.Stt += w * dt * (t - self.mean_t)
+        self.Stp += w * dt * (phase - self.mean_phase)
+        self.Spp += w * dp * (phase - self.mean_phase)
+        self.used += 1
+
+    def publish(self):
+        '''Compute, print and hand over the current estimate (None before three blocks with the tone).'''
+        if self.used < 3 or self.Stt <= 0:
+            return None
+        slope = self.Stp / self.Stt # rad/s
+        residual = max(self.Spp - slope * self.Stp, 0.0) / (self.used - 2)
+        offset = float(slope / (2 * np.pi))
+        error = float(np.sqrt(residual / self.Stt) / (2 * np.pi))
+        frequency = self.nominal_frequency + offset
+        self.estimate = {'seconds': self.num_blocks * self.block_samples / self.frame_rate,
+                         'frequency': frequency,
+                         'skew_ppm': offset / self.nominal_frequency * 1e6,
+                         'skew_ppm_error': error / self.nominal_frequency * 1e6,
+                         'slip_seconds': 1 / offset if offset != 0 else float('inf'),
+                         'blocks': self.used}
+        if self.verbose:
+            print("[ADC] %.0f s: %.4f Hz, skew %+.4f +- %.4f ppm" % (
+                self.estimate['seconds'], frequency, self.estimate['skew_ppm'], self.estimate['skew_ppm_error']))
+        if self.callback is not None:
+            self.callback(self.estimate)
+        if (self.limit_ppm is not None and not self.limit_reached
+                and abs(self.estimate['skew_ppm']) - 2 * self.estimate['skew_ppm_error'] > self.limit_ppm):
+            self.limit_reached = True
+            print("[ADC] clock skew beyond %g ppm" % self.limit_ppm)
+            if self.on_limit is not None:
+                self.on_limit()
+        return self.estimate
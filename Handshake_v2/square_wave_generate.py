@@ -1,6 +1,11 @@
+import wave
+from fractions import Fraction
+
 import numpy as np
 from scipy.io import wavfile as wav
 
+BLOCK_SIZE = 65536 # samples per block for the streaming generators
+
 def gen_sharp_square_wave():
     # Set sampling rate and frequency
     sample_rate = 150000
@@ -62,6 +67,94 @@ def gen_sine_wave():
     wav.write(filename, sample_rate, scaled_wave)
     print(f"Created successfully: {filename}")
 
+# =============================================
+# ========= Streaming generators
+# =============================================
+def phase_blocks(sample_rate, frequency, duration=None, block_size=BLOCK_SIZE):
+    '''
+    Phase in cycles of every sample, one block at a time (duration=None never ends).
+    The phase at the start of each block is computed exactly from the sample index with fractions,
+    so the signal stays phase-continuous and does not drift however many blocks are generated.
+    '''
+    step = Fraction(frequency) / Fraction(sample_rate) # cycles per sample
+    offsets = np.arange(block_size) * float(step)
+    num_samples = None if duration is None else int(sample_rate * duration)
+
+    start = 0
+    while num_samples is None or start < num_samples:
+        n = block_size if num_samples is None else min(block_size, num_samples - start)
+        start_phase = float((start * step) % 1)
+        yield start_phase + offsets[:n]
+        start += n
+
+
+def _wave_blocks(wave_function, sample_rate, frequency, duration, block_size):
+    # wave_function(phase in cycles) -> int16, block by block. When a period is a whole number of
+    # samples (e.g. sample_rate/10), one period is computed with the exact phases and the blocks are copied from it
+    step = Fraction(frequency) / Fraction(sample_rate)
+    period = step.denominator
+    if period > block_size:
+        for phase in phase_blocks(sample_rate, frequency, duration, block_size):
+            yield wave_function(phase)
+        return
+
+    one_period = wave_function(np.arange(period) * step.numerator % period / period)
+    table = np.tile(one_period, block_size // period + 2)
+    num_samples = None if duration is None else int(sample_rate * duration)
+    start = 0
+    while num_samples is None or start < num_samples:
+        n = block_size if num_samples is None else min(block_size, num_samples - start)
+        offset = start % period
+        yield table[offset:offset + n].copy()
+        start += n
+
+
+def sine_blocks(sample_rate, frequency, duration=None, amplitude=1.0, block_size=BLOCK_SIZE):
+    '''Same signal as gen_sine_wave, as int16 blocks for dac_source.BlockStreamSource.'''
+    scale = amplitude * np.iinfo(np.int16).max
+    def sine(phase):
+        phase = phase * (2 * np.pi)
+        np.sin(phase, out=phase)
+        phase *= scale
+        return phase.astype(np.int16)
+    return _wave_blocks(sine, sample_rate, frequency, duration, block_size)
+
+
+def square_blocks(sample_rate, frequency, duration=None, amplitude=1.0, block_size=BLOCK_SIZE):
+    '''Same signal as gen_sharp_square_wave (high for the first half of every period, then 0), as int16 blocks.'''
+    high = np.int16(amplitude * np.iinfo(np.int16).max)
+    def square(phase):
+        return np.where(phase % 1 < 0.5, high, np.int16(0))
+    return _wave_blocks(square, sample_rate, frequency, duration, block_size)
+
+
+def write_wav_blocks(filename, sample_rate, blocks):
+    '''
+    Write int16 blocks (sine_blocks, square_blocks...) to a mono WAV file as they are generated,
+    so only one block is in memory whatever the duration. Returns the number of samples written.
+    '''
+    num_samples = 0
+    with wave.open(filename, 'wb') as output_file:
+        output_file.setnchannels(1)  # Mono audio
+        output_file.setsampwidth(2)  # 16-bit
+        output_file.setframerate(sample_rate)
+        for block in blocks:
+            # the sizes in the header are written once, on close
+            output_file.writeframesraw(np.ascontiguousarray(block, dtype='<i2'))
+            num_samples += len(block)
+    return num_samples
+
+
+def write_sine_wave(filename, sample_rate, frequency, duration, amplitude=1.0, block_size=BLOCK_SIZE):
+    '''gen_sine_wave streamed to filename in blocks, for any duration at constant memory.'''
+    return write_wav_blocks(filename, sample_rate, sine_blocks(sample_rate, frequency, duration, amplitude, block_size))
+
+
+def write_square_wave(filename, sample_rate, frequency, duration, amplitude=1.0, block_size=BLOCK_SIZE):
+    '''gen_sharp_square_wave streamed to filename in blocks, for any duration at constant memory.'''
+    return write_wav_blocks(filename, sample_rate, square_blocks(sample_rate, frequency, duration, amplitude, block_size))
+
+
 if __name__ == "__main__":
     # gen_sharp_square_wave()
     gen_sine_wave()
@@ -0,0 +1,104 @@
+'''
+Generated stimuli (square_wave_generate.py) kept on disk ready to send to the DAC.
+
+A stimulus is stored under the hash of its generator parameters (waveform, sample rate, frequency,
+number of samples, amplitude, sample bits) and of the generator sources, as the exact byte stream
+the DAC sender sends: little-endian samples (packed for sample_bits < 16) with the tail padding
+already appended, after a HEADER. source() memory-maps it (dac_source.MappedStreamSource), so a
+stimulus is synthesized and padded once and then sent straight from the page cache on every run.
+A stimulus is generated block by block into a temporary file and renamed, so memory stays constant
+and several processes can share a cache. A hit refreshes its mtime; when the directory grows
+beyond max_bytes, the least recently used stimuli are deleted (cache_files.py).
+
+Usage:
+    stimuli = StimulusCache()
+    session.run(stimuli.source('sine', 180000, 18000.0, 60))     # or runDAC(..., blocks=stimuli.source(...))
+    filename = stimuli.path('square', 150000, 75000, 5)          # generated if missing
+'''
+import hashlib
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import sample_format
+import square_wave_generate
+from cache_files import cacheSize, evict, fileHash
+from dac_source import PACKET_SIZE, TAIL_PADDING, MappedStreamSource
+from sample_format import SAMPLE_BITS, PackedEncoder
+from square_wave_generate import sine_blocks, square_blocks
+
+WAVEFORMS = {'sine': sine_blocks, 'square': square_blocks}
+CACHE_DIR = ".stimulus_cache"
+CACHE_MAX_BYTES = 4 << 30
+HEADER = struct.Struct('<4sIII')  # magic, version, frame rate, sample bits
+MAGIC = b'STIM'
+VERSION = 1
+
+
+# changing the generators or the packing invalidates every stimulus
+SOURCE_HASH = hashlib.blake2b(''.join(fileHash(module.__file__) for module in
+                                      (square_wave_generate, sample_format)).encode()).hexdigest()
+
+
+class StimulusCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, waveform, sample_rate, frequency, duration, amplitude=1.0, sample_bits=SAMPLE_BITS):
+        num_samples = int(sample_rate * duration) # 60 and 60.0 s are the same stimulus
+        text = repr((VERSION, SOURCE_HASH, waveform, int(sample_rate), float(frequency), num_samples,
+                     float(amplitude), int(sample_bits)))
+        return hashlib.blake2b(text.encode(), digest_size=20).hexdigest()
+
+    def path(self, waveform, sample_rate, frequency, duration, amplitude=1.0, sample_bits=SAMPLE_BITS):
+        '''File of the stimulus, generated if it is not in the cache.'''
+        path = os.path.join(self.directory, self.key(waveform, sample_rate, frequency, duration, amplitude, sample_bits) + '.stim')
+        try:
+            os.utime(path) # most recently used
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        blocks = WAVEFORMS[waveform](sample_rate, frequency, duration, amplitude)
+        self._generate(path, blocks, sample_rate, sample_bits)
+        evict(self.directory, '.stim', self.max_bytes, keep=path)
+        return path
+
+    def source(self, waveform, sample_rate, frequency, duration, amplitude=1.0, sample_bits=SAMPLE_BITS):
+        '''The stimulus as a memory-mapped source for the DAC sender (makeSource, runDAC, sessions).'''
+        path = self.path(waveform, sample_rate, frequency, duration, amplitude, sample_bits)
+        return MappedStreamSource(path, sample_rate, sample_bits, HEADER.size)
+
+    def _generate(self, path, blocks, frame_rate, sample_bits):
+        # the same bytes BlockStreamSource would send for these blocks
+        encoder = PackedEncoder(sample_bits) if sample_bits != SAMPLE_BITS else None
+        total = 0
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as f:
+            try:
+                f.write(HEADER.pack(MAGIC, VERSION, frame_rate, sample_bits))
+                for block in blocks:
+                    data = np.asarray(block, dtype='<i2').tobytes() if encoder is None else encoder.encode(block)
+                    f.write(data)
+                    total += len(data)
+                if encoder is not None:
+                    data = encoder.flush()
+                    f.write(data)
+                    total += len(data)
+                if total % PACKET_SIZE == 0:
+                    f.write(TAIL_PADDING)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def size(self):
+        '''Bytes of stimuli in the cache.'''
+        return cacheSize(self.directory, '.stim')
@@ -0,0 +1,148 @@
+'''
+Sample rate / tone frequency sweep on one loopback rig.
+
+Every point of the grid is a sine like gen_sine_wave() in square_wave_generate.py, generated block by
+block while it is sent (sine_blocks), so no stimulus files are needed. With a StimulusCache
+(stimulus_cache.py) every stimulus is generated once and sent from the cache in later sweeps. The boards stay open for the
+whole sweep (loopback_session.py). Each capture is analysed in a worker process while the
+next point is being captured: the sine is fitted to the part of the capture where the tone is
+present, the frequency and clock skew are computed as in drift_check.py.
+A point that fails is recorded with its error and the sweep goes on.
+Every finished row is appended to RESULTS_FILE right away, so an interrupted sweep keeps its results.
+
+Usage:
+    session = LoopbackSession()
+    results = runSweep(session, grid([100000, 180000], [1000, 10000, 18000]))
+    printResults(results)
+'''
+import csv
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from drift_check import clock_skew, fit_sine
+from loopback_session import LoopbackSession
+from square_wave_generate import sine_blocks
+
+SAMPLE_RATES = [100000, 150000, 180000]
+FREQUENCIES = [1000, 2000, 5000, 10000, 18000]
+DURATION = 1.0        # seconds of stimulus per point
+OUTPUT_DIR = "sweep"
+RESULTS_FILE = "sweep_results.csv"
+KEEP_CAPTURES = True  # keep the WAV file of every point
+ANALYSIS_WORKERS = 1  # the analysis of point k only has to keep up with the capture of point k+1
+ACTIVE_THRESHOLD = 0.1 # part of the peak level above which the tone counts as present
+EDGE_SECONDS = 0.01    # cut from both ends of the tone (DAC start-up, end of playback)
+USE_FAKE_DEVICES = False # run on fake_device.py (no tone in the capture, only checks the sweep itself)
+
+COLUMNS = ['point', 'sample_rate', 'frequency', 'samples', 'underruns', 'run_seconds',
+           'f_est', 'skew_ppm', 'slip_seconds', 'amplitude', 'error']
+
+
+def grid(sample_rates, frequencies):
+    '''(sample_rate, frequency) of every combination below the Nyquist frequency.'''
+    return [(rate, frequency) for rate in sample_rates for frequency in frequencies if frequency < rate / 2]
+
+
+def activeRegion(y, Fs):
+    '''The samples between the first and last one above ACTIVE_THRESHOLD of the peak, without EDGE_SECONDS at both ends.'''
+    level = np.abs(y.astype(np.float64))
+    active = np.nonzero(level > ACTIVE_THRESHOLD * level.max())[0] if len(y) else []
+    if len(active) == 0:
+        return y[:0]
+    edge = int(EDGE_SECONDS * Fs)
+    return y[active[0] + edge:active[-1] + 1 - edge]
+
+
+def analyzePoint(filename, frequency):
+    '''Measured frequency and skew of one capture (runs in a worker process).'''
+    result = dict.fromkeys(['f_est', 'skew_ppm', 'slip_seconds', 'amplitude'], np.nan)
+    result['error'] = ''
+    Fs, y = wav.read(filename)
+    y = activeRegion(y, Fs)
+    if len(y) < Fs / frequency * 10:
+        result['error'] = 'no tone in the capture'
+        return result
+    try:
+        f_est, params = fit_sine(y, Fs, frequency)
+    except (RuntimeError, ValueError) as e: # the fit did not converge
+        result['error'] = str(e)
+        return result
+    result['f_est'] = f_est
+    result['skew_ppm'], result['slip_seconds'] = clock_skew(f_est, frequency)
+    result['amplitude'] = abs(params[0])
+    return result
+
+
+def runSweep(session, points, duration=DURATION, output_dir=OUTPUT_DIR, results_file=RESULTS_FILE, keep_captures=KEEP_CAPTURES,
+             stimuli=None):
+    '''
+    Capture and analyse every (sample_rate, frequency) of points, returns one dict per point (COLUMNS).
+    stimuli is a StimulusCache to send the sines from, they are generated while sent without one.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    rows = []
+    pending = [] # (row, analysis future or None) not written yet, in point order
+
+    with open(results_file, 'w', newline='') as f, \
+         ProcessPoolExecutor(ANALYSIS_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+
+        def finish(row, future):
+            if future is not None:
+                try:
+                    row.update(future.result())
+                except Exception as e: # e.g. a worker died, the capture is still there
+                    row['error'] = repr(e)
+                if not keep_captures:
+                    os.remove(row.pop('file'))
+            row.pop('file', None)
+            writer.writerow(row)
+            f.flush()
+            rows.append(row)
+
+        for k, (rate, frequency) in enumerate(points):
+            filename = os.path.join(output_dir, f'{rate/1000}kHz_{frequency}Hz.wav')
+            row = {'point': k, 'sample_rate': rate, 'frequency': frequency, 'file': filename}
+            print(f"[sweep] point {k + 1}/{len(points)}: {rate} S/s, {frequency} Hz")
+            future = None
+            try:
+                if stimuli is None:
+                    blocks = sine_blocks(rate, frequency, duration)
+                else:
+                    blocks = stimuli.source('sine', rate, frequency, duration, sample_bits=session.sample_bits)
+                stats = session.run(blocks, rate, filename)
+                row.update(samples=stats['samples'], underruns=stats['underruns'], run_seconds=stats['seconds'])
+                future = pool.submit(analyzePoint, filename, frequency) # analysed while the next point is captured
+            except Exception as e:
+                row['error'] = repr(e)
+            pending.append((row, future))
+
+            while pending and (pending[0][1] is None or pending[0][1].done()):
+                finish(*pending.pop(0))
+
+        for row, future in pending:
+            finish(row, future)
+    return rows
+
+
+def printResults(rows):
+    print(f"{'rate':>8} {'freq (Hz)':>10} {'f_est (Hz)':>14} {'skew (ppm)':>11} {'underruns':>10} {'run (s)':>8}  error")
+    for r in rows:
+        print(f"{r['sample_rate']:>8} {r['frequency']:>10} {r.get('f_est', np.nan):>14.4f} {r.get('skew_ppm', np.nan):>+11.3f} "
+              f"{str(r.get('underruns')):>10} {r.get('run_seconds', np.nan):>8.2f}  {r.get('error', '')}")
+
+
+if __name__ == "__main__":
+    if USE_FAKE_DEVICES:
+        from fake_device import FakeADC, getFakeDevices
+        session = LoopbackSession(getFakeDevices(), make_transport=FakeADC.async_transport)
+    else:
+        session = LoopbackSession()
+    rows = runSweep(session, grid(SAMPLE_RATES, FREQUENCIES))
+    printResults(rows)
+    print("results saved as", RESULTS_FILE)
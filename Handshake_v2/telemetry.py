@@ -0,0 +1,140 @@
+'''
+Per-run telemetry of the DAC handshake and the ADC capture.
+
+The send and capture loops time their events with a monotonic clock (time.perf_counter_ns) and
+record them into histograms by name, the unit is the suffix of the name:
+    dac.request_to_write_ns   'S' / 'C' received -> its packets written
+    dac.write_ns              duration of one bulk OUT write
+    dac.write_bytes           bytes per write
+    dac.credits               packets granted per credit message
+    dac.read_timeouts         (counter) 10 ms reads of the DAC's IN endpoint that got nothing
+    adc.buffer_bytes          bytes per ADC buffer (512, 1024, ... up to the transfer size)
+    adc.buffer_gap_ns         time between two ADC buffers
+    adc.put_ns                time the reader waited to hand a buffer to the writer (back-pressure)
+    adc.ring_free             free ring slots when a buffer arrives
+    adc.writer_queue_depth    buffers waiting for the writer after a put
+    adc.read_timeouts         (counter) synchronous ADC reads that got nothing
+A histogram has log-linear buckets like an HDR histogram: exact below 2**SUB_BITS, then
+2**(SUB_BITS-1) buckets per power of two, so any value is known within 1/2**(SUB_BITS-1)
+(1.6%) with a fixed number of buckets. Recording is a few integer operations, cheap enough to
+leave on: a run records about one event per packet. Every name is written by one thread only.
+
+Usage:
+    telemetry = RunTelemetry()
+    runDAC(..., telemetry=telemetry) / runADC(..., telemetry=telemetry)
+    telemetry.dump("output.wav.telemetry.json")   # counters and histograms (count, min, max, mean, percentiles, buckets)
+    telemetry.report()
+'''
+import json
+import time
+
+SUB_BITS = 7
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * ((64 - SUB_BITS + 2) << (SUB_BITS - 1))
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = int(value)
+        if value < 0:
+            value = 0 # clock steps cannot go backwards, sizes cannot be negative
+        shift = value.bit_length() - SUB_BITS
+        if shift <= 0:
+            self.counts[value] += 1
+        else:
+            self.counts[(shift << (SUB_BITS - 1)) + (value >> shift)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @staticmethod
+    def bounds(index):
+        '''[lower, upper) of the values counted in bucket index.'''
+        if index < 1 << SUB_BITS:
+            return index, index + 1
+        shift = (index >> (SUB_BITS - 1)) - 1
+        lower = (index - (shift << (SUB_BITS - 1))) << shift
+        return lower, lower + (1 << shift)
+
+    def percentile(self, p):
+        '''Highest value of the bucket holding the p-th percentile, within min and max.'''
+        if self.count == 0:
+            return None
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(max(self.bounds(index)[1] - 1, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        summary = {'count': self.count, 'min': self.min, 'max': self.max,
+                   'mean': self.total / self.count if self.count else None}
+        for p in PERCENTILES:
+            summary['p%g' % p] = self.percentile(p)
+        summary['buckets'] = [[*self.bounds(index), n] for index, n in enumerate(self.counts) if n] # [lower, upper, count]
+        return summary
+
+
+class RunTelemetry:
+    clock = staticmethod(time.perf_counter_ns)
+
+    def __init__(self):
+        self.started = time.time()
+        self.start = self.clock()
+        self.histograms = {}
+        self.counters = {}
+
+    def record(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(value)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrapConsumer(self, consumer, ring=None, queue=None):
+        '''consumer(data, slot) of captureADC that also records the buffer sizes, gaps, ring and writer queue.'''
+        clock = self.clock
+        last = [None]
+        def put(data, slot=None):
+            now = clock()
+            self.record('adc.buffer_bytes', len(data) * getattr(data, 'itemsize', 1))
+            if last[0] is not None:
+                self.record('adc.buffer_gap_ns', now - last[0])
+            last[0] = now
+            if ring is not None:
+                self.record('adc.ring_free', ring.free.qsize())
+            consumer(data, slot)
+            self.record('adc.put_ns', clock() - now)
+            if queue is not None:
+                self.record('adc.writer_queue_depth', queue.qsize())
+        return put
+
+    def summary(self):
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'seconds': (self.clock() - self.start) / 1e9,
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': {name: self.histograms[name].summary() for name in sorted(self.histograms)}}
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+    def report(self):
+        for name, value in sorted(self.counters.items()):
+            print(f"[telemetry] {name}: {value}")
+        for name in sorted(self.histograms):
+            h = self.histograms[name]
+            print(f"[telemetry] {name}: n={h.count} min={h.min} p50={h.percentile(50)} p99={h.percentile(99)} max={h.max}")
@@ -0,0 +1,53 @@
+'''
+Bulk transfers straight from/into existing buffers.
+
+pyusb's dev.write() copies its argument into a new array.array (element by element for a memoryview)
+and dev.read() allocates a new array for every call. For the libusb1 backend these helpers pass
+the buffer address to libusb_bulk_transfer directly. Other devices (fake_device.py) go through
+dev.write(ep, data) / dev.read(ep, buffer, timeout).
+'''
+from ctypes import POINTER, byref, c_int, c_ubyte, cast
+
+import numpy as np
+from usb.backend import libusb1
+
+
+def _libusb1Backend(dev):
+    backend = getattr(getattr(dev, '_ctx', None), 'backend', None)
+    if backend is None or backend.__class__.__name__ != '_LibUSB':
+        return None
+    return backend
+
+
+def _bulkTransfer(dev, backend, ep, view, timeout):
+    dev._ctx.managed_open()
+    _, ep = dev._ctx.setup_request(dev, ep) # claims the interface like dev.read()/dev.write()
+    buffer = np.frombuffer(view, dtype=np.uint8)
+    transferred = c_int()
+    ret = backend.lib.libusb_bulk_transfer(dev._ctx.handle.handle,
+                                           ep.bEndpointAddress,
+                                           cast(buffer.ctypes.data, POINTER(c_ubyte)),
+                                           len(buffer),
+                                           byref(transferred),
+                                           timeout)
+    # unlike dev.read(), keep what arrived before a timeout
+    if ret == libusb1.LIBUSB_ERROR_TIMEOUT and transferred.value > 0:
+        return transferred.value
+    libusb1._check(ret)
+    return transferred.value
+
+
+def writeView(dev, ep, view, timeout=1000):
+    '''Bulk write from any buffer (bytes, memoryview, NumPy array) without copying it.'''
+    backend = _libusb1Backend(dev)
+    if backend is None:
+        return dev.write(ep, view)
+    return _bulkTransfer(dev, backend, ep, view, timeout)
+
+
+def readView(dev, ep, view, timeout=1000):
+    '''Bulk read into a writable buffer (e.g. a SampleRing slot), returns the number of bytes read.'''
+    backend = _libusb1Backend(dev)
+    if backend is None:
+        return dev.read(ep, view, timeout)
+    return _bulkTransfer(dev, backend, ep, view, timeout)
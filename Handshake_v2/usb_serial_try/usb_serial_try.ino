@@ -40,6 +40,24 @@ volatile int totalWrite = 0;
 
 int coming_size; // coming size from PC, initilze here
 
+// ================= credit flow control ===========
+// PC sends 8 bytes (sampling rate + window) instead of 4 to use credit mode.
+// MCU grants free buffer space as 'C' + number of packets (at most creditWindow),
+// PC writes all granted packets back to back without waiting for an 'S' per packet.
+volatile bool creditMode = false;
+int creditWindow = 1;      // max number of packets granted at a time
+int bytesOutstanding = 0;  // bytes granted to PC but not received yet
+
+volatile uint32_t underrunCount = 0; // timer ticks with an empty buffer, reported after 'E'
+
+// ================= packed sample format ===========
+// In credit mode PC may send 12 bytes (sampling rate + window + sample bits): every sample is then
+// only the top sampleBits bits, MSB first as one continuous bit stream (12 bits: 2 samples in 3 bytes).
+// The timer unpacks them again, the low bits of the DAC word are zero.
+volatile int sampleBits = 16;
+uint32_t unpackAcc = 0;  // bits read from byte_buffer but not played yet, in the low unpackBits bits
+int unpackBits = 0;
+
 // =============== Test LED def ===========
 #define LED 2
 #define LED2 3
@@ -109,6 +127,46 @@ void loop() {
       receiveSample = true;
 
     }
+    //wait for samplingrate + credit window (+ sample bits)
+    else if (usb_serial_available() == 8 || usb_serial_available() == 12){
+      uint8_t header[12];
+      int headerSize = usb_serial_available();
+      usb_serial_read(header, headerSize);
+
+      uint32_t sampleRate = (uint32_t) header[0] | (uint32_t) header[1] <<8 | (uint32_t) header[2] <<16 | (uint32_t) header[3] <<24;
+      uint32_t window = (uint32_t) header[4] | (uint32_t) header[5] <<8 | (uint32_t) header[6] <<16 | (uint32_t) header[7] <<24;
+      sampleBits = 16;
+      if (headerSize == 12){
+        uint32_t bits = (uint32_t) header[8] | (uint32_t) header[9] <<8 | (uint32_t) header[10] <<16 | (uint32_t) header[11] <<24;
+        if (bits >= 8 && bits < 16){
+          sampleBits = bits;
+        }
+      }
+      unpackAcc = 0;
+      unpackBits = 0;
+      samplingRate = (float)sampleRate;
+      periodMicros = 1e6/samplingRate;
+
+      digitalWrite(LED, HIGH); //inidicate it has sampling rate 
+      HWSERIAL.println("SR (credit mode):");
+      HWSERIAL.println(sampleRate);
+      HWSERIAL.println(window);
+      HWSERIAL.println(sampleBits);
+
+      //clean buffer on MCU side
+      nextRead = 0; 
+      nextWrite = 0;
+      buffer_size = 0;
+      underrunCount = 0;
+
+      creditWindow = constrain(window, 1, 255); // grant count is sent in one byte
+      bytesOutstanding = 0;
+      creditMode = true;
+      receiveSample = true;
+    }
+  }else if (creditMode == true && receiveSample == true){
+    creditService();
+
   }else if (receiveSample == true && timerStart == false){
     //timer is not working so buffer_size is only incrementing
 
@@ -268,19 +326,74 @@ void loop() {
 
       totalWrite = 0; //reset totalRead
 
-      uint8_t ACK = 'E';
-      usb_serial_write(&ACK, 1);
+      uint8_t ACK[5] = {'E',
+                        (uint8_t)(underrunCount), (uint8_t)(underrunCount >>8),
+                        (uint8_t)(underrunCount >>16), (uint8_t)(underrunCount >>24)};
+      usb_serial_write(ACK, 5);
+      usb_serial_flush_output();
+      underrunCount = 0;
 
       // **** reset all flags *****
       timerStart = false;
       receiveSample = false;
       end_of_file = false;
+      creditMode = false;
+      sampleBits = 16;
     }
     
   }
   
 }
 
+void creditService(){
+  //========= step 1: move everything that has arrived into the ring buffer =========
+  int available = usb_serial_available();
+  while (available > 0){
+    // nextWrite stays a multiple of PACKET_SIZE until the tail, so this never splits a packet
+    int count = usb_serial_read(&byte_buffer[nextWrite], min(available, MAX_BUFFER_SIZE - nextWrite));
+    nextWrite = (nextWrite + count) % MAX_BUFFER_SIZE;
+    noInterrupts();
+    buffer_size += count;
+    interrupts();
+    totalWrite += count;
+    bytesOutstanding -= count;
+
+    if (count % PACKET_SIZE != 0){ // only the tail is shorter than PACKET_SIZE
+      digitalWrite(LED2, LOW); //recive end_of_file signal
+      end_of_file = true;
+      receiveSample = false;
+      break;
+    }
+    available = usb_serial_available();
+  }
+
+  //========= step 2: start timer once half of the buffer is filled =========
+  if (timerStart == false && (buffer_size >= HLAF_MAX_BUFFER_SIZE || end_of_file == true)){
+    timerStart = true;
+    timer.begin(timerCallback, periodMicros);
+    digitalWrite(LED_RED, HIGH); // indication for timer start
+  }
+  if (end_of_file == true){
+    return;
+  }
+
+  //========= step 3: grant free space to PC =========
+  // keep one packet free so a full buffer never looks empty (nextRead == nextWrite)
+  noInterrupts();
+  int used = buffer_size;
+  interrupts();
+  int freePackets = (MAX_BUFFER_SIZE - PACKET_SIZE - used - bytesOutstanding) / PACKET_SIZE;
+  int credits = min(freePackets, creditWindow - bytesOutstanding / PACKET_SIZE);
+
+  // grant at least half a window at a time, so PC is not flooded with tiny grants
+  if (credits > 0 && credits >= (creditWindow + 1) / 2){
+    uint8_t grant[2] = {'C', (uint8_t)credits};
+    usb_serial_write(grant, 2);
+    usb_serial_flush_output();
+    bytesOutstanding += credits * PACKET_SIZE;
+  }
+}
+
 void timerCallback() {
   // uint8_t low_byte = byte_buffer[nextRead];
   // uint8_t high_byte = byte_buffer[nextRead];
@@ -292,12 +405,35 @@ void timerCallback() {
     HWSERIAL.println("Finish DAC: ");
     HWSERIAL.println(totalRead);
   }
+  else if (nextRead == nextWrite){
+    // buffer is empty but PC has not finished sending: hold the last output
+    underrunCount++;
+  }
   else{
-    uint16_t value = *(uint16_t*)&byte_buffer[nextRead];
+    uint16_t value;
+    if (sampleBits == 16){
+      value = *(uint16_t*)&byte_buffer[nextRead];
 
-    nextRead = (nextRead+2) % MAX_BUFFER_SIZE;
-    totalRead += 2;
-    buffer_size = buffer_size -2;
+      nextRead = (nextRead+2) % MAX_BUFFER_SIZE;
+      totalRead += 2;
+      buffer_size = buffer_size -2;
+    }
+    else{
+      // pull bytes into the bit stream until it holds a whole sample
+      while (unpackBits < sampleBits && nextRead != nextWrite){
+        unpackAcc = (unpackAcc << 8) | byte_buffer[nextRead];
+        unpackBits += 8;
+        nextRead = (nextRead+1) % MAX_BUFFER_SIZE;
+        totalRead += 1;
+        buffer_size = buffer_size -1;
+      }
+      if (unpackBits < sampleBits){ // the rest of this sample has not arrived yet
+        underrunCount++;
+        return;
+      }
+      unpackBits -= sampleBits;
+      value = (uint16_t)(((unpackAcc >> unpackBits) & ((1u << sampleBits) - 1)) << (16 - sampleBits));
+    }
     
     // Transmit SPI data
     digitalWrite(chipSelectPin, LOW);
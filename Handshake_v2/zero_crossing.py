@@ -0,0 +1,220 @@
+'''
+Rising zero crossings of long captures at constant memory, with sub-sample times and hysteresis.
+
+cal_sin in drift_check.py used np.where((Y[:-1] < 0) & (Y[1:] >= 0)) on the whole normalized file:
+integer sample times and several float64 copies of it. Here the samples are read chunk by chunk
+(a memory-mapped WAV is never loaded) and compared in their own dtype, and only the crossings,
+a few per period, are handled as arrays:
+
+- the signal is cut into segments at every crossing of `level`, each one below or above it
+- with hysteresis h, a rising crossing counts only if the signal has been below level - h since
+  the last counted one and rises above level + h before it falls below level again (Schmitt trigger),
+  so noise around the level gives one crossing per period instead of a burst
+- its time is interpolated between the two samples around it (linear), or is the root of the
+  cubic through the four samples around it (cubic)
+
+The ongoing segment and the last 3 samples of a chunk are carried to the next one, so crossings
+across chunk boundaries are found exactly like the others; finish() looks for the ones in the last
+samples of the signal. Between the first two and the last two samples the cubic lacks a sample on one
+side and linear is used instead.
+Times are in samples from the first one.
+
+Usage:
+    stats = wav_period_stats("output.wav", hysteresis=0.01)  # level and hysteresis in full scale units
+    print(stats['frequency'], stats['period_std'])
+    for times in rising_crossings(y, hysteresis=300, interpolation='cubic'):  # per chunk
+        ...
+'''
+import numpy as np
+import scipy.io.wavfile as wav
+
+CHUNK_SAMPLES = 1 << 20
+TAIL = 3        # samples kept from the previous chunk: the cubic needs 1 before and 2 after a crossing
+NEWTON_STEPS = 4
+
+
+def _threshold(value, dtype, rounding=np.ceil):
+    # value in the samples' own dtype, so comparisons do not convert the chunk. For integer samples
+    # y >= v and y < v are y >= ceil(v) and y < ceil(v), y > v and y <= v are y > floor(v) and y <= floor(v)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return dtype.type(np.clip(rounding(value), info.min, info.max))
+    return dtype.type(value)
+
+
+class ZeroCrossingDetector:
+    '''
+    Usage:
+        detector = ZeroCrossingDetector(level=0, hysteresis=300, interpolation='linear')
+        times = detector.update(chunk)   # rising crossings completed by this chunk, in samples from the first one
+        times = detector.finish()        # after the last chunk
+    '''
+    def __init__(self, level=0, hysteresis=0, interpolation='linear'):
+        if interpolation not in ('linear', 'cubic'):
+            raise ValueError("interpolation must be 'linear' or 'cubic'")
+        self.level = level
+        self.hysteresis = hysteresis
+        self.interpolation = interpolation
+        self.thresholds = None
+        self.tail = None        # last TAIL samples of the previous chunk
+        self.position = 0       # index of the first sample of the next chunk
+        # ongoing segment: side (True above), start time, whether it went beyond level -+ hysteresis
+        self.above = None
+        self.start = np.nan
+        self.beyond = False
+        self.armed = False      # below level - hysteresis since the last counted crossing
+
+    def update(self, samples):
+        samples = np.asarray(samples)
+        if self.thresholds is None:
+            self.thresholds = (_threshold(self.level, samples.dtype), _threshold(self.level - self.hysteresis, samples.dtype),
+                               _threshold(self.level + self.hysteresis, samples.dtype, np.floor))
+        if self.tail is not None:
+            samples = np.concatenate((self.tail, samples))
+        base = self.position - (0 if self.tail is None else len(self.tail)) # index of samples[0]
+        self.position = base + len(samples)
+        self.tail = samples[-TAIL:]
+        if len(samples) < TAIL + 1:
+            return np.empty(0)
+        # crossings near the end are found again in the next chunk
+        return self._scan(samples, base, len(samples) - TAIL)
+
+    def finish(self):
+        '''The crossings in the last samples of the signal and the one that starts the last segment, if they count.'''
+        if self.tail is None or len(self.tail) < 2:
+            return np.empty(0)
+        crossings = self._scan(self.tail, self.position - len(self.tail), len(self.tail) - 2)
+        crossings = np.concatenate((crossings, self._count(np.array([self.above]), np.array([self.beyond]), np.array([self.start]), 0)))
+        self.tail = None
+        self.start = np.nan
+        return crossings
+
+    def _scan(self, samples, base, last):
+        # rising crossings completed by samples[0] = sample `base`, between p and p + 1 for 1 <= p <= last
+        level, low, high = self.thresholds
+        side = samples >= level
+        first = 1 # p = 0 is in the tail of the previous chunk
+        if self.above is None: # first chunk, segment 0 is sample 0
+            first = 0
+            self.above = bool(side[0])
+            self.beyond = bool(samples[0] > high if self.above else samples[0] < low)
+        p = np.flatnonzero(side[1:] != side[:-1])
+        p = p[(p >= first) & (p <= last)]
+        # segment k (0: the ongoing one carried over) ends at sample p[k], the last one goes on
+        ends = np.append(p, len(samples) - 1)
+        num = len(ends)
+
+        # with hysteresis, the segments in which the signal passes level - h (below) or level + h (above)
+        above = np.empty(num, bool)
+        above[0] = self.above
+        above[1:] = side[p + 1]
+        if self.hysteresis > 0:
+            went_under = np.zeros(num, bool)
+            went_over = np.zeros(num, bool)
+            went_under[np.searchsorted(ends, np.flatnonzero((samples[:-1] >= low) & (samples[1:] < low)) + 1)] = True
+            went_over[np.searchsorted(ends, np.flatnonzero((samples[:-1] <= high) & (samples[1:] > high)) + 1)] = True
+            beyond = np.where(above, went_over, went_under)
+            beyond[0] |= self.beyond
+        else: # every crossing counts
+            beyond = np.ones(num, bool)
+
+        times = np.empty(num)
+        times[0] = self.start
+        times[1:] = base + p + self._fraction(samples, p)
+
+        return self._count(above, beyond, times, 1)
+
+    def _count(self, above, beyond, times, ongoing):
+        # Schmitt trigger over the segments, the last `ongoing` ones are carried to the next chunk
+        num = len(above)
+        counted = np.zeros(num, bool)
+        armed = self.armed
+        decided = np.flatnonzero(beyond[:num - ongoing])
+        if len(decided):
+            low_segments = ~above[decided]
+            # armed before a decided segment: the previous decided segment was a low one
+            before = np.empty(len(decided), bool)
+            before[0] = armed
+            before[1:] = low_segments[:-1]
+            counted[decided] = above[decided] & before
+            armed = bool(low_segments[-1])
+        self.armed = armed
+        self.above = bool(above[-1])
+        self.start = times[-1]
+        self.beyond = bool(beyond[-1])
+        crossings = times[counted]
+        return crossings[~np.isnan(crossings)]
+
+    def _fraction(self, samples, p):
+        # position of the crossing between samples p and p + 1, from samples p
+        level = self.level
+        y0 = samples[p].astype(np.float64) - level
+        y1 = samples[p + 1].astype(np.float64) - level
+        t = -y0 / (y1 - y0)
+        if self.interpolation == 'cubic':
+            linear = t
+            inside = (p >= 1) & (p + 2 < len(samples)) # a sample before p and after p + 1, else linear
+            ym = samples[np.maximum(p - 1, 0)].astype(np.float64) - level
+            y2 = samples[np.minimum(p + 2, len(samples) - 1)].astype(np.float64) - level
+            # Lagrange cubic through x = -1, 0, 1, 2, Newton from the linear guess
+            c1 = -ym/3 - y0/2 + y1 - y2/6
+            c2 = (ym + y1)/2 - y0
+            c3 = (y2 - ym)/6 + (y0 - y1)/2
+            for _ in range(NEWTON_STEPS):
+                value = y0 + t*(c1 + t*(c2 + t*c3))
+                slope = c1 + t*(2*c2 + 3*t*c3)
+                t = np.clip(t - value / np.where(slope > 0, slope, np.inf), 0, 1)
+            t = np.where(inside, t, linear)
+        return t
+
+
+def rising_crossings(y, level=0, hysteresis=0, interpolation='linear', chunk_samples=CHUNK_SAMPLES):
+    '''Rising crossing times (samples from y[0]) of an array or memory map, one array per chunk.'''
+    detector = ZeroCrossingDetector(level, hysteresis, interpolation)
+    for start in range(0, len(y), chunk_samples):
+        yield detector.update(y[start:start + chunk_samples])
+    yield detector.finish()
+
+
+def period_stats(y, Fs, level=0, hysteresis=0, interpolation='linear', chunk_samples=CHUNK_SAMPLES):
+    '''
+    Mean frequency and the spread of the periods between rising crossings, at constant memory.
+    Returns a dict: crossings, frequency (Hz), period, period_std, min_period, max_period (s).
+    '''
+    count = 0
+    first = last = None
+    num_periods, mean, M2 = 0, 0.0, 0.0 # running mean and squared deviations of the periods (Chan et al.)
+    shortest, longest = np.inf, -np.inf
+    for times in rising_crossings(y, level, hysteresis, interpolation, chunk_samples):
+        if len(times) == 0:
+            continue
+        if first is None:
+            first = times[0]
+        periods = np.diff(times if last is None else np.concatenate(([last], times)))
+        last = times[-1]
+        count += len(times)
+        if len(periods) == 0:
+            continue
+        batch_mean = periods.mean()
+        total = num_periods + len(periods)
+        delta = batch_mean - mean
+        M2 += ((periods - batch_mean)**2).sum() + delta**2 * num_periods * len(periods) / total
+        mean += delta * len(periods) / total
+        num_periods = total
+        shortest, longest = min(shortest, periods.min()), max(longest, periods.max())
+
+    stats = {'crossings': count, 'frequency': np.nan, 'period': np.nan, 'period_std': np.nan,
+             'min_period': np.nan, 'max_period': np.nan}
+    if count > 1:
+        stats['period'] = (last - first) / (count - 1) / Fs
+        stats['frequency'] = 1 / stats['period']
+        stats['period_std'] = np.sqrt(M2 / num_periods) / Fs
+        stats['min_period'], stats['max_period'] = shortest / Fs, longest / Fs
+    return stats
+
+
+def wav_period_stats(filename, level=0, hysteresis=0, interpolation='linear', chunk_samples=CHUNK_SAMPLES):
+    '''period_stats of a memory-mapped WAV file, level and hysteresis in full scale units (samples / dtype max).'''
+    Fs, y = wav.read(filename, mmap=True)
+    scale = np.iinfo(y.dtype).max if np.issubdtype(y.dtype, np.integer) else 1
+    return period_stats(y, Fs, level * scale, hysteresis * scale, interpolation, chunk_samples)
@@ -1,23 +1,11 @@
-import numpy as np
 import matplotlib.pyplot as plt
-from scipy.io import wavfile as wav
+import numpy as np
 
-Fs, Y = wav.read("output.wav")
-Y = Y.astype(np.uint16)
-print(Y)
-# Fs = 100000
-Y = (Y / 65535.0)  *5
+from lod_viewer import LodViewer
 
-# Y = Y[0:100]
-# 
-time = np.arange(len(Y)) / Fs
+# The whole capture is memory-mapped and only what is visible is drawn: a min/max envelope
+# (cached next to the file as .lod.npy) or, once zoomed in, every sample. ADC_pyusb.py writes the
+# unsigned ADC samples as they are, so they are viewed as uint16.
+viewer = LodViewer("output.wav", dtype=np.uint16)
 
-plt.figure(figsize=(10, 4))
-plt.plot(time, Y, label="Audio Signal")
-plt.scatter(time, Y, label="Audio Signal Pt")
-plt.xlabel("Time (seconds)")
-plt.ylabel("Amplitude")
-plt.title(f"Waveform (Sampling Rate: {Fs} Hz)")
-plt.legend()
-plt.grid()
 plt.show()
@@ -0,0 +1,175 @@
+'''
+Interactive plot of captures of any length (impulse_wav_visualize.py).
+
+The one copy of this module, at the top of the repository: the scripts in Handshake_v1 and
+Handshake_v2 put this directory on sys.path to import it.
+
+The WAV file is memory-mapped, nothing is loaded up front. A pyramid of min/max envelopes is
+built once and saved next to the capture (output.wav -> output.wav.lod.npy): level 1 is the min
+and max of every LEVEL_FACTOR samples, level k+1 the min and max of LEVEL_FACTOR buckets of level k,
+up to about MAX_BUCKETS buckets for the whole file. It is rebuilt when the capture is newer.
+After every zoom or pan, only what is visible is drawn: the coarsest level that still has
+MAX_BUCKETS buckets across the axes, merged down to at most MAX_BUCKETS columns and filled between
+min and max (so no peak disappears), or the samples themselves once at most RAW_SAMPLES are visible
+(with markers below MARKER_SAMPLES).
+
+Usage:
+    viewer = LodViewer("output.wav")
+    plt.show()
+    t, low, high, level = viewer.envelope(0, 180000) # what is drawn for the first 180000 samples (level 0 = samples)
+    viewer = LodViewer("output.wav", dtype=np.uint16) # samples of the old ADC_pyusb.py, unsigned in an int16 WAV
+'''
+import os
+import tempfile
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.io import wavfile as wav
+
+LEVEL_FACTOR = 16
+MAX_BUCKETS = 2000      # about the number of pixels across the plot
+RAW_SAMPLES = 10000     # below this many visible samples they are drawn one by one
+MARKER_SAMPLES = 2000
+CHUNK_SAMPLES = LEVEL_FACTOR << 18
+VOLTS_PER_STEP = 5 / 65535.0 # as impulse_wav_visualize.py always scaled the samples
+
+
+def _level_sizes(num_samples):
+    # buckets of every level
+    sizes = []
+    size = num_samples
+    while size > MAX_BUCKETS or not sizes:
+        size = -(-size // LEVEL_FACTOR)
+        sizes.append(size)
+    return sizes
+
+
+def _samples(filename, dtype=None):
+    Fs, y = wav.read(filename, mmap=True)
+    if dtype is not None:
+        y = y.view(dtype) # same size, still memory-mapped
+    if y.ndim > 1:
+        y = y[:, 0] # first channel
+    return Fs, y
+
+
+def build_pyramid(filename, pyramid_path=None, dtype=None):
+    '''Compute the min/max pyramid of a WAV file chunk by chunk and save it to pyramid_path (.npy).'''
+    pyramid_path = pyramid_path or filename + '.lod.npy'
+    _, y = _samples(filename, dtype)
+    sizes = _level_sizes(len(y))
+    directory = os.path.dirname(os.path.abspath(pyramid_path))
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp', delete=False) as f:
+        name = f.name
+    try:
+        # row 0 the minima, row 1 the maxima, the levels one after the other
+        pyramid = np.lib.format.open_memmap(name, mode='w+', dtype=y.dtype, shape=(2, sum(sizes)))
+        for start in range(0, len(y), CHUNK_SAMPLES):
+            chunk = np.asarray(y[start:start + CHUNK_SAMPLES])
+            first = start // LEVEL_FACTOR
+            buckets = np.arange(0, len(chunk), LEVEL_FACTOR)
+            pyramid[0, first:first + len(buckets)] = np.minimum.reduceat(chunk, buckets)
+            pyramid[1, first:first + len(buckets)] = np.maximum.reduceat(chunk, buckets)
+        offset = 0
+        for size, next_size in zip(sizes, sizes[1:]):
+            level = pyramid[:, offset:offset + size]
+            buckets = np.arange(0, size, LEVEL_FACTOR)
+            pyramid[0, offset + size:offset + size + next_size] = np.minimum.reduceat(level[0], buckets)
+            pyramid[1, offset + size:offset + size + next_size] = np.maximum.reduceat(level[1], buckets)
+            offset += size
+        pyramid.flush()
+        del pyramid
+        os.replace(name, pyramid_path)
+    except BaseException:
+        os.remove(name)
+        raise
+    return pyramid_path
+
+
+def load_pyramid(filename, dtype=None):
+    '''
+    (Fs, samples, levels) of a WAV file, all memory-mapped, the samples viewed as dtype if given.
+    levels[k] is the (2, buckets) min/max envelope of LEVEL_FACTOR**(k+1) samples per bucket.
+    The pyramid is built if missing, older than the file or of another dtype.
+    '''
+    Fs, y = _samples(filename, dtype)
+    sizes = _level_sizes(len(y))
+    pyramid_path = filename + '.lod.npy'
+    pyramid = None
+    if os.path.exists(pyramid_path) and os.path.getmtime(pyramid_path) >= os.path.getmtime(filename):
+        pyramid = np.load(pyramid_path, mmap_mode='r')
+        if pyramid.shape != (2, sum(sizes)) or pyramid.dtype != y.dtype:
+            pyramid = None
+    if pyramid is None:
+        pyramid = np.load(build_pyramid(filename, pyramid_path, dtype), mmap_mode='r')
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    return Fs, y, [pyramid[:, offsets[k]:offsets[k + 1]] for k in range(len(sizes))]
+
+
+class LodViewer:
+    '''The plot of impulse_wav_visualize.py for any capture length, redrawn for every zoom / pan.'''
+    def __init__(self, filename, ax=None, scale=VOLTS_PER_STEP, dtype=None):
+        self.Fs, self.samples, self.levels = load_pyramid(filename, dtype)
+        self.scale = scale
+        if ax is None:
+            plt.figure(figsize=(10, 4))
+            ax = plt.gca()
+        self.ax = ax
+        (self.line,) = ax.plot([], [], label="Audio Signal")
+        # one polygon renders far faster than thousands of vertical strokes
+        self.fill = ax.fill_between([], [], [], color=self.line.get_color())
+        ax.set_xlabel("Time (seconds)")
+        ax.set_ylabel("Amplitude")
+        ax.set_title(f"Waveform (Sampling Rate: {self.Fs} Hz)")
+        ax.legend()
+        ax.grid()
+
+        duration = max(len(self.samples), 1) / self.Fs
+        top = self.levels[-1]
+        low, high = float(top[0].min(initial=0)) * scale, float(top[1].max(initial=0)) * scale
+        margin = 0.05 * (high - low) or 1.0
+        ax.set_xlim(0, duration)
+        ax.set_ylim(low - margin, high + margin)
+        ax.callbacks.connect('xlim_changed', self._redraw)
+        self._redraw(ax)
+
+    def envelope(self, start, stop):
+        '''
+        (times, low, high, level) drawn for samples[start:stop]: the samples themselves (level 0,
+        low is high), or min and max of every column at its start time, a column being one or more
+        buckets of level k.
+        '''
+        start, stop = max(int(start), 0), min(int(stop), len(self.samples))
+        if stop <= start:
+            return np.zeros(0), np.zeros(0), np.zeros(0), 0
+        if stop - start <= RAW_SAMPLES:
+            t = np.arange(start, stop) / self.Fs
+            y = self.samples[start:stop] * self.scale
+            return t, y, y, 0
+        # the coarsest level with at least MAX_BUCKETS buckets in view
+        level = 1
+        while level < len(self.levels) and (stop - start) // LEVEL_FACTOR ** (level + 1) >= MAX_BUCKETS:
+            level += 1
+        bucket = LEVEL_FACTOR ** level
+        first, last = start // bucket, -(-stop // bucket)
+        # columns of `group` buckets, aligned on multiples of group so they do not change while panning
+        group = -(-(last - first) // MAX_BUCKETS)
+        first = first // group * group
+        minmax = self.levels[level - 1][:, first:last]
+        columns = np.arange(0, minmax.shape[1], group)
+        low = np.minimum.reduceat(minmax[0], columns) if group > 1 else minmax[0]
+        high = np.maximum.reduceat(minmax[1], columns) if group > 1 else minmax[1]
+        t = (first + columns) * bucket / self.Fs
+        return t, low * self.scale, high * self.scale, level
+
+    def _redraw(self, ax):
+        left, right = ax.get_xlim()
+        t, low, high, level = self.envelope(np.floor(left * self.Fs), np.ceil(right * self.Fs) + 1)
+        if level == 0:
+            self.line.set_data(t, high)
+            self.line.set_marker('o' if len(t) <= MARKER_SAMPLES else 'None')
+            self.fill.set_verts([])
+        else:
+            self.line.set_data([], [])
+            self.fill.set_verts([np.column_stack((np.concatenate((t, t[::-1])), np.concatenate((high, low[::-1]))))])
+        ax.figure.canvas.draw_idle()